@@ -0,0 +1,470 @@
+"""ローカルの擬似 Podcast ホストを相手に、フィード巡回の性能を計測する.
+
+使い方:
+    python -m benchmarks.crawl [--feeds 2000] [--rounds 2] [--driver poll_feeds]
+
+Note:
+    別プロセスで HTTP サーバーを起動し、合成したフィードとチャンネル画像を配信する.
+    フィードごとにエピソード数・応答遅延・条件付き GET への対応・エラーの種類を変え、
+    poll_feeds コマンド(または get_feed の逐次呼び出し)で全フィードを巡回する.
+    巡回ごとにスループット、フィードあたりの処理時間(p50/p99)、クエリ数、
+    最大メモリ使用量(RSS)を出力する.
+    1 回目は全エピソードの新規登録、2 回目以降は 304 や差分登録の計測となる.
+
+    テスト用データベースを新たに作成し、画像は一時ディレクトリに保存するため、
+    既存のデータベース・ストレージやネットワークには触れない.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from socketserver import ThreadingMixIn
+
+import django
+
+# フィードの種類と出現比率
+#   ok: ETag / Last-Modified を返し、変更がなければ 304 を返す
+#   no_validators: 毎回同じ内容を 200 で返す
+#   growing: リクエストのたびにエピソードが 1 件増える
+#   invalid: フィードではない HTML を返す
+#   error: 500 を返す
+#   not_found: 404 を返す
+#   timeout: 読み込みタイムアウトより長く応答しない
+KINDS = (
+    ('ok', 60),
+    ('no_validators', 15),
+    ('growing', 15),
+    ('invalid', 3),
+    ('error', 3),
+    ('not_found', 2),
+    ('timeout', 2),
+)
+
+# エピソード数と出現比率. 大きなバックカタログを持つフィードは少数
+SIZES = ((5, 30), (20, 35), (100, 25), (500, 8), (2000, 2))
+
+# チャンネル画像を持つフィードの割合
+IMAGE_RATIO = 0.8
+
+
+def make_profiles(num_feeds, seed, max_latency):
+    """フィードごとの設定を作る.
+
+    Arguments:
+        num_feeds(int) -- フィード数
+        seed(int) -- 乱数のシード
+        max_latency(float) -- 応答遅延の最大秒数
+    Return:
+        profiles(list) -- フィードごとの設定
+    """
+    rnd = random.Random(seed)
+    kinds, kind_weights = zip(*KINDS)
+    sizes, size_weights = zip(*SIZES)
+    profiles = []
+    for i in range(num_feeds):
+        # 遅延は大半が小さく、一部が大きい分布にする
+        latency = min(rnd.expovariate(1 / (max_latency / 10)), max_latency)
+        profiles.append({
+            'kind': rnd.choices(kinds, kind_weights)[0],
+            'episodes': rnd.choices(sizes, size_weights)[0],
+            'latency': latency,
+            'image': rnd.random() < IMAGE_RATIO,
+        })
+    return profiles
+
+
+def make_feed(index, profile, count, base_url):
+    """フィードの RSS を作る.
+
+    Arguments:
+        index(int) -- フィード番号
+        profile(dict) -- フィードの設定
+        count(int) -- エピソード数
+        base_url(str) -- サーバーの URL
+    Return:
+        body(bytes) -- RSS
+    """
+    out = []
+    out.append(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" '
+        'xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">\n'
+        '<channel>\n'
+        '<title>bench channel %d</title>\n'
+        '<link>%s/channels/%d</link>\n'
+        '<description>benchmark channel %d</description>\n'
+        '<itunes:author>bench</itunes:author>\n' % (index, base_url, index, index))
+    if profile['image']:
+        out.append('<itunes:image href="%s/images/%d.png"/>\n' % (
+            base_url, index))
+    # 新しい順に並べる
+    for ep in range(count - 1, -1, -1):
+        published = formatdate(1500000000 + ep * 86400, usegmt=True)
+        out.append(
+            '<item>\n'
+            '<title>episode %d</title>\n'
+            '<link>%s/channels/%d/%d</link>\n'
+            '<description>show notes for **episode %d**\n\n'
+            '- topic one\n- topic two\n- [link](https://example.com/%d)'
+            '</description>\n'
+            '<pubDate>%s</pubDate>\n'
+            '<itunes:duration>%d:%02d</itunes:duration>\n'
+            '<enclosure url="%s/audio/%d/%d.mp3" type="audio/mpeg" '
+            'length="1"/>\n'
+            '</item>\n' % (ep, base_url, index, ep, ep, ep, published,
+                           30 + ep % 30, ep % 60, base_url, index, ep))
+    out.append('</channel>\n</rss>\n')
+    return ''.join(out).encode('utf-8')
+
+
+def make_image(index, size):
+    """チャンネル画像の PNG を作る."""
+    from PIL import Image
+
+    rnd = random.Random(index)
+    color = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+    out = BytesIO()
+    Image.new('RGB', (size, size), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+class FakeHostServer(ThreadingMixIn, HTTPServer):
+    """擬似 Podcast ホスト. リクエストごとにスレッドで応答する."""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, profiles, image_size, hang):
+        super().__init__(address, FakeHostHandler)
+        self.profiles = profiles
+        self.image_size = image_size
+        self.hang = hang
+        self.base_url = 'http://%s:%d' % self.server_address[:2]
+        self.lock = threading.Lock()
+        # growing フィードのリクエスト回数
+        self.hits = {}
+        self.cache = {}
+
+    def get_cached(self, key, build):
+        """生成済のレスポンスボディを返す."""
+        with self.lock:
+            body = self.cache.get(key)
+        if body is None:
+            body = build()
+            with self.lock:
+                self.cache[key] = body
+        return body
+
+
+class FakeHostHandler(BaseHTTPRequestHandler):
+    """フィードと画像を返す."""
+    # 接続を使い回せるよう keep-alive に対応する
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        try:
+            index = int(os.path.splitext(parts[1])[0])
+            profile = self.server.profiles[index]
+        except (IndexError, ValueError):
+            return self.send_body(404, b'not found')
+
+        if parts[0] == 'feeds':
+            time.sleep(profile['latency'])
+            return self.send_feed(index, profile)
+        if parts[0] == 'images' and profile['image']:
+            return self.send_image(index)
+        return self.send_body(404, b'not found')
+
+    def send_feed(self, index, profile):
+        kind = profile['kind']
+        if kind == 'timeout':
+            time.sleep(self.server.hang)
+            return self.send_body(200, b'')
+        if kind == 'error':
+            return self.send_body(500, b'internal server error')
+        if kind == 'not_found':
+            return self.send_body(404, b'not found')
+        if kind == 'invalid':
+            return self.send_body(
+                200, b'<html><body>not a feed</body></html>', 'text/html')
+
+        count = profile['episodes']
+        if kind == 'growing':
+            with self.server.lock:
+                hits = self.server.hits.get(index, 0)
+                self.server.hits[index] = hits + 1
+            count += hits
+
+        headers = {}
+        if kind == 'ok':
+            etag = '"%d-%d"' % (index, count)
+            if self.headers.get('If-None-Match') == etag:
+                return self.send_body(304, b'', headers={'ETag': etag})
+            headers['ETag'] = etag
+            headers['Last-Modified'] = formatdate(1500000000 + count * 86400,
+                                                  usegmt=True)
+        body = self.server.get_cached(
+            ('feed', index, count),
+            lambda: make_feed(index, profile, count, self.server.base_url))
+        return self.send_body(200, body, 'application/rss+xml', headers)
+
+    def send_image(self, index):
+        etag = '"img-%d"' % index
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(304, b'', headers={'ETag': etag})
+        body = self.server.get_cached(
+            ('image', index),
+            lambda: make_image(index, self.server.image_size))
+        return self.send_body(200, body, 'image/png', {'ETag': etag})
+
+    def send_body(self, status, body, content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def serve(profiles, image_size, hang, conn):
+    """擬似ホストを起動し、URL を conn に送る. 別プロセスで実行する."""
+    server = FakeHostServer(('127.0.0.1', 0), profiles, image_size, hang)
+    conn.send(server.base_url)
+    server.serve_forever()
+
+
+class QueryCounter:
+    """全スレッドの DB 接続で実行されたクエリ数を数える."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        """接続にクエリ数の計測を設定する. connection_created から呼ばれる."""
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class FeedTimer:
+    """フィードごとの取得・登録の処理時間を記録する."""
+
+    def __init__(self, utils):
+        self.utils = utils
+        self.fetch_feed = utils.fetch_feed
+        self.store_feed = utils.store_feed
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, feed_url, elapsed):
+        with self._lock:
+            self.timings[feed_url] = self.timings.get(feed_url, 0) + elapsed
+
+    def timed(self, function, position):
+        """position 番目の引数を Feed URL として処理時間を記録する."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(args[position], time.perf_counter() - start)
+        return wrapper
+
+    def __enter__(self):
+        self.timings = {}
+        self.utils.fetch_feed = self.timed(self.fetch_feed, 0)
+        self.utils.store_feed = self.timed(self.store_feed, 1)
+        return self
+
+    def __exit__(self, *exc):
+        self.utils.fetch_feed = self.fetch_feed
+        self.utils.store_feed = self.store_feed
+
+
+def percentile(values, pct):
+    """values の pct パーセンタイルを返す."""
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss():
+    """プロセスの最大 RSS (MB) を返す."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux は KB 単位
+    if sys.platform == 'darwin':
+        return usage / 1024 / 1024
+    return usage / 1024
+
+
+def seed_channels(base_url, num_feeds):
+    """巡回対象のチャンネルを登録する."""
+    from feed.models import Channel
+
+    Channel.objects.bulk_create([
+        Channel(feed_url='%s/feeds/%d.rss' % (base_url, i))
+        for i in range(num_feeds)
+    ], batch_size=500)
+
+
+def run_round(args, timer, counter):
+    """全フィードを 1 回巡回し、計測結果を返す."""
+    from django.core.management import call_command
+    from django.db.models import Count
+    from django.utils import timezone
+
+    from feed import utils
+    from feed.models import Channel, Episode, PollLog
+
+    started = timezone.now()
+    queries = counter.count
+    with timer:
+        start = time.perf_counter()
+        if args.driver == 'poll_feeds':
+            call_command('poll_feeds', workers=args.workers,
+                         per_host=args.per_host, db_workers=args.db_workers,
+                         timeout=args.timeout)
+        else:
+            for feed_url in Channel.objects.values_list('feed_url', flat=True):
+                utils.get_feed(feed_url)
+        wall = time.perf_counter() - start
+    queries = counter.count - queries
+
+    statuses = dict(PollLog.objects.filter(created__gte=started).values_list(
+        'status').annotate(Count('id')))
+    latencies = list(timer.timings.values())
+    return {
+        'feeds': len(latencies),
+        'wall': wall,
+        'throughput': len(latencies) / wall if wall else 0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'queries': queries,
+        'episodes': Episode.objects.count(),
+        'statuses': statuses,
+        'rss': peak_rss(),
+    }
+
+
+def report(number, result):
+    print('-- round %d' % number)
+    print('feeds            %d' % result['feeds'])
+    print('wall             %.2f s' % result['wall'])
+    print('throughput       %.1f feeds/s' % result['throughput'])
+    print('latency p50      %.1f ms' % result['p50'])
+    print('latency p99      %.1f ms' % result['p99'])
+    print('queries          %d (%.1f per feed)' % (
+        result['queries'], result['queries'] / max(result['feeds'], 1)))
+    print('episodes stored  %d' % result['episodes'])
+    print('poll results     %s' % ', '.join(
+        '%s=%d' % item for item in sorted(result['statuses'].items())))
+    print('peak RSS         %.1f MB' % result['rss'])
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--feeds', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=2,
+                        help='Number of crawls over all feeds')
+    parser.add_argument('--driver', choices=('poll_feeds', 'get_feed'),
+                        default='poll_feeds',
+                        help='Crawl with the poll_feeds command or get_feed '
+                             'called serially')
+    parser.add_argument('--workers', type=int, default=8)
+    # 全フィードが同じホストにあるため、既定ではホスト単位の制限をかけない
+    parser.add_argument('--per-host', type=int, default=None, dest='per_host',
+                        help='Concurrent fetches per host (default: workers)')
+    parser.add_argument('--db-workers', type=int, default=None,
+                        dest='db_workers',
+                        help='Threads writing to the database '
+                             '(default: 2, 1 on SQLite)')
+    parser.add_argument('--timeout', type=float, default=2,
+                        help='Read timeout in seconds for each feed')
+    parser.add_argument('--max-latency', type=float, default=0.5,
+                        dest='max_latency',
+                        help='Maximum response delay of the fake host')
+    parser.add_argument('--image-size', type=int, default=600,
+                        dest='image_size', help='Cover image size in pixels')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show warnings for each failed feed')
+    args = parser.parse_args(argv)
+    if args.per_host is None:
+        args.per_host = args.workers
+
+    profiles = make_profiles(args.feeds, args.seed, args.max_latency)
+    parent, child = multiprocessing.Pipe()
+    host = multiprocessing.Process(
+        target=serve, args=(profiles, args.image_size, args.timeout + 1, child),
+        daemon=True)
+    host.start()
+    base_url = parent.recv()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'logue.settings')
+    django.setup()
+    if not args.verbose:
+        # 不正なフィードごとの警告は出さず、巡回処理の例外のみ表示する
+        logging.getLogger('feed.utils').setLevel(logging.CRITICAL)
+
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from django.test.utils import override_settings
+
+    from feed import utils
+
+    media_root = tempfile.mkdtemp(prefix='logue-bench-')
+    storage = override_settings(
+        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+        MEDIA_ROOT=media_root)
+    counter = QueryCounter()
+    timer = FeedTimer(utils)
+
+    if args.db_workers is None:
+        # SQLite はテーブル単位でロックするため、書き込みスレッドを 1 つにする
+        args.db_workers = 1 if connection.vendor == 'sqlite' else 2
+
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    storage.enable()
+    try:
+        seed_channels(base_url, args.feeds)
+        counter.install(connection)
+        connection_created.connect(counter.install)
+        print('%d feeds served from %s (driver: %s)' % (
+            args.feeds, base_url, args.driver))
+        print()
+        for number in range(1, args.rounds + 1):
+            report(number, run_round(args, timer, counter))
+    finally:
+        connection_created.disconnect(counter.install)
+        storage.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+        host.terminate()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""feed アプリの頻出クエリについて、インデックス追加前後の実行計画を比較する.
+
+使い方:
+    python -m benchmarks.query_plans [--channels 1000] [--episodes 50]
+
+Note:
+    テスト用データベースを新たに作成し、インデックス追加前のマイグレーションまで
+    戻した状態と、追加後の状態とで EXPLAIN と実行時間を出力する.
+    既存のデータベースには触れない.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import uuid
+
+import django
+
+# インデックス追加前後のマイグレーション
+BEFORE = ('feed', '0004_dedupe_feed_rows')
+AFTER = ('feed', '0005_hot_path_indexes')
+
+
+def get_models(state):
+    """マイグレーション時点のモデルを取得する."""
+    from django.db import connection
+    from django.db.migrations.executor import MigrationExecutor
+
+    executor = MigrationExecutor(connection)
+    apps = executor.loader.project_state(state).apps
+    return {
+        name: apps.get_model(*name.split('.'))
+        for name in ('feed.Channel', 'feed.Episode', 'feed.Like',
+                     'feed.Subscription', 'accounts.LogueUser')
+    }
+
+
+def seed(models, num_channels, num_episodes, num_users):
+    """計測用のデータを登録する."""
+    from django.utils import timezone
+
+    Channel = models['feed.Channel']
+    Episode = models['feed.Episode']
+    Like = models['feed.Like']
+    Subscription = models['feed.Subscription']
+    User = models['accounts.LogueUser']
+
+    rnd = random.Random(0)
+    now = timezone.now()
+    # 自動採番の主キーを取得するため、ユーザーは 1 件ずつ登録する
+    users = [
+        User.objects.create(email='bench%d@example.com' % i, password='')
+        for i in range(num_users)
+    ]
+    channels = Channel.objects.bulk_create([
+        Channel(id=uuid.uuid4(), feed_url='https://bench%d.example.com/feed.rss' % i,
+                title='channel %d' % i)
+        for i in range(num_channels)
+    ], batch_size=400)
+    episodes = []
+    for channel in channels:
+        for i in range(num_episodes):
+            episodes.append(Episode(
+                id=uuid.uuid4(), channel=channel, title='episode %d' % i,
+                audio_url='%s/ep%d.mp3' % (channel.feed_url, i),
+                published_time=now - datetime.timedelta(
+                    hours=rnd.randint(0, 24 * 365))))
+    Episode.objects.bulk_create(episodes, batch_size=400)
+
+    likes = []
+    subs = []
+    for user in users:
+        for episode in rnd.sample(episodes, min(len(episodes), 20)):
+            likes.append(Like(id=uuid.uuid4(), episode=episode, user=user))
+        for channel in rnd.sample(channels, min(len(channels), 10)):
+            subs.append(Subscription(id=uuid.uuid4(), channel=channel, user=user))
+    Like.objects.bulk_create(likes, batch_size=400)
+    Subscription.objects.bulk_create(subs, batch_size=400)
+    return channels[len(channels) // 2], episodes[len(episodes) // 2], users[0]
+
+
+def hot_queries(models, channel, episode, user):
+    """頻出クエリを (名前, QuerySet) のリストで返す."""
+    Channel = models['feed.Channel']
+    Episode = models['feed.Episode']
+    Like = models['feed.Like']
+    Subscription = models['feed.Subscription']
+    since = datetime.date.today() - datetime.timedelta(days=20)
+    return [
+        ('channel by feed_url',
+         Channel.objects.filter(feed_url=channel.feed_url)),
+        ('channel detail episodes',
+         Episode.objects.filter(channel_id=channel.pk).order_by('-published_time')[:8]),
+        ('recently published',
+         Episode.objects.filter(published_time__gt=since)
+         .order_by('-published_time')[:12]),
+        ('episode by audio_url',
+         Episode.objects.filter(channel_id=channel.pk, audio_url=episode.audio_url)),
+        ('like toggle probe',
+         Like.objects.filter(episode_id=episode.pk, user_id=user.pk)),
+        ('subscription toggle probe',
+         Subscription.objects.filter(channel_id=channel.pk, user_id=user.pk)),
+    ]
+
+
+def explain(queryset, repeat):
+    """実行計画と平均実行時間(ミリ秒)を返す."""
+    from django.db import connection
+
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        plan = '\n'.join(' '.join(str(col) for col in row)
+                         for row in cursor.fetchall())
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(sql, params)
+            cursor.fetchall()
+        elapsed = (time.perf_counter() - start) * 1000 / repeat
+    return plan, elapsed
+
+
+def analyze():
+    """統計情報を更新する."""
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def report(label, models, targets, repeat):
+    print('=' * 72)
+    print(label)
+    print('=' * 72)
+    timings = {}
+    for name, queryset in hot_queries(models, *targets):
+        plan, elapsed = explain(queryset, repeat)
+        timings[name] = elapsed
+        print('-- %s (%.3f ms)' % (name, elapsed))
+        print(plan)
+        print()
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=1000)
+    parser.add_argument('--episodes', type=int, default=50,
+                        help='Episodes per channel')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Executions per query when timing')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'logue.settings')
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        call_command('migrate', *BEFORE, verbosity=0)
+        models = get_models(BEFORE)
+        targets = seed(models, args.channels, args.episodes, args.users)
+        analyze()
+        before = report('BEFORE %s' % BEFORE[1], models, targets, args.repeat)
+
+        call_command('migrate', *AFTER, verbosity=0)
+        analyze()
+        after = report('AFTER %s' % AFTER[1], get_models(AFTER), targets,
+                       args.repeat)
+
+        print('%-28s %12s %12s' % ('query', 'before(ms)', 'after(ms)'))
+        for name in before:
+            print('%-28s %12.3f %12.3f' % (name, before[name], after[name]))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,7 @@ admin.site.register(models.Channel)
 admin.site.register(models.Episode)
 admin.site.register(models.Subscription)
 admin.site.register(models.Like)
+admin.site.register(models.TrendingEpisode)
 admin.site.register(models.MstCollection)
 admin.site.register(models.Collection)
 admin.site.register(models.MstPlaylist)
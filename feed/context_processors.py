@@ -0,0 +1,24 @@
+"""全画面で共通のテンプレート変数を提供する."""
+from django.utils.functional import SimpleLazyObject
+
+from .forms import SubscriptionForm
+from .models import MstCollection
+
+
+def sidebar(request):
+    """ヘッダ部の登録用フォームとサイドバーのコレクション一覧を返す.
+
+    Note:
+        コレクション一覧はテンプレートで参照された時に初めて取得し、
+        ユーザーごとにキャッシュする. 未ログインの場合は DB にアクセスしない.
+    """
+    def get_collections():
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return []
+        return MstCollection.objects.cached_for_user(user)
+
+    return {
+        'subscription_form': SubscriptionForm,
+        'mst_collection': SimpleLazyObject(get_collections),
+    }
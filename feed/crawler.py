@@ -0,0 +1,191 @@
+"""フィードを並行に巡回する.
+
+ネットワーク取得はスレッドプールで並行に行い、
+DB 書き込みは少数の書き込みスレッドに限定する.
+"""
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import islice
+from urllib.parse import urlsplit
+
+from django.db import connection
+
+from . import jobs, scheduler, utils
+
+logger = logging.getLogger(__name__)
+
+# 書き込みスレッド終了の合図
+_STOP = object()
+
+# 取得スレッドあたりの同時に投入する取得処理の数.
+# 取得結果は書き込みまで保持されるため、全チャンネルを一度に投入しない
+PENDING_PER_WORKER = 2
+
+
+def get_host(url):
+    """URL のホスト名を取得する."""
+    return urlsplit(url).netloc.lower()
+
+
+class HostLimiter:
+    """ホスト単位で同時リクエスト数を制限する."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextmanager
+    def slot(self, url):
+        """URL のホストに空きができるまで待つ."""
+        host = get_host(url)
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit)
+                self._semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+
+def interleave_by_host(channels):
+    """同一ホストが連続しないようにチャンネルを並べ替える.
+
+    Note:
+        同じホストのフィードが固まっていると、ホスト単位の制限で
+        ワーカーが待たされるため、ホストごとに順番に取り出す.
+    """
+    buckets = OrderedDict()
+    for channel in channels:
+        buckets.setdefault(get_host(channel.feed_url), []).append(channel)
+
+    ordered = []
+    queues = [iter(items) for items in buckets.values()]
+    while queues:
+        remaining = []
+        for items in queues:
+            channel = next(items, None)
+            if channel is not None:
+                ordered.append(channel)
+                remaining.append(items)
+        queues = remaining
+    return ordered
+
+
+def _write(tasks, results):
+    """取得済フィードを DB に書き込み、次回取得日時を設定する.
+
+    Note:
+        書き込みスレッドで実行される. 取得に失敗したフィードも
+        store_feed に渡して結果を記録する.
+        画像の取得は書き込みを待たせないよう、画像保存ジョブに任せる.
+    """
+    try:
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                break
+            channel, response = task
+            feed_url = channel.feed_url
+            result = ''
+            try:
+                result = utils.store_feed(response, feed_url, with_image=False)
+            except Exception:
+                logger.exception('logue get_feeds failed to store "%s"',
+                                 feed_url)
+            try:
+                if result:
+                    scheduler.schedule_next_poll(feed_url)
+                    if result == 'success':
+                        jobs.enqueue_image(channel, response.parsed)
+                    # 恒久的に転送されていれば、次回から転送先を取得する
+                    utils.save_redirect(feed_url, response)
+                else:
+                    scheduler.schedule_retry(feed_url)
+            except Exception:
+                logger.exception('logue get_feeds failed to schedule "%s"',
+                                 feed_url)
+            results.append((feed_url, result))
+    finally:
+        # スレッドごとに開いた DB 接続を閉じる
+        connection.close()
+
+
+def poll_channels(channels, workers=8, per_host=2, timeout=None,
+                  db_workers=2, callback=None):
+    """フィードを並行に取得し、登録する.
+
+    Note:
+        取得スレッドは DB にアクセスしないため、
+        channels は事前に評価済である必要がある.
+        取得処理は取得スレッド数の PENDING_PER_WORKER 倍までしか投入せず、
+        書き込みに渡した取得結果は保持しない.
+
+    Arguments:
+        channels(list) -- 取得対象の Channel モデルインスタンス
+        workers(int) -- 取得スレッド数
+        per_host(int) -- ホスト単位の同時リクエスト数
+        timeout(tuple) -- (接続, 読み込み) タイムアウト秒数
+        db_workers(int) -- DB 書き込みスレッド数
+        callback(function) -- 取得完了ごとに Feed URL を渡して呼ばれる
+    Return:
+        results(dict) -- Feed URL ごとの処理結果.
+                         store_feed の戻り値、取得失敗の場合は ''
+    """
+    limiter = HostLimiter(per_host)
+
+    def fetch(channel):
+        with limiter.slot(channel.feed_url):
+            return utils.fetch_feed(
+                channel.feed_url, timeout=timeout,
+                etag=channel.etag, modified=channel.last_modified,
+                digest=channel.feed_body_hash)
+
+    # 取得待ちが溜まりすぎないよう、書き込みキューに上限を設ける
+    tasks = queue.Queue(maxsize=max(db_workers, 1) * 4)
+    results = []
+    writers = [
+        threading.Thread(target=_write, args=(tasks, results), daemon=True)
+        for _ in range(max(db_workers, 1))
+    ]
+    for writer in writers:
+        writer.start()
+
+    remaining = iter(interleave_by_host(channels))
+    max_pending = max(workers, 1) * PENDING_PER_WORKER
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def submit():
+                for channel in islice(remaining, max_pending - len(pending)):
+                    pending[executor.submit(fetch, channel)] = channel
+
+            submit()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    channel = pending.pop(future)
+                    if callback:
+                        callback(channel.feed_url)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        logger.exception(
+                            'logue get_feeds failed to fetch "%s"',
+                            channel.feed_url)
+                        response = utils.FeedResponse(
+                            None, None, None, None, error=str(e))
+                    tasks.put((channel, response))
+                submit()
+    finally:
+        for _ in writers:
+            tasks.put(_STOP)
+        for writer in writers:
+            writer.join()
+
+    return dict(results)
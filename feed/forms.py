@@ -3,6 +3,7 @@ from django.conf import settings
 from django.core.mail import send_mail
 
 from . import models
+from .normalize import normalize_feed_url
 
 
 class SubscriptionForm(forms.Form):
@@ -19,6 +20,13 @@ class SubscriptionForm(forms.Form):
         )
     )
 
+    def clean_require_url(self):
+        """Feed URL を正規化する."""
+        url = self.cleaned_data['require_url']
+        if url:
+            url = normalize_feed_url(url)
+        return url
+
 
 class AddCollectionForm(forms.Form):
     """登録済のコレクションリストの選択フォーム."""
@@ -0,0 +1,58 @@
+"""フィード・画像の取得に使う HTTP クライアント.
+
+ホストごとのコネクションプールを持つ Session を全スレッドで共有し、
+同じホストへのリクエストでは TCP/TLS 接続を使い回す.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import request as urllib3_request
+
+# プールを保持するホスト数と、1 ホストあたりに保持する接続数
+POOL_CONNECTIONS = 64
+POOL_MAXSIZE = 8
+
+USER_AGENT = 'logueHub/1.0 (+https://github.com/kita83/logueHub)'
+
+# urllib3 が展開できる圧縮形式. brotli が使える場合は br を含む
+ACCEPT_ENCODING = urllib3_request.ACCEPT_ENCODING
+
+_session = None
+_lock = threading.Lock()
+
+
+def build_session():
+    """コネクションプールを設定した Session を作る."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                          pool_maxsize=POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'User-Agent': USER_AGENT,
+        'Accept-Encoding': ACCEPT_ENCODING,
+    })
+    return session
+
+
+def get_session():
+    """共有の Session を返す."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get(url, **kwargs):
+    """共有の Session で GET リクエストを送る.
+
+    Arguments:
+        url(str) -- リクエストURL
+        kwargs -- requests.Session.get に渡す引数
+    Return:
+        response(requests.Response) -- レスポンス
+    """
+    return get_session().get(url, **kwargs)
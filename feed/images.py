@@ -0,0 +1,133 @@
+"""チャンネル画像のサムネイルを生成する.
+
+フィードの画像は数 MB の大きな画像であることが多いため、
+表示サイズごとに縮小した JPEG (レンディション) を元画像と同じ場所に保存する.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 生成するサムネイルの一辺のピクセル数
+RENDITION_SIZES = (60, 145, 400)
+
+# JPEG の保存品質
+RENDITION_QUALITY = 85
+
+
+def rendition_name(name, size):
+    """サムネイルの保存パスを返す.
+
+    Arguments:
+        name(str) -- 元画像の保存パス
+        size(int) -- サムネイルの一辺のピクセル数
+    Return:
+        name(str) -- サムネイルの保存パス
+    """
+    base = os.path.splitext(name)[0]
+    return '%s_%d.jpg' % (base, size)
+
+
+def to_rgb(img):
+    """透過画像などを白背景の RGB 画像に変換する."""
+    if img.mode == 'RGB':
+        return img
+    if img.mode in ('RGBA', 'LA') or \
+            (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert('RGB')
+
+
+def make_rendition(file, size):
+    """画像を縮小した JPEG データを作る.
+
+    Arguments:
+        file(file) -- 元画像のファイルオブジェクト
+        size(int) -- サムネイルの一辺のピクセル数
+    Return:
+        content(bytes) -- JPEG データ
+    """
+    return make_renditions(file, (size,))[size]
+
+
+def make_renditions(file, sizes):
+    """画像をサイズごとに縮小した JPEG データを作る.
+
+    Note:
+        元画像のデコードは 1 度だけ行い、大きいサイズから順に
+        直前の縮小結果の複製をさらに縮小する.
+    Arguments:
+        file(file) -- 元画像のファイルオブジェクト
+        sizes(list) -- サムネイルの一辺のピクセル数
+    Return:
+        contents(dict) -- サイズごとの JPEG データ
+    """
+    sizes = sorted(sizes, reverse=True)
+    file.seek(0)
+    img = Image.open(file)
+    # JPEG の場合は縮小した状態でデコードし、展開コストを抑える
+    img.draft('RGB', (sizes[0], sizes[0]))
+    img = to_rgb(img)
+
+    contents = {}
+    for size in sizes:
+        img = img.copy()
+        img.thumbnail((size, size), Image.ANTIALIAS)
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=RENDITION_QUALITY,
+                 optimize=True, progressive=True)
+        contents[size] = out.getvalue()
+    return contents
+
+
+def save_renditions(name, file):
+    """元画像からサムネイルを生成して保存する.
+
+    Arguments:
+        name(str) -- 元画像の保存パス
+        file(file) -- 元画像のファイルオブジェクト
+    Return:
+        result(bool) -- すべてのサムネイルを保存できた場合 True
+    """
+    try:
+        contents = make_renditions(file, RENDITION_SIZES)
+    except (IOError, OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning('logue could not make thumbnails of "%s": %s', name, e)
+        return False
+    for size in RENDITION_SIZES:
+        path, data = rendition_name(name, size), contents[size]
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(data))
+    return True
+
+
+def delete_renditions(name):
+    """サムネイルを削除する.
+
+    Arguments:
+        name(str) -- 元画像の保存パス
+    """
+    for size in RENDITION_SIZES:
+        path = rendition_name(name, size)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def delete_image(name):
+    """元画像とサムネイルを削除する.
+
+    Arguments:
+        name(str) -- 元画像の保存パス
+    """
+    delete_renditions(name)
+    if default_storage.exists(name):
+        default_storage.delete(name)
@@ -0,0 +1,368 @@
+"""DB に保存したジョブをバックグラウンドで実行する.
+
+Web リクエスト内で時間のかかる処理を行わないよう、ビューはジョブを登録するだけにし、
+run_workers コマンドがジョブを取り出して実行する.
+run_workers は複数ノードで複数プロセス起動でき、ジョブは
+SELECT ... FOR UPDATE SKIP LOCKED で取り出すため同じジョブを重複して実行しない.
+"""
+import datetime
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import locks, models, scheduler, utils
+
+logger = logging.getLogger(__name__)
+
+# ジョブの種類ごとの同時実行数の上限(全ワーカーの合計)
+CONCURRENCY = {
+    models.Job.REGISTER_CHANNEL: 4,
+    models.Job.POLL_CHANNEL: 8,
+    models.Job.SAVE_IMAGE: 2,
+}
+# 最大実行回数. 超えた場合は失敗とする
+MAX_ATTEMPTS = 5
+# 失敗時の再実行間隔. 実行回数に応じて倍々に延ばす
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+# 実行中のままこの時間を過ぎたジョブは、ワーカーが停止したものとみなす
+STALE_AFTER = datetime.timedelta(minutes=30)
+# 実行中のジョブの更新日時を更新する間隔. STALE_AFTER より十分短くする
+HEARTBEAT_INTERVAL = datetime.timedelta(minutes=5)
+# 完了・失敗したジョブの保存期間
+JOB_RETENTION = datetime.timedelta(days=7)
+
+
+class JobError(Exception):
+    """ジョブの実行に失敗したことを表す.
+
+    Arguments:
+        message(str) -- エラー内容
+        retry(bool) -- False の場合、再実行しない
+    """
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def register_channel(job):
+    """新規登録されたチャンネルのフィードを取得し、エピソードを登録する.
+
+    Note:
+        フィードとして不正な場合、チャンネルを無効にする.
+        画像は別のジョブで保存する.
+    Arguments:
+        job(Job) -- ジョブ
+    """
+    feed_url = job.channel.feed_url
+    response = utils.fetch_feed(feed_url)
+    if not utils.store_feed(response, feed_url, with_image=False):
+        if response.error:
+            raise JobError('could not fetch "%s": %s' % (
+                feed_url, response.error))
+        models.Channel.objects.filter(pk=job.channel_id).update(is_active=False)
+        raise JobError('"%s" is not a valid podcast feed' % feed_url,
+                       retry=False)
+
+    enqueue_image(job.channel, response.parsed)
+    scheduler.schedule_next_poll(feed_url)
+    utils.save_redirect(feed_url, response)
+
+
+def poll_channel(job):
+    """チャンネルのフィードを取得し、新着エピソードを登録する.
+
+    Note:
+        失敗時の再取得は scheduler が次回取得日時で管理するため、再実行しない.
+    Arguments:
+        job(Job) -- ジョブ
+    """
+    channel = job.channel
+    response = utils.fetch_feed(
+        channel.feed_url, etag=channel.etag, modified=channel.last_modified,
+        digest=channel.feed_body_hash)
+    result = utils.store_feed(response, channel.feed_url, with_image=False)
+    if not result:
+        scheduler.schedule_retry(channel.feed_url)
+        raise JobError('could not poll "%s"' % channel.feed_url, retry=False)
+
+    if result == 'success':
+        enqueue_image(channel, response.parsed)
+    scheduler.schedule_next_poll(channel.feed_url)
+    utils.save_redirect(channel.feed_url, response)
+
+
+def save_image(job):
+    """チャンネル画像を保存する.
+
+    Arguments:
+        job(Job) -- ジョブ. argument は画像URL
+    """
+    channel = job.channel
+    utils.set_cover_image(channel, job.argument)
+    # 画像以外の項目はフィード取得処理が更新するため、変更した項目のみ保存する
+    channel.save_changed_fields()
+
+
+# ジョブの種類ごとの処理
+HANDLERS = {
+    models.Job.REGISTER_CHANNEL: register_channel,
+    models.Job.POLL_CHANNEL: poll_channel,
+    models.Job.SAVE_IMAGE: save_image,
+}
+
+
+def enqueue(kind, channel=None, argument=None, key=None):
+    """ジョブを登録する.
+
+    Note:
+        key を指定した場合、同じキーの未完了ジョブがあれば登録せずにそのジョブを返す.
+    Arguments:
+        kind(str) -- ジョブの種類
+        channel(Channel) -- 対象チャンネル
+        argument(str) -- ジョブの引数
+        key(str) -- 重複登録を防ぐキー
+    Return:
+        job(Job) -- 登録したジョブ
+    """
+    job, created = get_or_create_job(kind, channel, argument, key)
+    return job
+
+
+def get_or_create_job(kind, channel=None, argument=None, key=None):
+    """ジョブを登録し、登録したかどうかも返す.
+
+    Return:
+        job(Job) -- 登録したジョブ、または同じキーの未完了ジョブ
+        created(bool) -- 登録した場合 True
+    """
+    values = {'kind': kind, 'channel': channel, 'argument': argument}
+    if key is None:
+        return models.Job.objects.create(**values), True
+    return models.Job.objects.get_or_create(key=key, defaults=values)
+
+
+def enqueue_image(channel, parsed):
+    """フィードにチャンネル画像があれば、画像保存ジョブを登録する.
+
+    Arguments:
+        channel(Channel) -- チャンネル
+        parsed(json) -- パース済 Json データ
+    """
+    image_url = utils.get_image_url(parsed)
+    if image_url:
+        enqueue(models.Job.SAVE_IMAGE, channel, argument=image_url,
+                key='%s:%s' % (models.Job.SAVE_IMAGE, channel.pk))
+
+
+def get_retry_delay(attempts):
+    """再実行までの時間を求める.
+
+    Arguments:
+        attempts(int) -- 実行回数
+    Return:
+        delay(timedelta) -- 再実行までの時間
+    """
+    return min(RETRY_DELAY * 2 ** min(attempts - 1, 16), MAX_RETRY_DELAY)
+
+
+def requeue_stale(now):
+    """ワーカーが停止して実行中のまま残ったジョブを再実行・失敗にする."""
+    stale = models.Job.objects.filter(
+        status=models.Job.RUNNING, modified__lt=now - STALE_AFTER)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=models.Job.FAILED, key=None,
+        last_error='worker lost', modified=now)
+    stale.update(status=models.Job.PENDING, run_after=now, modified=now)
+
+
+def prune_jobs(now=None):
+    """保存期間を過ぎた完了・失敗したジョブを削除する.
+
+    Return:
+        count(int) -- 削除した件数
+    """
+    now = now or timezone.now()
+    count, _ = models.Job.objects.filter(
+        status__in=(models.Job.DONE, models.Job.FAILED),
+        modified__lt=now - JOB_RETENTION).delete()
+    return count
+
+
+def claim_kind(kind, now):
+    """指定した種類の実行可能なジョブを 1 件取り出し、実行中にする.
+
+    Note:
+        種類ごとのロックを取得して実行中の件数を数え、上限に達していれば取り出さない.
+    Return:
+        job(Job) -- 取り出したジョブ. 取り出せない場合は None
+    """
+    with transaction.atomic():
+        locks.advisory_xact_lock('feed.jobs:%s' % kind)
+        running = models.Job.objects.filter(
+            kind=kind, status=models.Job.RUNNING).count()
+        if running >= CONCURRENCY.get(kind, 1):
+            return None
+
+        job = models.Job.objects.select_for_update(skip_locked=True).filter(
+            kind=kind, status=models.Job.PENDING, run_after__lte=now,
+        ).order_by('run_after', 'id').first()
+        if job is None:
+            return None
+
+        # 行ロックがないデータベースでも、他のワーカーが先に取り出したジョブは実行しない
+        claimed = models.Job.objects.filter(
+            pk=job.pk, status=models.Job.PENDING).update(
+                status=models.Job.RUNNING, attempts=job.attempts + 1,
+                modified=now)
+        if not claimed:
+            return None
+    job.status = models.Job.RUNNING
+    job.attempts += 1
+    return job
+
+
+def claim_job(now=None, kinds=None):
+    """実行可能なジョブを 1 件取り出し、実行中にする.
+
+    Note:
+        待ち時間の長いジョブの種類から取り出す.
+    Arguments:
+        now(datetime) -- 現在日時
+        kinds(list) -- 取り出すジョブの種類. 省略時は全種類
+    Return:
+        job(Job) -- 取り出したジョブ. 実行可能なジョブがない場合は None
+    """
+    now = now or timezone.now()
+    requeue_stale(now)
+
+    pending = models.Job.objects.filter(
+        status=models.Job.PENDING, run_after__lte=now)
+    if kinds:
+        pending = pending.filter(kind__in=kinds)
+    waiting = pending.values('kind').annotate(
+        oldest=Min('run_after')).order_by('oldest')
+    for row in waiting:
+        job = claim_kind(row['kind'], now)
+        if job is not None:
+            return job
+    return None
+
+
+def touch_job(job):
+    """実行中のジョブの更新日時を現在日時にする."""
+    models.Job.objects.filter(pk=job.pk, status=models.Job.RUNNING).update(
+        modified=timezone.now())
+
+
+@contextmanager
+def heartbeat(job):
+    """実行中のジョブの更新日時を定期的に更新する.
+
+    Note:
+        STALE_AFTER より長くかかるジョブを requeue_stale が再実行しないよう、
+        別スレッドで HEARTBEAT_INTERVAL ごとに modified を更新する.
+    Arguments:
+        job(Job) -- 実行中にしたジョブ
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL.total_seconds()):
+                try:
+                    touch_job(job)
+                except Exception:
+                    logger.exception('logue job %s failed to heartbeat', job)
+        finally:
+            # スレッドで開いた DB 接続を閉じる
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    """ジョブを実行し、結果を保存する.
+
+    Note:
+        失敗した場合、MAX_ATTEMPTS 回までは間隔を延ばして再実行する.
+    Arguments:
+        job(Job) -- 実行中にしたジョブ
+    Return:
+        result(bool) -- 成功の場合 True
+    """
+    retry = True
+    try:
+        with heartbeat(job):
+            HANDLERS[job.kind](job)
+    except JobError as e:
+        logger.warning('logue job %s failed: %s', job, e)
+        job.last_error = str(e)
+        retry = e.retry
+    except Exception as e:
+        logger.exception('logue job %s failed', job)
+        job.last_error = '%s: %s' % (type(e).__name__, e)
+    else:
+        job.last_error = None
+        job.status = models.Job.DONE
+
+    if job.status != models.Job.DONE:
+        if retry and job.attempts < MAX_ATTEMPTS:
+            job.status = models.Job.PENDING
+            job.run_after = timezone.now() + get_retry_delay(job.attempts)
+        else:
+            job.status = models.Job.FAILED
+
+    if job.status in (models.Job.DONE, models.Job.FAILED):
+        # 同じキーのジョブを再び登録できるようにする
+        job.key = None
+    job.save(update_fields=[
+        'status', 'last_error', 'run_after', 'key', 'modified'])
+    return job.status == models.Job.DONE
+
+
+def run_pending(limit=None, kinds=None):
+    """実行可能なジョブがなくなるまで実行する.
+
+    Arguments:
+        limit(int) -- 実行するジョブの最大件数
+        kinds(list) -- 実行するジョブの種類. 省略時は全種類
+    Return:
+        count(int) -- 実行したジョブの件数
+    """
+    count = 0
+    while limit is None or count < limit:
+        close_old_connections()
+        job = claim_job(kinds=kinds)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def enqueue_polls(channels):
+    """チャンネルごとにフィード取得ジョブを登録する.
+
+    Arguments:
+        channels(list) -- チャンネル
+    Return:
+        count(int) -- 登録したジョブの件数. 未完了のジョブがあるチャンネルは数えない
+    """
+    count = 0
+    for channel in channels:
+        job, created = get_or_create_job(
+            models.Job.POLL_CHANNEL, channel,
+            key='%s:%s' % (models.Job.POLL_CHANNEL, channel.pk))
+        count += created
+    return count
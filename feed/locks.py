@@ -0,0 +1,58 @@
+"""プロセス・ノードをまたいだ排他制御.
+
+PostgreSQL のアドバイザリロックを使う. PostgreSQL 以外では何もしない.
+"""
+import hashlib
+import struct
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+def lock_id(name):
+    """ロック名をアドバイザリロックのキー(符号付き 64bit 整数)にする.
+
+    Note:
+        フィード・ジョブの種類ごとのロックが衝突しにくいよう、
+        SHA-1 の先頭 8 バイトを使う.
+    """
+    digest = hashlib.sha1(name.encode('utf-8')).digest()
+    return struct.unpack('>q', digest[:8])[0]
+
+
+def advisory_xact_lock(name):
+    """トランザクションが終わるまで name のロックを取得する.
+
+    Note:
+        transaction.atomic() の中で呼び出す. 他のトランザクションが
+        同じロックを保持している場合は解放されるまで待つ.
+    Arguments:
+        name(str) -- ロック名
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [lock_id(name)])
+
+
+@contextmanager
+def advisory_lock(name):
+    """with ブロックを抜けるまで name のロックを取得する.
+
+    Note:
+        トランザクションの外で使え、ネットワーク処理などの長い処理を排他できる.
+        他の接続が同じロックを保持している場合は解放されるまで待つ.
+    Arguments:
+        name(str) -- ロック名
+    """
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    key = lock_id(name)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s)', [key])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from feed import images
+from feed.models import Channel
+from datetime import datetime
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    サムネイル未作成のチャンネル画像からサムネイルを作成する
+    """
+    help = 'チャンネル画像のサムネイルを作成'
+
+    def handle(self, *args, **options):
+        """
+        保存済の画像を読み込み、サムネイルを保存する
+        """
+        channels = Channel.objects.filter(has_renditions=False).exclude(
+            cover_image='').exclude(cover_image=None).only('cover_image')
+        count = 0
+        for channel in channels.iterator():
+            name = channel.cover_image.name
+            try:
+                with default_storage.open(name, 'rb') as file:
+                    saved = images.save_renditions(name, file)
+            except (IOError, OSError) as e:
+                logger.warning('logue make_thumbnails could not read "%s": %s',
+                               name, e)
+                continue
+            if saved:
+                Channel.objects.filter(pk=channel.pk).update(has_renditions=True)
+                count += 1
+
+        end_time = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        print('[%s] logue make_thumbnails completed successfully (%d channels)' % (
+            end_time, count))
+        logger.info('[%s] logue make_thumbnails completed successfully' % (
+            end_time))
@@ -2,7 +2,10 @@
 
 from django.core.management.base import BaseCommand
 from feed.models import Channel
-from feed.utils import get_feed
+from feed.crawler import poll_channels
+from feed.jobs import enqueue_polls, prune_jobs
+from feed.utils import prune_poll_logs
+from feed.scheduler import due_channels
 from datetime import datetime
 
 import logging
@@ -26,32 +29,100 @@ class Command(BaseCommand):
                             dest='verbose',
                             default=False,
                             help='Print progress on command line')
+        parser.add_argument('--due',
+                            action='store_true',
+                            dest='due',
+                            default=False,
+                            help='Only poll channels whose next poll time has passed')
+        parser.add_argument('--limit',
+                            type=int,
+                            default=None,
+                            help='Maximum number of channels to poll')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=8,
+                            help='Number of concurrent feed fetches')
+        parser.add_argument('--per-host',
+                            type=int,
+                            default=2,
+                            dest='per_host',
+                            help='Maximum concurrent fetches per host')
+        parser.add_argument('--db-workers',
+                            type=int,
+                            default=2,
+                            dest='db_workers',
+                            help='Number of threads writing to the database')
+        parser.add_argument('--timeout',
+                            type=float,
+                            default=30,
+                            help='Read timeout in seconds for each feed')
+        parser.add_argument('--enqueue',
+                            action='store_true',
+                            dest='enqueue',
+                            default=False,
+                            help='Queue poll jobs for run_workers instead of polling here')
 
     def handle(self, *args, **options):
         """
         既存チャンネル新着エピソードを取得
         """
         verbose = options['verbose']
-        channels = Channel.objects.all()
+        if options['due']:
+            # 取得予定日時を過ぎたチャンネルのみ、優先度順に取得する
+            channels = due_channels()
+        else:
+            channels = Channel.objects.filter(is_active=True)
+        channels = channels.only(
+            'feed_url', 'etag', 'last_modified', 'feed_body_hash')
+        if options['limit']:
+            channels = channels[:options['limit']]
+        channels = list(channels)
         num_channels = len(channels)
         start = datetime.now()
         exec_time = start.strftime('%Y/%m/%d %H:%M:%S')
 
+        prune_poll_logs()
+        prune_jobs()
+
+        if options['enqueue']:
+            # 取得は run_workers に任せ、複数ノードで分担する
+            count = enqueue_polls(channels)
+            print('[%s] logue get_feeds queued %d channels' % (exec_time, count))
+            logger.info('[%s] logue get_feeds queued %d channels' % (
+                exec_time, count))
+            return
+
         if verbose:
             print('##########################################################################')
             print('[%s] %d channels to process..' % (
                 exec_time, num_channels))
 
-        for i, channel in enumerate(channels):
+        progress = {'done': 0}
+
+        def report(feed_url):
+            progress['done'] += 1
             if verbose:
                 print('(%d/%d) Processing Channels' % (
-                    i + 1, num_channels))
-            # feed取得
-            get_feed(channel.feed_url)
+                    progress['done'], num_channels))
 
+        # feed取得
+        results = poll_channels(
+            channels,
+            workers=options['workers'],
+            per_host=options['per_host'],
+            timeout=(5, options['timeout']),
+            db_workers=options['db_workers'],
+            callback=report)
+
+        num_updated = sum(1 for r in results.values() if r == 'success')
+        num_not_modified = sum(
+            1 for r in results.values() if r == 'not_modified')
         end = datetime.now()
         end_time = end.strftime('%Y/%m/%d %H:%M:%S')
-        print('[%s] logue get_feeds completed successfully' % (
-            end_time))
+        print('[%s] logue get_feeds completed successfully '
+              '(%d updated, %d not modified, %d failed, %s)' % (
+                  end_time, num_updated, num_not_modified,
+                  num_channels - num_updated - num_not_modified,
+                  end - start))
         logger.info('[%s] logue get_feeds completed successfully' % (
             end_time))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from feed.models import Episode, Like
+from datetime import datetime
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    エピソードの Like 数を Like テーブルの件数に合わせる
+    Cronから定期的に呼ばれることを想定
+    """
+    help = 'Like 数のずれを補正'
+
+    def handle(self, *args, **options):
+        """
+        Like 数を補正
+        """
+        counts = dict(Like.objects.values_list('episode').annotate(
+            num=Count('id')).order_by())
+
+        # Like のあるエピソードと、Like 数が 0 でないエピソードを確認する
+        episodes = Episode.objects.filter(like_count__gt=0).values_list(
+            'id', 'like_count')
+        stored = dict(episodes)
+        num_fixed = 0
+        for episode_id in set(stored) | set(counts):
+            actual = counts.get(episode_id, 0)
+            if stored.get(episode_id, 0) != actual:
+                Episode.objects.filter(id=episode_id).update(like_count=actual)
+                num_fixed += 1
+
+        end_time = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        print('[%s] logue reconcile_like_counts completed successfully (%d fixed)' % (
+            end_time, num_fixed))
+        logger.info('[%s] logue reconcile_like_counts completed successfully' % (
+            end_time))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from feed.models import TrendingEpisode
+from datetime import datetime
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    トレンドスコアを全ての Like から再計算する
+    Cronから定期的に呼ばれることを想定
+    """
+    help = 'トレンドエピソードを再計算'
+
+    def handle(self, *args, **options):
+        """
+        トレンドスコアを再計算
+        """
+        TrendingEpisode.objects.rebuild()
+
+        end_time = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        print('[%s] logue refresh_trending completed successfully (%d episodes)' % (
+            end_time, TrendingEpisode.objects.count()))
+        logger.info('[%s] logue refresh_trending completed successfully' % (
+            end_time))
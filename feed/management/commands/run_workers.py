@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from feed import jobs
+from datetime import datetime
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    登録されたジョブを実行する
+    常駐プロセスとして起動することを想定
+    """
+    help = 'バックグラウンドジョブを実行'
+
+    def add_arguments(self, parser):
+        """
+        省略可能な引数
+        """
+        parser.add_argument('--once',
+                            action='store_true',
+                            dest='once',
+                            default=False,
+                            help='Exit when there are no more pending jobs')
+        parser.add_argument('--sleep',
+                            type=float,
+                            default=5,
+                            help='Seconds to wait when there are no pending jobs')
+        parser.add_argument('--kinds',
+                            default='',
+                            help='Comma separated job kinds to run (default: all)')
+
+    def handle(self, *args, **options):
+        """
+        実行可能なジョブがなくなるまで実行し、待機する
+        """
+        start_time = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        logger.info('[%s] logue run_workers started' % start_time)
+
+        # ノードごとに実行するジョブの種類を分けられるようにする
+        kinds = [kind for kind in options['kinds'].split(',') if kind]
+
+        total = 0
+        while True:
+            total += jobs.run_pending(kinds=kinds)
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+
+        end_time = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        print('[%s] logue run_workers completed successfully (%d jobs)' % (
+            end_time, total))
+        logger.info('[%s] logue run_workers completed successfully' % (
+            end_time))
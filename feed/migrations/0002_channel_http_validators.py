@@ -0,0 +1,23 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='etag',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0002_channel_http_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='poll_error_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='publish_interval',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:22
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def duplicated(model, *fields):
+    """指定フィールドの組み合わせが重複する行を、作成日時の古い順にまとめて返す."""
+    keys = model.objects.values(*fields).annotate(
+        num=Count('pk')).filter(num__gt=1)
+    for key in keys:
+        del key['num']
+        rows = list(model.objects.filter(**key).order_by('created', 'pk'))
+        yield rows[0], rows[1:]
+
+
+def dedupe_rows(apps, schema_editor):
+    """一意制約を追加する前に、重複したチャンネル・エピソード・購読・Like をまとめる.
+
+    Note:
+        最も古い行を残し、重複行を参照するデータは残す行に付け替える.
+    """
+    Channel = apps.get_model('feed', 'Channel')
+    Episode = apps.get_model('feed', 'Episode')
+    Subscription = apps.get_model('feed', 'Subscription')
+    Like = apps.get_model('feed', 'Like')
+    Collection = apps.get_model('feed', 'Collection')
+    Playlist = apps.get_model('feed', 'Playlist')
+    Tag = apps.get_model('feed', 'Tag')
+
+    # 同じ Feed URL のチャンネル
+    for keep, dupes in duplicated(Channel, 'feed_url'):
+        Episode.objects.filter(channel__in=dupes).update(channel=keep)
+        Subscription.objects.filter(channel__in=dupes).update(channel=keep)
+        Channel.objects.filter(pk__in=[ch.pk for ch in dupes]).delete()
+
+    # 同じチャンネル内で同じ音声ファイルURLのエピソード
+    for keep, dupes in duplicated(Episode, 'channel', 'audio_url'):
+        for model in (Like, Collection, Playlist, Tag):
+            model.objects.filter(episode__in=dupes).update(episode=keep)
+        Episode.objects.filter(pk__in=[ep.pk for ep in dupes]).delete()
+
+    # 同じユーザーの重複した購読、Like
+    for keep, dupes in duplicated(Subscription, 'user', 'channel'):
+        Subscription.objects.filter(pk__in=[sub.pk for sub in dupes]).delete()
+    for keep, dupes in duplicated(Like, 'user', 'episode'):
+        Like.objects.filter(pk__in=[like.pk for like in dupes]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0003_channel_poll_schedule'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_rows, migrations.RunPython.noop),
+    ]
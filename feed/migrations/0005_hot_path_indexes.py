@@ -0,0 +1,42 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('feed', '0004_dedupe_feed_rows'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='channel',
+            name='feed_url',
+            field=models.URLField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='episode',
+            name='published_time',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='episode',
+            unique_together={('channel', 'audio_url')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='like',
+            unique_together={('user', 'episode')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscription',
+            unique_together={('user', 'channel')},
+        ),
+        migrations.AddIndex(
+            model_name='episode',
+            index=models.Index(fields=['channel', '-published_time'], name='feed_episode_ch_pub_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import feed.models
+
+
+def build_trending(apps, schema_editor):
+    """既存の Like からトレンドスコアを計算する."""
+    TrendingEpisode = apps.get_model('feed', 'TrendingEpisode')
+    TrendingEpisode.objects.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingEpisode',
+            fields=[
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('episode', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='feed.Episode')),
+                ('score', models.FloatField(db_index=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+            managers=[
+                ('objects', feed.models.TrendingEpisodeManager()),
+            ],
+        ),
+        migrations.RunPython(build_trending, migrations.RunPython.noop),
+    ]
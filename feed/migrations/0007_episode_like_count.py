@@ -0,0 +1,30 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_likes(apps, schema_editor):
+    """既存の Like 数を集計する."""
+    Episode = apps.get_model('feed', 'Episode')
+    Like = apps.get_model('feed', 'Like')
+    counts = Like.objects.values_list('episode').annotate(
+        num=Count('id')).order_by()
+    for episode_id, num in counts:
+        Episode.objects.filter(id=episode_id).update(like_count=num)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0006_trending_episode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0007_episode_like_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['mst_collection', '-created', '-id'], name='feed_col_mst_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', '-created', '-id'], name='feed_like_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mstcollection',
+            index=models.Index(fields=['user', '-created', '-id'], name='feed_mstcol_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', '-created', '-id'], name='feed_sub_user_created_idx'),
+        ),
+    ]
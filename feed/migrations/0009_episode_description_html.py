@@ -0,0 +1,18 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='description_html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0009_episode_description_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='has_renditions',
+            field=models.BooleanField(default=False),
+        ),
+    ]
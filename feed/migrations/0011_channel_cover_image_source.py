@@ -0,0 +1,33 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0010_channel_has_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='cover_image_etag',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='cover_image_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='cover_image_last_modified',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='cover_image_url',
+            field=models.URLField(blank=True, max_length=2000, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='argument',
+            field=models.CharField(blank=True, max_length=2000, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='key',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('register_channel', 'チャンネル登録'), ('poll_channel', 'フィード取得'), ('save_image', '画像保存')], max_length=30),
+        ),
+    ]
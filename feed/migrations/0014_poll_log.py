@@ -0,0 +1,33 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0013_job_key_argument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('success', '更新'), ('not_modified', '変更なし'), ('invalid', 'フィード不正'), ('error', '取得失敗')], max_length=20)),
+                ('http_status', models.IntegerField(blank=True, null=True)),
+                ('bytes', models.IntegerField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('new_episodes', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='feed.Channel')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='polllog',
+            index=models.Index(fields=['channel', '-created'], name='feed_polllog_ch_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0014_poll_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_full_sync',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.4 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0015_channel_last_full_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='feed_body_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
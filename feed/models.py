@@ -1,12 +1,25 @@
 """feedアプリのモデル"""
 import uuid
+import math
 import datetime
 from django.utils import timezone
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from . import images
+from .rendering import render_markdown
+
+
+# トレンドスコアの基準日時と半減期
+TRENDING_EPOCH = datetime.datetime(2018, 1, 1, tzinfo=timezone.utc)
+TRENDING_HALF_LIFE = datetime.timedelta(days=3)
+
+# サイドバーのコレクション一覧のキャッシュ有効期間(秒).
+# 共有キャッシュを設定していない場合、他のプロセスの表示はこの時間だけ遅れる
+SIDEBAR_CACHE_TIMEOUT = 60
 
 
 class EpisodeManager(models.Manager):
@@ -17,6 +30,79 @@ class EpisodeManager(models.Manager):
                 days=20)).order_by('-published_time')
 
 
+def trending_weight(liked_at):
+    """Like 1 件分のスコアを log2 で返す.
+
+    Note:
+        新しい Like ほど大きく、半減期ごとに 1 ずつ増える.
+        log2 で保持することで、スコアを減衰させずに並び順を保てる.
+    """
+    return (liked_at - TRENDING_EPOCH) / TRENDING_HALF_LIFE
+
+
+def log2_add(a, b):
+    """log2 で表した 2 つの値の和を log2 で返す."""
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def log2_sub(a, b):
+    """log2 で表した 2 つの値の差を log2 で返す. 0 以下の場合は None."""
+    rest = 1 - 2 ** (b - a)
+    if rest <= 1e-9:
+        return None
+    return a + math.log2(rest)
+
+
+class TrendingEpisodeManager(models.Manager):
+    """トレンドスコアを更新する Manager クラス."""
+    use_in_migrations = True
+
+    def add_like(self, episode_id, liked_at):
+        """Like の追加をスコアに反映する."""
+        weight = trending_weight(liked_at)
+        with transaction.atomic():
+            trending, created = self.get_or_create(
+                episode_id=episode_id, defaults={'score': weight})
+            if created:
+                return
+            trending = self.select_for_update().get(pk=trending.pk)
+            trending.score = log2_add(trending.score, weight)
+            trending.save(update_fields=['score', 'modified'])
+
+    def remove_like(self, episode_id, liked_at):
+        """Like の削除をスコアに反映する."""
+        with transaction.atomic():
+            trending = self.select_for_update().filter(
+                episode_id=episode_id).first()
+            if trending is None:
+                return
+            score = log2_sub(trending.score, trending_weight(liked_at))
+            if score is None:
+                trending.delete()
+            else:
+                trending.score = score
+                trending.save(update_fields=['score', 'modified'])
+
+    def rebuild(self):
+        """全ての Like からスコアを再計算する."""
+        like_model = self.model._meta.apps.get_model('feed', 'Like')
+        scores = {}
+        likes = like_model.objects.values_list('episode_id', 'created')
+        for episode_id, created in likes.iterator():
+            weight = trending_weight(created)
+            if episode_id in scores:
+                weight = log2_add(scores[episode_id], weight)
+            scores[episode_id] = weight
+
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                self.model(episode_id=episode_id, score=score)
+                for episode_id, score in scores.items()
+            ], batch_size=200)
+
+
 class TimeStampModel(models.Model):
     """作成日時と変更日時フィールドを提供する Abstract クラス."""
     created = models.DateTimeField(auto_now_add=True)
@@ -32,9 +118,20 @@ class Channel(TimeStampModel):
     title = models.CharField(max_length=2000, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     link = models.URLField(max_length=2000, null=True, blank=True)
-    feed_url = models.URLField(max_length=200)
+    feed_url = models.URLField(max_length=200, unique=True)
     author = models.CharField(max_length=100, null=True, blank=True)
     last_polled_time = models.DateTimeField(null=True, blank=True)
+    # 条件付き GET 用に前回レスポンスの ETag / Last-Modified を保持する
+    etag = models.CharField(max_length=200, null=True, blank=True)
+    last_modified = models.CharField(max_length=100, null=True, blank=True)
+    # 前回取得したフィード本文の SHA-256. 本文が同じ場合はパースしない
+    feed_body_hash = models.CharField(max_length=64, null=True, blank=True)
+    # 次回取得予定日時と学習した配信間隔(秒). feed.scheduler が更新する
+    next_poll_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    publish_interval = models.IntegerField(null=True, blank=True)
+    poll_error_count = models.IntegerField(default=0)
+    # 全エントリを確認した日時. feed.utils.save_episodes が更新する
+    last_full_sync = models.DateTimeField(null=True, blank=True)
     cover_image = models.ImageField(
         upload_to='images/',
         width_field='width_field',
@@ -44,27 +141,123 @@ class Channel(TimeStampModel):
     )
     width_field = models.IntegerField(default=400)
     height_field = models.IntegerField(default=400)
+    # 取得元の画像URL、条件付き GET 用の ETag / Last-Modified と画像のハッシュ値
+    cover_image_url = models.URLField(max_length=2000, null=True, blank=True)
+    cover_image_etag = models.CharField(max_length=200, null=True, blank=True)
+    cover_image_last_modified = models.CharField(
+        max_length=100, null=True, blank=True)
+    cover_image_hash = models.CharField(max_length=64, null=True, blank=True)
+    # cover_image のサムネイル(feed.images.RENDITION_SIZES)を保存済の場合 True
+    has_renditions = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
         return self.title or self.feed_url
 
+    def get_cover_image(self, size):
+        """表示サイズに応じた画像の保存パスを返す.
+
+        Note:
+            サムネイルが未作成の場合は元画像のパスを返す.
+        Arguments:
+            size(int) -- サムネイルの一辺のピクセル数
+        Return:
+            name(str) -- 画像の保存パス
+        """
+        if not self.cover_image:
+            return ''
+        if not self.has_renditions:
+            return self.cover_image.name
+        return images.rendition_name(self.cover_image.name, size)
+
+    @property
+    def cover_image_60(self):
+        return self.get_cover_image(60)
+
+    @property
+    def cover_image_145(self):
+        return self.get_cover_image(145)
+
+    @property
+    def cover_image_400(self):
+        return self.get_cover_image(400)
+
     def get_absolute_url(self):
         return reverse('feed:ch_detail', kwargs={'pk': self.pk})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Channel, cls).from_db(db, field_names, values)
+        # 変更検知のため、読み込んだ値を保持する
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
         """チャンネルを登録する."""
-        try:
-            Channel.objects.get(feed_url=self.feed_url)
-            super(Channel, self).save(*args, **kwargs)
-        except Channel.DoesNotExist:
-            super(Channel, self).save(*args, **kwargs)
+        super(Channel, self).save(*args, **kwargs)
+        self._reset_loaded_values(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(Channel, self).refresh_from_db(using, fields)
+        self._reset_loaded_values(fields)
+
+    def _reset_loaded_values(self, fields=None):
+        """現在の値を変更検知の基準にする.
+
+        Arguments:
+            fields(list) -- 対象の項目名. 省略時は読み込み済の全項目
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if fields is None or field.name in fields \
+                    or field.attname in fields:
+                loaded[field.attname] = getattr(self, field.attname)
+        self._loaded_values = loaded
+
+    def get_changed_fields(self):
+        """読み込み・保存した時点から変更された項目名を返す.
+
+        Note:
+            読み込んでいない項目(遅延読み込み)は、値を設定した場合に変更とみなす.
+        Return:
+            fields(list) -- 変更された項目名
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.attname in loaded:
+                if getattr(self, field.attname) != loaded[field.attname]:
+                    changed.append(field.name)
+            elif field.attname in self.__dict__:
+                changed.append(field.name)
+        return changed
+
+    def save_changed_fields(self):
+        """変更された項目のみ保存する.
+
+        Note:
+            変更がなければ UPDATE を発行しない.
+        Return:
+            fields(list) -- 保存した項目名
+        """
+        changed = self.get_changed_fields()
+        if changed:
+            self.save(update_fields=changed + ['modified'])
+        return changed
 
 
 @receiver(post_delete, sender=Channel)
 def delete_file(sender, instance, **kwargs):
-    """Channelモデル削除後に画像ファイルを削除する."""
-    instance.cover_image.delete(False)
+    """Channelモデル削除後に画像ファイルを削除する.
+
+    Note:
+        同じ画像を他のチャンネルが使っている場合は削除しない.
+    """
+    name = instance.cover_image.name if instance.cover_image else ''
+    if name and not Channel.objects.filter(cover_image=name).exists():
+        images.delete_image(name)
 
 
 class Episode(TimeStampModel):
@@ -75,15 +268,27 @@ class Episode(TimeStampModel):
     link = models.URLField(max_length=2000, null=True, blank=True)
     audio_url = models.URLField(max_length=2000)
     description = models.TextField(null=True, blank=True)
+    # description を Markdown 変換した HTML. 未変換の場合は None
+    description_html = models.TextField(null=True, blank=True, editable=False)
     published_time = models.DateTimeField(
         default=timezone.now,
-        null=True, blank=True)
+        null=True, blank=True, db_index=True)
     duration = models.CharField(max_length=10, null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Like 数. change_like で更新し、reconcile_like_counts コマンドで補正する
+    like_count = models.IntegerField(default=0)
 
     objects = models.Manager()
     recently = EpisodeManager()
 
+    class Meta:
+        unique_together = (('channel', 'audio_url'),)
+        indexes = [
+            # チャンネル詳細の最新エピソード取得用
+            models.Index(fields=['channel', '-published_time'],
+                         name='feed_episode_ch_pub_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -91,7 +296,21 @@ class Episode(TimeStampModel):
         return reverse('feed:ep_detail', kwargs={'pk': self.pk})
 
     def num_likad_entries(self):
-        return Like.objects.filter(episode=self).count()
+        return self.like_count
+
+    def get_description_html(self):
+        """ShowNote を HTML で返す.
+
+        Note:
+            未変換の場合は変換結果を保存し、以降は Markdown の変換を行わない.
+        Return:
+            description_html(str) -- 変換後の HTML
+        """
+        if self.description_html is None:
+            self.description_html = render_markdown(self.description)
+            Episode.objects.filter(pk=self.pk).update(
+                description_html=self.description_html)
+        return self.description_html
 
 
 class Subscription(TimeStampModel):
@@ -103,6 +322,14 @@ class Subscription(TimeStampModel):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        unique_together = (('user', 'channel'),)
+        indexes = [
+            # 登録チャンネル一覧のページング用
+            models.Index(fields=['user', '-created', '-id'],
+                         name='feed_sub_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.channel.title
 
@@ -116,10 +343,72 @@ class Like(TimeStampModel):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        unique_together = (('user', 'episode'),)
+        indexes = [
+            # Like 一覧のページング用
+            models.Index(fields=['user', '-created', '-id'],
+                         name='feed_like_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.episode.title
 
 
+class TrendingEpisode(TimeStampModel):
+    """Like 数を時間減衰させたトレンドスコアを保持する.
+
+    Note:
+        Like の追加・削除時に更新し、refresh_trending コマンドで再計算する.
+    """
+    episode = models.OneToOneField(
+        Episode, on_delete=models.CASCADE, primary_key=True)
+    score = models.FloatField(db_index=True)
+
+    objects = TrendingEpisodeManager()
+
+    def __str__(self):
+        return self.episode.title
+
+
+@receiver(post_save, sender=Like)
+def add_trending_like(sender, instance, created, **kwargs):
+    """Like 登録後にトレンドスコアを更新する."""
+    if created:
+        TrendingEpisode.objects.add_like(instance.episode_id, instance.created)
+
+
+@receiver(post_delete, sender=Like)
+def remove_trending_like(sender, instance, **kwargs):
+    """Like 削除後にトレンドスコアを更新する."""
+    TrendingEpisode.objects.remove_like(instance.episode_id, instance.created)
+
+
+class MstCollectionManager(models.Manager):
+    """ユーザーごとのコレクション一覧をキャッシュする Manager クラス.
+
+    Note:
+        CACHES を設定していない場合はプロセスごとのメモリキャッシュとなり、
+        コレクション変更時のキャッシュ削除は変更を処理したプロセスにのみ反映される.
+        gunicorn の他のワーカーでは最大 SIDEBAR_CACHE_TIMEOUT 秒、
+        変更前のコレクション一覧を表示する. 即時に反映するには
+        Redis や Memcached などプロセス間で共有するキャッシュを設定する.
+    """
+
+    @staticmethod
+    def cache_key(user_id):
+        return 'feed:mst_collection:%s' % user_id
+
+    def cached_for_user(self, user):
+        """サイドバー表示用のコレクション一覧を取得する."""
+        key = self.cache_key(user.pk)
+        collections = cache.get(key)
+        if collections is None:
+            collections = list(self.filter(user=user).order_by('created'))
+            cache.set(key, collections, SIDEBAR_CACHE_TIMEOUT)
+        return collections
+
+
 class MstCollection(TimeStampModel):
     """コレクション情報を保持する."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -130,10 +419,26 @@ class MstCollection(TimeStampModel):
     )
     is_active = models.BooleanField(default=True)
 
+    objects = MstCollectionManager()
+
+    class Meta:
+        indexes = [
+            # コレクション一覧のページング用
+            models.Index(fields=['user', '-created', '-id'],
+                         name='feed_mstcol_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
 
+@receiver(post_save, sender=MstCollection)
+@receiver(post_delete, sender=MstCollection)
+def clear_collection_cache(sender, instance, **kwargs):
+    """コレクション変更後にサイドバーのキャッシュを削除する."""
+    cache.delete(MstCollection.objects.cache_key(instance.user_id))
+
+
 class Collection(TimeStampModel):
     """コレクションに入れるチャンネルを管理する."""
     mst_collection = models.ForeignKey(
@@ -143,6 +448,13 @@ class Collection(TimeStampModel):
     episode = models.ForeignKey(Episode, on_delete=models.CASCADE)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # コレクション詳細のページング用
+            models.Index(fields=['mst_collection', '-created', '-id'],
+                         name='feed_col_mst_created_idx'),
+        ]
+
     def __str__(self):
         return self.episode.title
 
@@ -192,3 +504,83 @@ class Tag(TimeStampModel):
 
     def __str__(self):
         return self.mst_tag.name
+
+
+class PollLog(TimeStampModel):
+    """フィード取得ごとの結果を保持する."""
+    SUCCESS = 'success'
+    NOT_MODIFIED = 'not_modified'
+    INVALID = 'invalid'
+    ERROR = 'error'
+    STATUS_CHOICES = (
+        (SUCCESS, '更新'),
+        (NOT_MODIFIED, '変更なし'),
+        (INVALID, 'フィード不正'),
+        (ERROR, '取得失敗'),
+    )
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    http_status = models.IntegerField(null=True, blank=True)
+    # レスポンスボディのバイト数と、取得・パースにかかった秒数
+    bytes = models.IntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    new_episodes = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['channel', '-created'],
+                         name='feed_polllog_ch_created_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.channel_id, self.status)
+
+
+class Job(TimeStampModel):
+    """バックグラウンドで実行する処理を保持する.
+
+    Note:
+        run_workers コマンドが status='pending' のジョブを取り出して実行する.
+        失敗したジョブは run_after を延ばして再実行する.
+    """
+    REGISTER_CHANNEL = 'register_channel'
+    POLL_CHANNEL = 'poll_channel'
+    SAVE_IMAGE = 'save_image'
+    KIND_CHOICES = (
+        (REGISTER_CHANNEL, 'チャンネル登録'),
+        (POLL_CHANNEL, 'フィード取得'),
+        (SAVE_IMAGE, '画像保存'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, '待機中'),
+        (RUNNING, '実行中'),
+        (DONE, '完了'),
+        (FAILED, '失敗'),
+    )
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    channel = models.ForeignKey(
+        Channel, null=True, blank=True, on_delete=models.CASCADE)
+    # ジョブの引数(画像URLなど)
+    argument = models.CharField(max_length=2000, null=True, blank=True)
+    # 重複登録を防ぐキー. 同じキーの未完了ジョブは 1 件のみ. 完了時にクリアする
+    key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    # この日時以降に実行する
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'],
+                         name='feed_job_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.kind, self.channel_id, self.status)
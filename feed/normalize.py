@@ -0,0 +1,96 @@
+"""Feed URL の正規化.
+
+同じフィードが表記の揺れで別のチャンネルとして登録されないよう、
+登録・取得の前に Feed URL を正規化する.
+"""
+from urllib.parse import urlsplit, urlunsplit
+
+# 取得内容に影響しない計測用のクエリパラメータ
+TRACKING_PARAMS = ('fbclid', 'gclid', 'mc_cid', 'mc_eid')
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def is_tracking_param(name):
+    """計測用のクエリパラメータの場合 True."""
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_feed_url(url):
+    """Feed URL を正規化する.
+
+    Note:
+        スキーム・ホスト名を小文字にし、既定のポート番号、フラグメント、
+        計測用のクエリパラメータを取り除く.
+        http と https、末尾のスラッシュの違いは別の URL として残し、
+        同じフィードかどうかは feed_url_variants で判定する.
+
+    Arguments:
+        url(str) -- Feed URL
+    Return:
+        url(str) -- 正規化した Feed URL. 解釈できない場合は前後の空白のみ除く
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        host = parts.hostname or ''
+        port = parts.port
+    except ValueError:
+        return url
+    if scheme not in DEFAULT_PORTS or not host:
+        return url
+
+    netloc = '[%s]' % host if ':' in host else host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = '%s:%d' % (netloc, port)
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    netloc = userinfo + at + netloc
+
+    # 値の符号化を変えないよう、文字列のまま取り除く
+    query = '&'.join(
+        param for param in parts.query.split('&')
+        if param and not is_tracking_param(param.split('=', 1)[0]))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def feed_url_variants(url, original=None):
+    """同じフィードとみなす Feed URL の表記を返す.
+
+    Note:
+        http と https、末尾のスラッシュの有無が異なる表記を同じフィードとみなす.
+        正規化する前に登録されたチャンネルも探せるよう、正規化前の URL を含められる.
+
+    Arguments:
+        url(str) -- 正規化した Feed URL
+        original(str) -- 正規化前の Feed URL
+    Return:
+        urls(list) -- url を先頭にした Feed URL のリスト
+    """
+    candidates = []
+    parts = urlsplit(url)
+    if parts.scheme in DEFAULT_PORTS:
+        candidates.extend(get_scheme_and_slash_variants(parts))
+    candidates.append((original or '').strip())
+
+    variants = [url]
+    for variant in candidates:
+        if variant and variant not in variants:
+            variants.append(variant)
+    return variants
+
+
+def get_scheme_and_slash_variants(parts):
+    """http/https と末尾のスラッシュの有無を入れ替えた Feed URL を返す."""
+    paths = [parts.path]
+    if parts.path.endswith('/') and parts.path != '/':
+        paths.append(parts.path.rstrip('/'))
+    elif not parts.path.endswith('/'):
+        paths.append(parts.path + '/')
+
+    for scheme in (parts.scheme, 'https' if parts.scheme == 'http' else 'http'):
+        for path in paths:
+            yield urlunsplit(
+                (scheme, parts.netloc, path, parts.query, parts.fragment))
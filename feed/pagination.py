@@ -0,0 +1,133 @@
+"""キーセット(カーソル)方式のページング.
+
+OFFSET を使わず、前ページ最後の行の並び順キーより後ろの行を取得するため、
+深いページでも先頭ページと同じコストで取得できる.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404, JsonResponse
+
+
+def encode_cursor(values):
+    """並び順キーの値をカーソル文字列にする."""
+    raw = json.dumps([str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """カーソル文字列を並び順キーの値(文字列)に戻す."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        values = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeError):
+        raise Http404('Invalid cursor')
+    if not isinstance(values, list):
+        raise Http404('Invalid cursor')
+    return values
+
+
+class KeysetPage:
+    """キーセット方式の 1 ページ分の結果."""
+
+    def __init__(self, object_list, next_cursor, has_previous):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginationMixin:
+    """ListView をキーセット方式でページングする Mixin クラス.
+
+    Note:
+        keyset_ordering の最後は一意なフィールドにする.
+        Ajax リクエストには get_ajax_item で変換した JSON を返す.
+    """
+    paginate_by = 20
+    keyset_ordering = ('-created', '-id')
+    cursor_kwarg = 'cursor'
+
+    def get_ordering(self):
+        return self.keyset_ordering
+
+    def get_cursor_filter(self, queryset, cursor):
+        """カーソル以降の行を取得する条件を作る."""
+        values = decode_cursor(cursor)
+        if len(values) != len(self.keyset_ordering):
+            raise Http404('Invalid cursor')
+
+        opts = queryset.model._meta
+        keys = []
+        for name, raw in zip(self.keyset_ordering, values):
+            field = opts.get_field(name.lstrip('-'))
+            try:
+                keys.append((name, field.to_python(raw)))
+            except ValidationError:
+                raise Http404('Invalid cursor')
+
+        # (a, b) > (x, y) を a > x OR (a = x AND b > y) に展開する
+        condition = Q()
+        for i, (name, value) in enumerate(keys):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            term = Q(**{'%s__%s' % (name.lstrip('-'), lookup): value})
+            for prev_name, prev_value in keys[:i]:
+                term &= Q(**{prev_name.lstrip('-'): prev_value})
+            condition |= term
+        return condition
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        queryset = queryset.order_by(*self.keyset_ordering)
+        if cursor:
+            queryset = queryset.filter(
+                self.get_cursor_filter(queryset, cursor))
+
+        # 1 件多く取得して次ページの有無を判定する
+        object_list = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            last = object_list[-1]
+            next_cursor = encode_cursor([
+                getattr(last, name.lstrip('-'))
+                for name in self.keyset_ordering
+            ])
+
+        page = KeysetPage(object_list, next_cursor, bool(cursor))
+        return None, page, object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        context['next_cursor'] = page.next_cursor if page else None
+        return context
+
+    def get_ajax_item(self, obj):
+        """Ajax レスポンス用に 1 行分のデータを作る."""
+        return {'id': str(obj.pk)}
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.is_ajax():
+            return JsonResponse({
+                'items': [self.get_ajax_item(obj)
+                          for obj in context['object_list']],
+                'next_cursor': context['next_cursor'],
+            })
+        return super().render_to_response(context, **response_kwargs)
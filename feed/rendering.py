@@ -0,0 +1,38 @@
+"""ShowNote などのテキストを HTML に変換する.
+
+Markdown インスタンスの生成は拡張機能の読み込みなどでコストがかかるため、
+スレッドごとに 1 つ生成して使い回す.
+"""
+import threading
+
+import markdown
+
+_local = threading.local()
+
+
+def get_markdown():
+    """現在のスレッド用の Markdown インスタンスを返す.
+
+    Note:
+        Markdown インスタンスはスレッドセーフではないため、スレッド間で共有しない.
+    """
+    md = getattr(_local, 'markdown', None)
+    if md is None:
+        md = _local.markdown = markdown.Markdown()
+    return md
+
+
+def render_markdown(text):
+    """Markdown 形式のテキストを HTML に変換する.
+
+    Arguments:
+        text(str) -- Markdown 形式のテキスト
+    Return:
+        html(str) -- 変換後の HTML
+    """
+    if not text:
+        return ''
+    md = get_markdown()
+    # 前回変換時の状態(脚注など)を持ち越さないようにする
+    md.reset()
+    return md.convert(text)
@@ -0,0 +1,364 @@
+"""RSS 2.0 フィードを lxml の iterparse で逐次パースする.
+
+feedparser は文書全体から FeedParserDict の木を作るため、数千件のエピソードを持つ
+フィードではパースの CPU 時間とメモリ使用量が大きい.
+ここでは <item> ごとに要素を破棄しながら、必要な項目だけを持つ小さなレコードを作る.
+エントリは反復した分だけパースするため、登録済のエピソードで打ち切れば
+残りの文書はパースしない.
+lxml のパーサはスレッド間で共有できないため、パーサを作ったスレッドで使い終え、
+取得したスレッドと登録するスレッドが異なっても問題ないようにする.
+
+レコードは feedparser の結果と同じ属性名を持ち、値がない属性は持たない
+(hasattr で判定できる). RSS 2.0 以外の形式や XML として不正な文書は
+feedparser でパースする.
+"""
+import cgi
+import logging
+from collections import namedtuple
+from io import BytesIO
+from urllib.parse import urljoin
+
+import feedparser
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# iTunes 拡張の名前空間. 大文字小文字の揺れがあるため小文字で比較する
+ITUNES_NAMESPACE = 'http://www.itunes.com/dtds/podcast-1.0.dtd'
+
+# 逐次パースする文字コード. それ以外は feedparser に任せる
+ENCODINGS = ('utf-8', 'utf8', 'us-ascii', 'ascii')
+
+# feedparser の *_detail に相当する
+Detail = namedtuple('Detail', ['type'])
+# feedparser の links の要素に相当する
+Link = namedtuple('Link', ['rel', 'type', 'href'])
+
+PLAIN = Detail('text/plain')
+HTML = Detail('text/html')
+
+
+class Feed:
+    """<channel> の内容. feedparser の feed と同じ属性名を持つ."""
+    __slots__ = ('title', 'title_detail', 'link', 'author', 'description',
+                 'description_detail', 'image')
+
+
+class Entry:
+    """<item> の内容. feedparser のエントリと同じ属性名を持つ."""
+    __slots__ = ('title', 'title_detail', 'link', 'links', 'itunes_duration',
+                 'published_parsed', 'description_detail', '_description',
+                 '_sanitized')
+
+    @property
+    def description(self):
+        """エピソード説明. HTML の場合は最初に読み出す時に無害化する.
+
+        Note:
+            無害化した値は保持する. 説明の有無は description_detail で判定する.
+        """
+        try:
+            return self._sanitized
+        except AttributeError:
+            pass
+        value = self._description
+        if self.description_detail is HTML:
+            value = sanitize(value)
+        self._sanitized = value
+        return value
+
+
+class ParsedFeed:
+    """逐次パースしたフィード. feedparser.parse の結果と同じく feed, entries を持つ.
+
+    Arguments:
+        feed(Feed) -- チャンネルの内容
+        content(bytes) -- レスポンスボディ
+        response_headers(dict) -- content-type, content-location を含むヘッダ
+    """
+    version = 'rss20'
+
+    def __init__(self, feed, content, response_headers):
+        self.feed = feed
+        self.entries = Entries(feed, content, response_headers)
+
+
+class Entries:
+    """フィードのエントリ. 反復した分だけ文書をパースする.
+
+    Note:
+        パース済のエントリは保持し、何度でも先頭から反復できる.
+        lxml のパーサはスレッド間で共有できないため、反復ごとに
+        反復するスレッドでパーサを作り、パース済の件数を読み飛ばす.
+        パーサは反復を終えた時点で破棄する.
+    """
+
+    def __init__(self, feed, content, response_headers):
+        self._feed = feed
+        self._content = content
+        self._response_headers = response_headers
+        self._items = []
+        self._done = False
+
+    def __iter__(self):
+        index = 0
+        parser = None
+        position = 0
+        try:
+            while True:
+                if index < len(self._items):
+                    yield self._items[index]
+                    index += 1
+                    continue
+                if self._done:
+                    return
+                # 他の反復が先にパースした場合は、その続きからパースし直す
+                if parser is None or position != len(self._items):
+                    if parser is not None:
+                        parser.close()
+                    position = len(self._items)
+                    parser = iter_entries(
+                        self._feed, self._content, self._response_headers,
+                        skip=position)
+                entry = next(parser, None)
+                if entry is None:
+                    self._done = True
+                    return
+                position += 1
+                self._items.append(entry)
+        finally:
+            if parser is not None:
+                parser.close()
+
+
+def sanitize(value):
+    """HTML を feedparser と同じ方法で無害化する."""
+    return feedparser._sanitizeHTML(value, 'utf-8', 'text/html')
+
+
+def get_detail(value):
+    """テキスト要素の種類を返す. feedparser と同じく HTML に見える場合は text/html."""
+    if feedparser._FeedParserMixin.lookslikehtml(value):
+        return HTML
+    return PLAIN
+
+
+def get_name(elem):
+    """要素名を返す. iTunes 拡張は 'itunes:' を付け、その他の名前空間は None."""
+    tag = elem.tag
+    if not isinstance(tag, str):
+        return None
+    if tag[0] != '{':
+        return tag
+    namespace, name = tag[1:].split('}', 1)
+    if namespace.lower() == ITUNES_NAMESPACE:
+        return 'itunes:' + name
+    return None
+
+
+def get_text(elem):
+    """要素の内容を返す. 子要素があれば HTML として含める."""
+    if not len(elem):
+        return (elem.text or '').strip()
+    parts = [elem.text or '']
+    for child in elem:
+        parts.append(etree.tostring(child, encoding='unicode', with_tail=True))
+    return ''.join(parts).strip()
+
+
+def set_title(record, elem):
+    """タイトルを設定する. 複数ある場合は最初の要素を使う."""
+    if hasattr(record, 'title'):
+        return
+    value = get_text(elem)
+    record.title_detail = get_detail(value)
+    if record.title_detail is HTML:
+        value = sanitize(value)
+    record.title = value
+
+
+def release(elem):
+    """処理済の要素と、それより前の兄弟要素を破棄する."""
+    elem.clear()
+    parent = elem.getparent()
+    while elem.getprevious() is not None:
+        del parent[0]
+
+
+def read_channel_element(feed, elem, base_url):
+    """<channel> 直下の要素をチャンネルの内容に反映する."""
+    name = get_name(elem)
+    if name == 'title':
+        set_title(feed, elem)
+    elif name == 'link':
+        feed.link = urljoin(base_url, get_text(elem))
+    elif name in ('itunes:author', 'managingEditor'):
+        feed.author = get_text(elem)
+    elif name == 'description':
+        # itunes:summary があればそちらを優先する
+        if not hasattr(feed, 'description'):
+            feed.description = sanitize(get_text(elem))
+            feed.description_detail = HTML
+    elif name == 'itunes:summary':
+        value = get_text(elem)
+        feed.description_detail = get_detail(value)
+        if feed.description_detail is HTML:
+            value = sanitize(value)
+        feed.description = value
+    elif name == 'itunes:image':
+        if elem.get('href'):
+            feed.image = {'href': elem.get('href')}
+    elif name == 'image':
+        for child in elem:
+            if get_name(child) == 'url':
+                feed.image = {'href': get_text(child)}
+
+
+def read_item(elem, base_url):
+    """<item> の内容からエントリを作る.
+
+    Arguments:
+        elem(Element) -- <item> 要素
+        base_url(str) -- 相対URLの基準とするフィードURL
+    Return:
+        entry(Entry) -- エントリ
+    """
+    entry = Entry()
+    links = []
+    guid = None
+    for child in elem:
+        name = get_name(child)
+        if name == 'title':
+            set_title(entry, child)
+        elif name == 'link' and not hasattr(entry, 'link'):
+            entry.link = urljoin(base_url, get_text(child))
+            links.append(Link('alternate', 'text/html', entry.link))
+        elif name == 'description' and not hasattr(entry, '_description'):
+            entry._description = get_text(child)
+            entry.description_detail = HTML
+        elif name == 'itunes:summary' and not hasattr(entry, '_description'):
+            entry._description = get_text(child)
+            entry.description_detail = get_detail(entry._description)
+        elif name == 'enclosure':
+            links.append(Link('enclosure', (child.get('type') or '').lower(),
+                              child.get('url', '')))
+        elif name == 'guid':
+            if (child.get('isPermaLink') or 'true').lower() == 'true':
+                guid = get_text(child)
+        elif name == 'pubDate':
+            entry.published_parsed = feedparser._parse_date(get_text(child))
+        elif name == 'itunes:duration':
+            entry.itunes_duration = get_text(child)
+
+    # feedparser と同じく、リンクがなければパーマリンクの GUID を使う
+    if not hasattr(entry, 'link') and guid:
+        entry.link = guid
+    if links:
+        entry.links = links
+    return entry
+
+
+def read_header(events, base_url):
+    """文書の先頭から最初の <item> までを読み、チャンネルの内容を返す.
+
+    Arguments:
+        events(iterparse) -- パースイベント
+        base_url(str) -- 相対URLの基準とするフィードURL
+    Return:
+        feed(Feed) -- チャンネルの内容. RSS でない場合は None
+        channel(Element) -- <channel> 要素. ない場合は None
+    """
+    event, root = next(events)
+    if root.tag != 'rss':
+        return None, None
+
+    feed = Feed()
+    channel = None
+    for event, elem in events:
+        if event == 'start':
+            if channel is None:
+                if elem.tag == 'channel' and elem.getparent() is root:
+                    channel = elem
+            elif elem.tag == 'item' and elem.getparent() is channel:
+                break
+        elif channel is not None and elem.getparent() is channel:
+            read_channel_element(feed, elem, base_url)
+            release(elem)
+    return feed, channel
+
+
+def iter_entries(feed, content, response_headers, skip=0):
+    """<item> を 1 件ずつパースしてエントリを返す.
+
+    Note:
+        呼び出したスレッドでパーサを作り、文書の先頭からパースする.
+        <item> より後にあるチャンネルの要素もチャンネルの内容に反映する.
+        途中で XML として不正な箇所があった場合、残りのエントリは
+        feedparser でパースし直した結果から返す.
+
+    Arguments:
+        feed(Feed) -- チャンネルの内容
+        content(bytes) -- レスポンスボディ
+        response_headers(dict) -- content-type, content-location を含むヘッダ
+        skip(int) -- 読み飛ばすエントリ数
+    """
+    base_url = (response_headers or {}).get('content-location', '')
+    count = 0
+    try:
+        events = iterparse(content)
+        _, channel = read_header(events, base_url)
+        for event, elem in events:
+            if event != 'end' or elem.getparent() is not channel:
+                continue
+            if elem.tag == 'item':
+                count += 1
+                entry = read_item(elem, base_url) if count > skip else None
+                release(elem)
+                if entry is not None:
+                    yield entry
+            else:
+                read_channel_element(feed, elem, base_url)
+                release(elem)
+    except etree.XMLSyntaxError as e:
+        logger.warning('logue rss falls back to feedparser after %d entries '
+                       'of "%s": %s', count, base_url, e)
+        parsed = feedparser.parse(content, response_headers=response_headers)
+        yield from parsed.entries[max(count, skip):]
+
+
+def iterparse(content):
+    """文書を逐次パースするイベントを返す."""
+    return etree.iterparse(
+        BytesIO(content), events=('start', 'end'),
+        resolve_entities=False, remove_comments=True, remove_pis=True)
+
+
+def parse(content, response_headers=None):
+    """フィードをパースする.
+
+    Note:
+        UTF-8 の RSS 2.0 は逐次パースし、それ以外は feedparser でパースする.
+        逐次パースの場合はチャンネルの内容のみパースし、エントリは
+        反復した時にパースする.
+
+    Arguments:
+        content(bytes) -- レスポンスボディ
+        response_headers(dict) -- content-type, content-location を含むヘッダ
+    Return:
+        parsed(ParsedFeed) -- パース結果. feedparser の場合は FeedParserDict
+    """
+    headers = response_headers or {}
+    base_url = headers.get('content-location', '')
+    charset = cgi.parse_header(headers.get('content-type', ''))[1].get(
+        'charset', 'utf-8')
+    if charset.lower() in ENCODINGS:
+        try:
+            feed, channel = read_header(iterparse(content), base_url)
+        except etree.XMLSyntaxError as e:
+            logger.info('logue rss falls back to feedparser for "%s": %s',
+                        base_url, e)
+        else:
+            # パーサはこのスレッドで破棄し、エントリは反復するスレッドでパースする
+            if feed is not None:
+                return ParsedFeed(feed, content, response_headers)
+    return feedparser.parse(content, response_headers=response_headers)
@@ -0,0 +1,146 @@
+"""チャンネルごとの次回取得日時を決める.
+
+直近エピソードの配信間隔を学習し、頻繁に配信するチャンネルは短い間隔で、
+休止中・エラーが続くチャンネルは長い間隔で取得する.
+"""
+import datetime
+import logging
+from statistics import median
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 配信間隔の学習に使うエピソード数
+SAMPLE_SIZE = 10
+# 配信間隔あたりの取得回数
+POLLS_PER_PERIOD = 6
+# 配信間隔が学習できない場合の取得間隔
+DEFAULT_INTERVAL = datetime.timedelta(hours=6)
+MIN_INTERVAL = datetime.timedelta(minutes=30)
+MAX_INTERVAL = datetime.timedelta(days=2)
+# エラー時の再取得間隔. 連続エラー回数に応じて倍々に延ばす
+RETRY_INTERVAL = datetime.timedelta(minutes=30)
+MAX_RETRY_INTERVAL = datetime.timedelta(days=7)
+# 連続エラー回数がこの回数に達したチャンネルは、取得を停止する
+MAX_ERROR_COUNT = 12
+
+
+def learn_publish_interval(published_times):
+    """エピソードの配信日時から配信間隔を求める.
+
+    Arguments:
+        published_times(list) -- 配信日時. 新しい順
+    Return:
+        interval(int) -- 配信間隔の中央値(秒). 求められない場合は None
+    """
+    times = [t for t in published_times if t is not None]
+    gaps = [
+        (newer - older).total_seconds()
+        for newer, older in zip(times, times[1:])
+        if newer > older
+    ]
+    if not gaps:
+        return None
+    return int(median(gaps))
+
+
+def get_poll_interval(publish_interval, last_published, now):
+    """次回取得までの間隔を求める.
+
+    Arguments:
+        publish_interval(int) -- 配信間隔(秒)
+        last_published(datetime) -- 最新エピソードの配信日時
+        now(datetime) -- 現在日時
+    Return:
+        interval(timedelta) -- 取得間隔
+    """
+    if not publish_interval:
+        return DEFAULT_INTERVAL
+
+    period = datetime.timedelta(seconds=publish_interval)
+    # 最新エピソードから配信間隔の倍以上経っていれば休止中とみなし、
+    # 経過時間に合わせて取得間隔を延ばす
+    if last_published and now - last_published > period * 2:
+        period = now - last_published
+
+    interval = period / POLLS_PER_PERIOD
+    return max(MIN_INTERVAL, min(interval, MAX_INTERVAL))
+
+
+def get_retry_interval(error_count):
+    """連続エラー回数から再取得までの間隔を求める."""
+    # 上限を超える桁の計算でオーバーフローしないよう指数を抑える
+    exponent = min(max(error_count - 1, 0), 16)
+    interval = RETRY_INTERVAL * (2 ** exponent)
+    return min(interval, MAX_RETRY_INTERVAL)
+
+
+def schedule_next_poll(feed_url, now=None):
+    """取得成功後に次回取得日時と最終取得日を設定する.
+
+    Arguments:
+        feed_url(str) -- Feed URL
+        now(datetime) -- 現在日時
+    """
+    now = now or timezone.now()
+    published_times = list(
+        models.Episode.objects.filter(channel__feed_url=feed_url)
+        .order_by('-published_time')
+        .values_list('published_time', flat=True)[:SAMPLE_SIZE])
+
+    publish_interval = learn_publish_interval(published_times)
+    last_published = published_times[0] if published_times else None
+    interval = get_poll_interval(publish_interval, last_published, now)
+
+    models.Channel.objects.filter(feed_url=feed_url).update(
+        next_poll_at=now + interval,
+        publish_interval=publish_interval,
+        poll_error_count=0,
+        last_polled_time=now)
+
+
+def schedule_retry(feed_url, now=None):
+    """取得失敗後に次回取得日時を設定する.
+
+    Note:
+        連続エラー回数が MAX_ERROR_COUNT に達した場合、チャンネルを無効にする.
+    Arguments:
+        feed_url(str) -- Feed URL
+        now(datetime) -- 現在日時
+    """
+    now = now or timezone.now()
+    channel = models.Channel.objects.filter(feed_url=feed_url).only(
+        'poll_error_count').first()
+    if channel is None:
+        return
+
+    error_count = channel.poll_error_count + 1
+    values = {
+        'next_poll_at': now + get_retry_interval(error_count),
+        'poll_error_count': error_count,
+    }
+    if error_count >= MAX_ERROR_COUNT:
+        # エラーが続くフィードは停止したものとみなし、取得対象から外す
+        logger.warning('logue get_feeds gave up "%s" after %d errors',
+                       feed_url, error_count)
+        values['is_active'] = False
+    models.Channel.objects.filter(pk=channel.pk).update(**values)
+
+
+def due_channels(now=None):
+    """取得予定日時を過ぎたチャンネルを優先度順に取得する.
+
+    Note:
+        無効なチャンネルは除く.
+        一度も取得していないチャンネルを先頭に、
+        取得予定日時の古い順に並べる.
+    """
+    now = now or timezone.now()
+    return models.Channel.objects.filter(
+        Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now),
+        is_active=True,
+    ).order_by(F('next_poll_at').asc(nulls_first=True))
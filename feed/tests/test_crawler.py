@@ -0,0 +1,141 @@
+"""フィード巡回のテスト"""
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from feed import crawler, utils
+from feed.models import Channel
+from feed.tests.test_utils import make_response
+
+
+class InterleaveByHostTest(SimpleTestCase):
+    """ホスト単位の並べ替え"""
+    def test_interleave(self):
+        """同一ホストの Feed URL が連続しない."""
+        urls = [
+            'https://a.example.com/1.rss',
+            'https://a.example.com/2.rss',
+            'https://a.example.com/3.rss',
+            'https://b.example.com/1.rss',
+            'https://c.example.com/1.rss',
+        ]
+        channels = [Channel(feed_url=url) for url in urls]
+        actual = crawler.interleave_by_host(channels)
+        self.assertEqual([ch.feed_url for ch in actual], [
+            'https://a.example.com/1.rss',
+            'https://b.example.com/1.rss',
+            'https://c.example.com/1.rss',
+            'https://a.example.com/2.rss',
+            'https://a.example.com/3.rss',
+        ])
+
+
+class PollChannelsTest(SimpleTestCase):
+    """並行取得"""
+    def setUp(self):
+        patcher = mock.patch('feed.crawler.scheduler')
+        self.scheduler = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('feed.crawler.jobs')
+        self.jobs = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_per_host_limit(self):
+        """ホスト単位の同時リクエスト数が上限を超えない."""
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def fetch(feed_url, **kwargs):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+            return utils.FeedResponse(200, {'feed_url': feed_url}, None, None)
+
+        channels = [Channel(feed_url='https://same.example.com/%d.rss' % i)
+                    for i in range(10)]
+        with mock.patch('feed.utils.fetch_feed', side_effect=fetch), \
+                mock.patch('feed.utils.store_feed', return_value='success'):
+            results = crawler.poll_channels(channels, workers=8, per_host=2)
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(set(results.values()), {'success'})
+        self.assertLessEqual(state['peak'], 2)
+
+    def test_bounded_pending(self):
+        """取得処理は上限の数までしか投入しない."""
+        consumed = []
+        lag = []
+
+        def fetch(feed_url, **kwargs):
+            index = int(feed_url.rsplit('/', 1)[1].split('.')[0])
+            lag.append(index - len(consumed))
+            return utils.FeedResponse(200, None, None, None)
+
+        channels = [Channel(feed_url='https://%d.example.com/%d.rss' % (i, i))
+                    for i in range(20)]
+        with mock.patch('feed.utils.fetch_feed', side_effect=fetch), \
+                mock.patch('feed.utils.store_feed', return_value=''):
+            crawler.poll_channels(channels, workers=1,
+                                  callback=consumed.append)
+
+        self.assertEqual(len(consumed), 20)
+        self.assertLess(max(lag), crawler.PENDING_PER_WORKER)
+
+    def test_parse_in_fetch_threads(self):
+        """取得スレッドでパースしたフィードのエントリを書き込みスレッドで読める."""
+        titles = {}
+        lock = threading.Lock()
+
+        def store(response, feed_url, with_image=True):
+            entries = [entry.title for entry in response.parsed.entries]
+            with lock:
+                titles[feed_url] = entries
+            return 'success'
+
+        channels = [Channel(feed_url='https://%d.example.com/test.rss' % i)
+                    for i in range(30)]
+        with mock.patch('feed.http.get',
+                        side_effect=lambda *args, **kwargs: make_response()), \
+                mock.patch('feed.utils.store_feed', side_effect=store):
+            results = crawler.poll_channels(channels, workers=8, db_workers=2)
+
+        self.assertEqual(set(results.values()), {'success'})
+        self.assertEqual(set(map(tuple, titles.values())), {('ep2', 'ep1')})
+
+    def test_fetch_failure(self):
+        """取得に失敗したフィードは結果を記録し、再取得を予定する."""
+        channels = [Channel(feed_url='https://a.example.com/ok.rss'),
+                    Channel(feed_url='https://b.example.com/ng.rss')]
+
+        def fetch(feed_url, **kwargs):
+            if 'ng' in feed_url:
+                raise ValueError('boom')
+            return utils.FeedResponse(200, {'feed_url': feed_url}, None, None)
+
+        def store(response, feed_url, with_image=True):
+            self.assertFalse(with_image)
+            return '' if response.error else 'success'
+
+        with mock.patch('feed.utils.fetch_feed', side_effect=fetch), \
+                mock.patch('feed.utils.store_feed', side_effect=store) as store:
+            results = crawler.poll_channels(channels)
+
+        self.assertEqual(results, {
+            'https://a.example.com/ok.rss': 'success',
+            'https://b.example.com/ng.rss': '',
+        })
+        failed = [call[0][0] for call in store.call_args_list
+                  if call[0][1] == 'https://b.example.com/ng.rss']
+        self.assertEqual(failed[0].error, 'boom')
+        self.scheduler.schedule_next_poll.assert_called_once_with(
+            'https://a.example.com/ok.rss')
+        # 画像は書き込みスレッドで取得せず、画像保存ジョブに任せる
+        self.jobs.enqueue_image.assert_called_once_with(
+            channels[0], mock.ANY)
+        self.scheduler.schedule_retry.assert_called_once_with(
+            'https://b.example.com/ng.rss')
@@ -0,0 +1,20 @@
+"""HTTP クライアントのテスト"""
+from django.test import SimpleTestCase
+
+from feed import http
+
+
+class SessionTest(SimpleTestCase):
+    """共有の Session"""
+    def test_shared(self):
+        """全ての取得処理で同じ Session を使う."""
+        self.assertIs(http.get_session(), http.get_session())
+
+    def test_pool(self):
+        """ホストごとのコネクションプールと共通のヘッダを設定する."""
+        session = http.build_session()
+        adapter = session.get_adapter('https://example.com/test.rss')
+        self.assertEqual(adapter._pool_connections, http.POOL_CONNECTIONS)
+        self.assertEqual(adapter._pool_maxsize, http.POOL_MAXSIZE)
+        self.assertEqual(session.headers['User-Agent'], http.USER_AGENT)
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
@@ -0,0 +1,91 @@
+"""チャンネル画像のサムネイルのテスト"""
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from feed import images
+from feed.models import Channel
+
+
+def make_png(size=1000):
+    """透過付きの PNG データを作る."""
+    out = BytesIO()
+    Image.new('RGBA', (size, size), (255, 0, 0, 128)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class RenditionTest(TestCase):
+    """サムネイル生成"""
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media_root,
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_make_rendition(self):
+        """指定サイズに収まる JPEG に変換する."""
+        content = images.make_rendition(BytesIO(make_png()), 145)
+        img = Image.open(BytesIO(content))
+        self.assertEqual(img.format, 'JPEG')
+        self.assertEqual(img.size, (145, 145))
+
+    def test_save_renditions(self):
+        """元画像と同じ場所にサイズごとのサムネイルを保存する."""
+        self.assertTrue(
+            images.save_renditions('images/abc.png', BytesIO(make_png())))
+        for size in images.RENDITION_SIZES:
+            self.assertTrue(default_storage.exists('images/abc_%d.jpg' % size))
+
+        images.delete_renditions('images/abc.png')
+        self.assertFalse(default_storage.exists('images/abc_60.jpg'))
+
+    def test_decode_once(self):
+        """元画像は 1 度だけ開き、サイズごとに縮小する."""
+        with mock.patch('feed.images.Image.open', side_effect=Image.open) \
+                as image_open:
+            contents = images.make_renditions(
+                BytesIO(make_png()), images.RENDITION_SIZES)
+
+        self.assertEqual(image_open.call_count, 1)
+        for size in images.RENDITION_SIZES:
+            img = Image.open(BytesIO(contents[size]))
+            self.assertEqual(img.size, (size, size))
+
+    def test_invalid_image(self):
+        """画像として読み込めない場合は保存しない."""
+        self.assertFalse(
+            images.save_renditions('images/abc.png', BytesIO(b'<html>')))
+        self.assertFalse(default_storage.exists('images/abc_60.jpg'))
+
+    def test_channel_cover_image(self):
+        """サムネイルがなければ元画像のパスを返す."""
+        channel = Channel(feed_url='https://example.com/test.rss',
+                          cover_image='images/abc.png')
+        self.assertEqual(channel.cover_image_60, 'images/abc.png')
+        channel.has_renditions = True
+        self.assertEqual(channel.cover_image_60, 'images/abc_60.jpg')
+        self.assertEqual(channel.cover_image_400, 'images/abc_400.jpg')
+
+    def test_make_thumbnails_command(self):
+        """サムネイル未作成のチャンネルにサムネイルを作成する."""
+        default_storage.save('images/abc.png', ContentFile(make_png()))
+        channel = Channel.objects.create(
+            feed_url='https://example.com/test.rss', cover_image='images/abc.png')
+
+        call_command('make_thumbnails', stdout=StringIO())
+
+        channel.refresh_from_db()
+        self.assertTrue(channel.has_renditions)
+        self.assertTrue(default_storage.exists('images/abc_145.jpg'))
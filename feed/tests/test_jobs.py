@@ -0,0 +1,225 @@
+"""バックグラウンドジョブのテスト"""
+import datetime
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
+import feedparser
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from feed import jobs, utils
+from feed.models import Channel, Episode, Job
+from feed.tests.test_utils import FEED_URL, SAMPLE_RSS, make_png
+
+SAMPLE_RSS_WITH_IMAGE = SAMPLE_RSS.replace(
+    b'<itunes:author>tester</itunes:author>',
+    b'<itunes:author>tester</itunes:author>'
+    b'<itunes:image href="https://example.com/cover.png"/>')
+
+
+class RegisterChannelJobTest(TestCase):
+    """チャンネル登録ジョブ"""
+    def setUp(self):
+        self.channel = Channel.objects.create(feed_url=FEED_URL)
+        self.job = jobs.enqueue(Job.REGISTER_CHANNEL, self.channel)
+
+    def run_pending(self, response):
+        with mock.patch('feed.utils.fetch_feed', return_value=response), \
+                mock.patch('feed.utils.save_image', return_value=''):
+            return jobs.run_pending()
+
+    def test_register(self):
+        """フィードを取得してチャンネル・エピソードを登録する."""
+        response = utils.FeedResponse(
+            200, feedparser.parse(SAMPLE_RSS), '"abc"', None)
+        self.assertEqual(self.run_pending(response), 1)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, Job.DONE)
+        self.assertEqual(self.job.attempts, 1)
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.title, 'examplefm')
+        self.assertIsNotNone(self.channel.next_poll_at)
+        self.assertEqual(Episode.objects.filter(channel=self.channel).count(), 2)
+
+    def test_invalid_feed(self):
+        """フィードとして不正な場合はチャンネルを無効にする."""
+        response = utils.FeedResponse(
+            200, feedparser.parse(b'<html></html>'), None, None)
+        self.run_pending(response)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, Job.FAILED)
+        self.assertIn('not a valid podcast feed', self.job.last_error)
+        self.channel.refresh_from_db()
+        self.assertFalse(self.channel.is_active)
+
+    def test_claim_once(self):
+        """実行中のジョブは他のワーカーが取り出さない."""
+        self.assertEqual(jobs.claim_job().pk, self.job.pk)
+        self.assertIsNone(jobs.claim_job())
+
+    def test_command(self):
+        """run_workers --once で実行可能なジョブを実行して終了する."""
+        response = utils.FeedResponse(None, None, None, None, error='timeout')
+        with mock.patch('feed.utils.fetch_feed', return_value=response):
+            call_command('run_workers', once=True, stdout=StringIO())
+
+        # 取得に失敗した場合は時間をおいて再実行する
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, Job.PENDING)
+        self.assertGreater(self.job.run_after, timezone.now())
+        self.assertIn('timeout', self.job.last_error)
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+    def test_image_job(self):
+        """画像は別のジョブで保存する."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        default_storage.save('images/abc.png', ContentFile(make_png()))
+
+        response = utils.FeedResponse(
+            200, feedparser.parse(SAMPLE_RSS_WITH_IMAGE), None, None)
+        with mock.patch('feed.utils.fetch_feed', return_value=response), \
+                mock.patch('feed.utils.save_image') as save_image:
+            jobs.run_pending(kinds=[Job.REGISTER_CHANNEL])
+            save_image.assert_not_called()
+
+            image_job = Job.objects.get(kind=Job.SAVE_IMAGE)
+            self.assertEqual(image_job.argument, 'https://example.com/cover.png')
+            save_image.return_value = 'images/abc.png'
+            jobs.run_pending(kinds=[Job.SAVE_IMAGE])
+
+        save_image.assert_called_once_with(
+            'https://example.com/cover.png', mock.ANY)
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.cover_image.name, 'images/abc.png')
+        self.assertEqual(self.channel.title, 'examplefm')
+
+
+class PollChannelJobTest(TestCase):
+    """フィード取得ジョブ"""
+    def test_not_modified(self):
+        """変更がない場合、チャンネルの UPDATE は次回取得日時の設定のみ."""
+        channel = Channel.objects.create(feed_url=FEED_URL, etag='"abc"')
+        job = jobs.enqueue(Job.POLL_CHANNEL, channel)
+        response = utils.FeedResponse(304, None, '"abc"', None)
+        with mock.patch('feed.utils.fetch_feed', return_value=response), \
+                CaptureQueriesContext(connection) as queries:
+            jobs.poll_channel(job)
+
+        updates = [q['sql'] for q in queries
+                   if q['sql'].startswith('UPDATE "feed_channel"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"next_poll_at"', updates[0])
+
+
+class JobQueueTest(TestCase):
+    """ジョブキュー"""
+    def setUp(self):
+        self.channel = Channel.objects.create(feed_url=FEED_URL)
+
+    def test_idempotency_key(self):
+        """同じキーの未完了ジョブは 1 件のみ登録する."""
+        job = jobs.enqueue(Job.POLL_CHANNEL, self.channel, key='poll:1')
+        self.assertEqual(
+            jobs.enqueue(Job.POLL_CHANNEL, self.channel, key='poll:1'), job)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # 完了後は同じキーで登録できる
+        with mock.patch.dict(jobs.HANDLERS, {Job.POLL_CHANNEL: mock.Mock()}):
+            jobs.run_pending()
+        jobs.enqueue(Job.POLL_CHANNEL, self.channel, key='poll:1')
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_retry_backoff(self):
+        """失敗したジョブは間隔を倍々に延ばして再実行し、上限回数で失敗とする."""
+        job = jobs.enqueue(Job.POLL_CHANNEL, self.channel, key='poll:1')
+        handler = mock.Mock(side_effect=ValueError('boom'))
+        delays = []
+        with mock.patch.dict(jobs.HANDLERS, {Job.POLL_CHANNEL: handler}):
+            for _ in range(jobs.MAX_ATTEMPTS):
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                before = timezone.now()
+                self.assertEqual(jobs.run_pending(), 1)
+                job.refresh_from_db()
+                delays.append(job.run_after - before)
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, jobs.MAX_ATTEMPTS)
+        self.assertIn('boom', job.last_error)
+        self.assertIsNone(job.key)
+        self.assertGreater(delays[2], delays[1])
+        self.assertGreater(delays[1], delays[0])
+
+    def test_concurrency_limit(self):
+        """種類ごとの同時実行数の上限を超えて取り出さない."""
+        for i in range(jobs.CONCURRENCY[Job.SAVE_IMAGE] + 1):
+            jobs.enqueue(Job.SAVE_IMAGE, self.channel)
+        jobs.enqueue(Job.POLL_CHANNEL, self.channel)
+
+        claimed = [jobs.claim_job() for _ in range(4)]
+        kinds = [job.kind for job in claimed if job is not None]
+        self.assertEqual(kinds.count(Job.SAVE_IMAGE),
+                         jobs.CONCURRENCY[Job.SAVE_IMAGE])
+        self.assertEqual(kinds.count(Job.POLL_CHANNEL), 1)
+        self.assertIsNone(claimed[-1])
+
+    def test_requeue_stale(self):
+        """実行中のまま残ったジョブは再実行する."""
+        job = jobs.enqueue(Job.POLL_CHANNEL, self.channel)
+        self.assertEqual(jobs.claim_job().pk, job.pk)
+
+        later = timezone.now() + jobs.STALE_AFTER * 2
+        self.assertEqual(jobs.claim_job(now=later).pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+
+    def test_heartbeat(self):
+        """実行中のジョブは更新日時を定期的に更新し、再実行しない."""
+        job = jobs.enqueue(Job.POLL_CHANNEL, self.channel)
+        job = jobs.claim_job()
+        beat = threading.Event()
+        with mock.patch.object(jobs, 'HEARTBEAT_INTERVAL',
+                               datetime.timedelta(milliseconds=10)), \
+                mock.patch('feed.jobs.touch_job',
+                           side_effect=lambda job: beat.set()):
+            with jobs.heartbeat(job):
+                self.assertTrue(beat.wait(5))
+
+        later = timezone.now() + jobs.STALE_AFTER * 2
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            jobs.touch_job(job)
+        self.assertIsNone(jobs.claim_job(now=later))
+
+    def test_prune(self):
+        """保存期間を過ぎた完了・失敗したジョブを削除する."""
+        for status in (Job.DONE, Job.FAILED, Job.PENDING):
+            Job.objects.create(kind=Job.POLL_CHANNEL, status=status)
+
+        later = timezone.now() + jobs.JOB_RETENTION * 2
+        self.assertEqual(jobs.prune_jobs(now=later), 2)
+        self.assertEqual(Job.objects.get().status, Job.PENDING)
+
+    def test_enqueue_polls(self):
+        """poll_feeds --enqueue で取得予定のチャンネルのジョブを登録する."""
+        call_command('poll_feeds', enqueue=True, stdout=StringIO())
+        call_command('poll_feeds', enqueue=True, stdout=StringIO())
+
+        job = Job.objects.get()
+        self.assertEqual(job.kind, Job.POLL_CHANNEL)
+        self.assertEqual(job.channel, self.channel)
+        # 未完了のジョブがあるチャンネルは数えない
+        self.assertEqual(jobs.enqueue_polls([self.channel]), 0)
@@ -1,11 +1,16 @@
 """モデル単位のテスト"""
+import datetime
+from unittest import mock
+
 import pytest
 
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.test import TestCase
 
 from django import forms
-from feed.models import Channel, Episode, Subscription, Like, MstCollection
+from feed.models import (Channel, Episode, Subscription, Like, MstCollection,
+                         TrendingEpisode, TRENDING_HALF_LIFE)
 from accounts.models import LogueUser
 
 
@@ -32,6 +37,14 @@ class ChannelModelTest(TestCase):
         actual = ch_result.link
         self.assertEqual(actual, 'https://example.com')
 
+    def test_unique_feed_url(self):
+        """
+        同じ Feed URL のチャンネルは登録できない.
+        """
+        Channel.objects.create(feed_url='https://example.com/test.rss')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Channel.objects.create(feed_url='https://example.com/test.rss')
+
 
 class EpisodeModelTest(TestCase):
     """
@@ -137,3 +150,98 @@ class LikeModelTest(TestCase):
         self.assertEqual(actual, 'test@example.com')
         actual = like.episode.title
         self.assertEqual(actual, 'test_title')
+
+    def test_unique_like(self):
+        """
+        同じユーザーが同じエピソードを重複して Like できない
+        """
+        user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        ch = Channel.objects.create(feed_url='https://example.com/test.rss')
+        ep = Episode.objects.create(
+            channel=ch, audio_url='http://files.example.fm/exampple-ep27.mp3')
+        Like.objects.create(episode=ep, user=user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(episode=ep, user=user)
+
+
+class TrendingEpisodeModelTest(TestCase):
+    """
+    トレンドモデル
+    """
+    def setUp(self):
+        self.user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        self.other = LogueUser.objects.create_user(
+            email='other@example.com', password='testtesttest')
+        ch = Channel.objects.create(feed_url='https://example.com/test.rss')
+        self.old_ep = Episode.objects.create(
+            channel=ch, title='old', audio_url='http://files.example.fm/old.mp3')
+        self.new_ep = Episode.objects.create(
+            channel=ch, title='new', audio_url='http://files.example.fm/new.mp3')
+
+    def like(self, episode, user, days_ago):
+        like = Like.objects.create(episode=episode, user=user)
+        created = timezone.now() - datetime.timedelta(days=days_ago)
+        Like.objects.filter(pk=like.pk).update(created=created)
+        return like
+
+    def test_time_decay(self):
+        """
+        古い Like より新しい Like のスコアが高い
+        """
+        self.like(self.old_ep, self.user, 0)
+        self.like(self.old_ep, self.other, 0)
+        self.like(self.new_ep, self.user, 0)
+        # Like 日時を書き換えたため再計算する
+        TrendingEpisode.objects.rebuild()
+        self.assertEqual(TrendingEpisode.objects.order_by('-score')[0].episode,
+                         self.old_ep)
+
+        Like.objects.filter(episode=self.old_ep).update(
+            created=timezone.now() - TRENDING_HALF_LIFE * 3)
+        TrendingEpisode.objects.rebuild()
+        self.assertEqual(TrendingEpisode.objects.order_by('-score')[0].episode,
+                         self.new_ep)
+
+    def test_incremental_update(self):
+        """
+        Like の追加・削除に応じてスコアが更新される
+        """
+        like = Like.objects.create(episode=self.new_ep, user=self.user)
+        Like.objects.create(episode=self.new_ep, user=self.other)
+        incremental = TrendingEpisode.objects.get(episode=self.new_ep).score
+        TrendingEpisode.objects.rebuild()
+        rebuilt = TrendingEpisode.objects.get(episode=self.new_ep).score
+        self.assertAlmostEqual(incremental, rebuilt)
+
+        like.delete()
+        Like.objects.filter(episode=self.new_ep).delete()
+        self.assertFalse(
+            TrendingEpisode.objects.filter(episode=self.new_ep).exists())
+
+
+class EpisodeDescriptionTest(TestCase):
+    """ShowNote の HTML 変換"""
+    def setUp(self):
+        self.channel = Channel.objects.create(feed_url='https://example.com/test.rss')
+
+    def test_render_once(self):
+        """初回に変換した HTML を保存し、以降は変換しない."""
+        ep = Episode.objects.create(
+            channel=self.channel, audio_url='http://files.example.fm/ep1.mp3',
+            description='**bold**')
+        self.assertEqual(ep.get_description_html(), '<p><strong>bold</strong></p>')
+
+        ep = Episode.objects.get(pk=ep.pk)
+        self.assertEqual(ep.description_html, '<p><strong>bold</strong></p>')
+        with mock.patch('feed.models.render_markdown') as render, \
+                self.assertNumQueries(0):
+            ep.get_description_html()
+        render.assert_not_called()
+
+    def test_empty_description(self):
+        """ShowNote がない場合は空文字を返す."""
+        ep = Episode.objects.create(
+            channel=self.channel, audio_url='http://files.example.fm/ep1.mp3')
+        self.assertEqual(ep.get_description_html(), '')
@@ -0,0 +1,54 @@
+"""Feed URL の正規化のテスト"""
+from django.test import SimpleTestCase
+
+from feed.normalize import feed_url_variants, normalize_feed_url
+
+
+class NormalizeFeedUrlTest(SimpleTestCase):
+    """Feed URL の正規化"""
+    def test_normalize(self):
+        """表記の揺れを取り除く."""
+        self.assertEqual(
+            normalize_feed_url(' HTTPS://Example.COM:443/Feed.rss#top '),
+            'https://example.com/Feed.rss')
+        self.assertEqual(normalize_feed_url('http://example.com'),
+                         'http://example.com/')
+        self.assertEqual(normalize_feed_url('http://example.com:8080/a'),
+                         'http://example.com:8080/a')
+
+    def test_tracking_params(self):
+        """計測用のクエリパラメータのみ取り除き、他は符号化を変えない."""
+        self.assertEqual(
+            normalize_feed_url('https://example.com/feed?utm_source=x'
+                               '&id=a%2Fb&fbclid=1&q=%E3%81%82'),
+            'https://example.com/feed?id=a%2Fb&q=%E3%81%82')
+
+    def test_not_http(self):
+        """http(s) 以外は前後の空白のみ除く."""
+        self.assertEqual(normalize_feed_url(' feed://Example.com/a '),
+                         'feed://Example.com/a')
+        self.assertEqual(normalize_feed_url('https://example.com:x/'),
+                         'https://example.com:x/')
+
+    def test_variants(self):
+        """http/https と末尾のスラッシュの違いを同じフィードとみなす."""
+        self.assertEqual(feed_url_variants('https://example.com/feed'), [
+            'https://example.com/feed',
+            'https://example.com/feed/',
+            'http://example.com/feed',
+            'http://example.com/feed/',
+        ])
+        self.assertEqual(feed_url_variants('http://example.com/'), [
+            'http://example.com/',
+            'https://example.com/',
+        ])
+
+    def test_variants_with_original(self):
+        """正規化前の URL も含める."""
+        self.assertEqual(
+            feed_url_variants('https://example.com/',
+                              ' HTTPS://Example.com/?utm_source=x '), [
+                'https://example.com/',
+                'http://example.com/',
+                'HTTPS://Example.com/?utm_source=x',
+            ])
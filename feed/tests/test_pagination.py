@@ -0,0 +1,76 @@
+"""キーセット方式のページングのテスト"""
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import LogueUser
+from feed.models import Channel, Episode, Like
+from feed.pagination import decode_cursor, encode_cursor
+
+
+class CursorTest(TestCase):
+    """カーソル文字列"""
+    def test_round_trip(self):
+        """並び順キーの値をカーソルにして元に戻せる."""
+        cursor = encode_cursor(['2018-10-01 10:00:00+00:00', 'abc'])
+        self.assertEqual(decode_cursor(cursor),
+                         ['2018-10-01 10:00:00+00:00', 'abc'])
+
+
+class LikeListPaginationTest(TestCase):
+    """Like 一覧のページング"""
+    def setUp(self):
+        self.user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        channel = Channel.objects.create(feed_url='https://example.com/test.rss')
+        now = timezone.now()
+        for i in range(25):
+            episode = Episode.objects.create(
+                channel=channel, title='ep%d' % i,
+                audio_url='https://files.example.com/%d.mp3' % i)
+            like = Like.objects.create(episode=episode, user=self.user)
+            # 作成日時が同じ行も ID で順序が決まることを確認する
+            Like.objects.filter(pk=like.pk).update(created=now)
+        self.client.force_login(self.user)
+        self.url = reverse('feed:like_list')
+
+    def test_pages(self):
+        """カーソルをたどると全件を重複なく取得できる."""
+        response = self.client.get(self.url)
+        first = list(response.context['likes'])
+        cursor = response.context['next_cursor']
+        self.assertEqual(len(first), 20)
+        self.assertIsNotNone(cursor)
+
+        response = self.client.get(self.url, {'cursor': cursor})
+        second = list(response.context['likes'])
+        self.assertEqual(len(second), 5)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(len({like.pk for like in first + second}), 25)
+
+    def test_ajax(self):
+        """Ajax リクエストには JSON を返す."""
+        response = self.client.get(
+            self.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = response.json()
+        self.assertEqual(len(data['items']), 20)
+        self.assertIn('title', data['items'][0])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_invalid_cursor(self):
+        """不正なカーソルの場合は 404 を返す."""
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_queries(self):
+        """2 ページ目以降も先頭ページと同じクエリ数で取得できる."""
+        # サイドバーのキャッシュを作成しておく
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(self.url)
+        cursor = response.context['next_cursor']
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(len(first), len(second))
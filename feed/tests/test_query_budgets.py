@@ -0,0 +1,90 @@
+"""画面ごとのクエリ数のテスト
+
+一覧の件数によらず、決まったクエリ数で表示できることを確認する.
+クエリ数が予算を超えた場合は N+1 の可能性があるため、テストを失敗させる.
+"""
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import LogueUser
+from feed.models import (Channel, Collection, Episode, Like, MstCollection,
+                         Subscription)
+
+
+class QueryBudgetTestCase(TestCase):
+    """クエリ数の予算を確認する TestCase."""
+    # 一覧の行数
+    sizes = (1, 10)
+
+    def setUp(self):
+        cache.clear()
+        self.user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        self.mst = MstCollection.objects.create(title='col', user=self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        """一覧に表示されるデータを count 件追加する."""
+        for _ in range(count):
+            i = self.rows
+            self.rows += 1
+            channel = Channel.objects.create(
+                title='ch%d' % i,
+                feed_url='https://example.com/%d.rss' % i,
+                cover_image='images/%d.png' % i)
+            episode = Episode.objects.create(
+                channel=channel, title='ep%d' % i,
+                audio_url='https://files.example.com/%d.mp3' % i)
+            Subscription.objects.create(channel=channel, user=self.user)
+            Like.objects.create(episode=episode, user=self.user)
+            Collection.objects.create(mst_collection=self.mst, episode=episode)
+
+    def assertQueryBudget(self, url, budget, login=True):
+        """一覧の行数を増やしてもクエリ数が budget に収まることを確認する.
+
+        Note:
+            サイドバーのキャッシュが有効な状態で計測する.
+        """
+        if login:
+            self.client.force_login(self.user)
+        for size in self.sizes:
+            self.add_rows(size - self.rows)
+            self.client.get(url)
+            with self.subTest(rows=size), self.assertNumQueries(budget):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class ListViewQueryBudgetTest(QueryBudgetTestCase):
+    """一覧画面のクエリ数"""
+    def test_index(self):
+        self.assertQueryBudget(reverse('feed:index'), 4)
+
+    def test_index_anonymous(self):
+        self.assertQueryBudget(reverse('feed:index'), 2, login=False)
+
+    def test_like_list(self):
+        self.assertQueryBudget(reverse('feed:like_list'), 3)
+
+    def test_channels(self):
+        self.assertQueryBudget(reverse('feed:channels'), 3)
+
+    def test_collection_list(self):
+        self.assertQueryBudget(reverse('feed:col_list'), 3)
+
+    def test_collection_detail(self):
+        self.assertQueryBudget(
+            reverse('feed:col_detail', kwargs={'mst_coll_id': self.mst.id}), 4)
+
+
+class StaticPageQueryBudgetTest(QueryBudgetTestCase):
+    """静的ページのクエリ数"""
+    def test_terms_anonymous(self):
+        self.assertQueryBudget(reverse('feed:terms'), 0, login=False)
+
+    def test_privacy_anonymous(self):
+        self.assertQueryBudget(reverse('feed:privacy'), 0, login=False)
+
+    def test_terms(self):
+        self.assertQueryBudget(reverse('feed:terms'), 2)
@@ -0,0 +1,96 @@
+"""RSS の逐次パースのテスト"""
+from itertools import islice
+from unittest import mock
+
+import feedparser
+from django.test import TestCase
+
+from feed import rss, utils
+from feed.models import Channel
+from feed.tests.test_utils import SAMPLE_RSS
+
+HEADERS = {
+    'content-type': 'application/rss+xml; charset=UTF-8',
+    'content-location': 'https://example.com/test.rss',
+}
+
+FEED_ATTRS = ('title', 'link', 'author', 'description')
+ENTRY_ATTRS = ('title', 'link', 'description', 'itunes_duration',
+               'published_parsed')
+
+
+class ParseTest(TestCase):
+    """RSS 2.0 の逐次パース"""
+    def test_same_as_feedparser(self):
+        """feedparser と同じ値を返す."""
+        expected = feedparser.parse(SAMPLE_RSS, response_headers=HEADERS)
+        parsed = rss.parse(SAMPLE_RSS, HEADERS)
+
+        self.assertIsInstance(parsed, rss.ParsedFeed)
+        for attr in FEED_ATTRS:
+            self.assertEqual(getattr(parsed.feed, attr),
+                             getattr(expected.feed, attr), attr)
+        self.assertEqual(parsed.feed.title_detail.type,
+                         expected.feed.title_detail.type)
+        entries = list(parsed.entries)
+        self.assertEqual(len(entries), len(expected.entries))
+        for entry, other in zip(entries, expected.entries):
+            for attr in ENTRY_ATTRS:
+                self.assertEqual(getattr(entry, attr), getattr(other, attr),
+                                 attr)
+            self.assertEqual(entry.title_detail.type, other.title_detail.type)
+            self.assertEqual(entry.description_detail.type,
+                             other.description_detail.type)
+            self.assertEqual([(l.type, l.href) for l in entry.links],
+                             [(l.type, l.href) for l in other.links])
+
+    def test_missing_attributes(self):
+        """値がない項目は属性を持たない."""
+        parsed = rss.parse(
+            b'<rss version="2.0"><channel><title>t</title>'
+            b'<item><title>ep</title></item></channel></rss>', HEADERS)
+        entry = next(iter(parsed.entries))
+        self.assertFalse(hasattr(parsed.feed, 'image'))
+        self.assertFalse(hasattr(entry, 'description'))
+        self.assertFalse(hasattr(entry, 'links'))
+
+    def test_sanitize_once(self):
+        """説明は参照した時に 1 度だけ無害化する."""
+        parsed = rss.parse(SAMPLE_RSS, HEADERS)
+        entry = next(iter(parsed.entries))
+        channel = Channel(feed_url='https://example.com/test.rss')
+
+        with mock.patch('feed.rss.sanitize',
+                        side_effect=rss.sanitize) as sanitize:
+            self.assertTrue(utils.get_audio_url(entry, channel))
+            sanitize.assert_not_called()
+            self.assertEqual(entry.description, 'second')
+            self.assertEqual(entry.description, 'second')
+        self.assertEqual(sanitize.call_count, 1)
+
+    def test_stop_early(self):
+        """反復した分だけパースし、以降の不正な箇所は読まない."""
+        content = SAMPLE_RSS.replace(b'<title>ep1</title>', b'<title>ep1')
+        parsed = rss.parse(content, HEADERS)
+
+        with mock.patch('feed.rss.feedparser.parse') as parse:
+            first = list(islice(parsed.entries, 1))
+        self.assertEqual(first[0].title, 'ep2')
+        parse.assert_not_called()
+
+        # 不正な箇所以降は feedparser でパースし直す
+        with mock.patch('feed.rss.feedparser.parse') as parse:
+            parse.return_value.entries = ['entry1', 'entry2']
+            self.assertEqual(list(parsed.entries)[1:], ['entry2'])
+
+    def test_fallback(self):
+        """RSS 2.0 以外・UTF-8 以外のフィードは feedparser でパースする."""
+        atom = (b'<feed xmlns="http://www.w3.org/2005/Atom">'
+                b'<title>t</title></feed>')
+        self.assertNotIsInstance(rss.parse(atom, HEADERS), rss.ParsedFeed)
+
+        headers = dict(HEADERS, **{'content-type': 'text/xml; charset=Shift_JIS'})
+        self.assertNotIsInstance(rss.parse(SAMPLE_RSS, headers), rss.ParsedFeed)
+
+        self.assertNotIsInstance(rss.parse(b'not xml', HEADERS),
+                                 rss.ParsedFeed)
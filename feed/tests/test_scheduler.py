@@ -0,0 +1,109 @@
+"""取得スケジュールのテスト"""
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from feed import scheduler
+from feed.models import Channel, Episode
+
+DAY = datetime.timedelta(days=1)
+
+
+class PollIntervalTest(TestCase):
+    """取得間隔の計算"""
+    def test_learn_publish_interval(self):
+        """配信間隔の中央値を求める."""
+        now = timezone.now()
+        times = [now, now - DAY, now - DAY * 2, now - DAY * 9]
+        actual = scheduler.learn_publish_interval(times)
+        self.assertEqual(actual, DAY.total_seconds())
+
+    def test_daily_show(self):
+        """毎日配信のチャンネルは短い間隔で取得する."""
+        now = timezone.now()
+        actual = scheduler.get_poll_interval(
+            DAY.total_seconds(), now - datetime.timedelta(hours=3), now)
+        self.assertEqual(actual, datetime.timedelta(hours=4))
+
+    def test_dormant_show(self):
+        """休止中のチャンネルは取得間隔を延ばす."""
+        now = timezone.now()
+        actual = scheduler.get_poll_interval(
+            DAY.total_seconds(), now - DAY * 30, now)
+        self.assertEqual(actual, scheduler.MAX_INTERVAL)
+
+    def test_retry_backoff(self):
+        """連続エラー回数に応じて再取得間隔を延ばす."""
+        self.assertEqual(scheduler.get_retry_interval(1),
+                         scheduler.RETRY_INTERVAL)
+        self.assertEqual(scheduler.get_retry_interval(3),
+                         scheduler.RETRY_INTERVAL * 4)
+        self.assertEqual(scheduler.get_retry_interval(100),
+                         scheduler.MAX_RETRY_INTERVAL)
+
+
+class ScheduleTest(TestCase):
+    """次回取得日時の設定"""
+    def setUp(self):
+        self.channel = Channel.objects.create(
+            feed_url='https://example.com/test.rss', poll_error_count=2)
+
+    def test_schedule_next_poll(self):
+        """取得成功後は配信間隔を学習し、エラー回数をリセットする."""
+        now = timezone.now()
+        for i in range(3):
+            Episode.objects.create(
+                channel=self.channel,
+                audio_url='https://files.example.com/%d.mp3' % i,
+                published_time=now - DAY * i)
+
+        scheduler.schedule_next_poll(self.channel.feed_url, now=now)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.publish_interval, DAY.total_seconds())
+        self.assertEqual(self.channel.poll_error_count, 0)
+        self.assertEqual(self.channel.next_poll_at,
+                         now + datetime.timedelta(hours=4))
+        self.assertEqual(self.channel.last_polled_time, now)
+
+    def test_schedule_retry(self):
+        """取得失敗後はエラー回数を増やし、再取得を遅らせる."""
+        now = timezone.now()
+        scheduler.schedule_retry(self.channel.feed_url, now=now)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.poll_error_count, 3)
+        self.assertEqual(self.channel.next_poll_at,
+                         now + scheduler.RETRY_INTERVAL * 4)
+
+    def test_due_channels(self):
+        """取得予定日時を過ぎたチャンネルを優先度順に返す."""
+        now = timezone.now()
+        Channel.objects.filter(pk=self.channel.pk).update(
+            next_poll_at=now - DAY)
+        never = Channel.objects.create(feed_url='https://example.com/new.rss')
+        later = Channel.objects.create(
+            feed_url='https://example.com/later.rss',
+            next_poll_at=now - datetime.timedelta(hours=1))
+        Channel.objects.create(
+            feed_url='https://example.com/future.rss',
+            next_poll_at=now + DAY)
+
+        actual = list(scheduler.due_channels(now=now))
+        self.assertEqual(actual, [never, self.channel, later])
+
+    def test_circuit_breaker(self):
+        """エラーが続くチャンネルは無効にし、取得対象から外す."""
+        now = timezone.now()
+        Channel.objects.filter(pk=self.channel.pk).update(
+            poll_error_count=scheduler.MAX_ERROR_COUNT - 2)
+        scheduler.schedule_retry(self.channel.feed_url, now=now)
+        self.channel.refresh_from_db()
+        self.assertTrue(self.channel.is_active)
+
+        scheduler.schedule_retry(self.channel.feed_url, now=now)
+        self.channel.refresh_from_db()
+        self.assertFalse(self.channel.is_active)
+        self.assertNotIn(
+            self.channel, scheduler.due_channels(now=now + DAY * 30))
@@ -0,0 +1,531 @@
+"""フィード取得処理のテスト"""
+import hashlib
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+import feedparser
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from feed import utils
+from feed.models import Channel, Episode, PollLog
+
+SAMPLE_RSS = b'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">
+  <channel>
+    <title>examplefm</title>
+    <link>https://example.com</link>
+    <description>testtesttest</description>
+    <itunes:author>tester</itunes:author>
+    <item>
+      <title>ep2</title>
+      <link>https://example.com/ep2</link>
+      <description>second</description>
+      <pubDate>Tue, 02 Oct 2018 10:00:00 +0900</pubDate>
+      <itunes:duration>35:12</itunes:duration>
+      <enclosure url="https://files.example.com/ep2.mp3" type="audio/mpeg" length="1"/>
+    </item>
+    <item>
+      <title>ep1</title>
+      <link>https://example.com/ep1</link>
+      <description>first</description>
+      <pubDate>Mon, 01 Oct 2018 10:00:00 +0900</pubDate>
+      <itunes:duration>30:00</itunes:duration>
+      <enclosure url="https://files.example.com/ep1.mp3" type="audio/mpeg" length="1"/>
+    </item>
+  </channel>
+</rss>
+'''
+
+FEED_URL = 'https://example.com/test.rss'
+
+
+def make_response(status_code=200, content=SAMPLE_RSS, headers=None):
+    """requests のレスポンスを模したオブジェクトを作る."""
+    res = mock.MagicMock()
+    res.status_code = status_code
+    res.content = content
+    res.headers = headers or {}
+    res.url = FEED_URL
+    res.iter_content.side_effect = lambda chunk_size=1: (
+        content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+    return res
+
+
+def make_png(color=(255, 0, 0)):
+    """PNG 画像のデータを作る."""
+    out = BytesIO()
+    Image.new('RGB', (100, 100), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+class ConditionalGetTest(TestCase):
+    """条件付き GET"""
+    def test_send_validators(self):
+        """保持している ETag / Last-Modified をリクエストに付与する."""
+        with mock.patch('feed.http.get',
+                        return_value=make_response(304)) as get:
+            response = utils.fetch_feed(
+                FEED_URL, etag='"abc"',
+                modified='Mon, 01 Oct 2018 01:00:00 GMT')
+
+        headers = get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"abc"')
+        self.assertEqual(
+            headers['If-Modified-Since'], 'Mon, 01 Oct 2018 01:00:00 GMT')
+        self.assertEqual(response.status, 304)
+        self.assertIsNone(response.parsed)
+
+    def test_store_validators(self):
+        """取得したフィードの ETag / Last-Modified を保存する."""
+        res = make_response(headers={
+            'etag': '"abc"',
+            'last-modified': 'Mon, 01 Oct 2018 01:00:00 GMT',
+        })
+        with mock.patch('feed.http.get', return_value=res), \
+                mock.patch('feed.utils.save_image', return_value=''):
+            result = utils.get_feed(FEED_URL)
+
+        self.assertEqual(result, 'success')
+        channel = Channel.objects.get(feed_url=FEED_URL)
+        self.assertEqual(channel.etag, '"abc"')
+        self.assertEqual(channel.last_modified, 'Mon, 01 Oct 2018 01:00:00 GMT')
+        self.assertEqual(Episode.objects.filter(channel=channel).count(), 2)
+
+    def test_not_modified(self):
+        """304 の場合はチャンネル、エピソードを更新しない."""
+        channel = Channel.objects.create(feed_url=FEED_URL, etag='"abc"')
+        response = utils.FeedResponse(304, None, '"abc"', None)
+        with mock.patch('feed.utils.save_channel') as save_channel, \
+                mock.patch('feed.utils.save_episodes') as save_episodes:
+            result = utils.store_feed(response, FEED_URL)
+
+        self.assertEqual(result, 'not_modified')
+        save_channel.assert_not_called()
+        save_episodes.assert_not_called()
+        # 最終取得日は scheduler.schedule_next_poll のみが更新する
+        channel.refresh_from_db()
+        self.assertIsNone(channel.last_polled_time)
+
+    def test_stored_by_another_worker(self):
+        """待っている間に同じ内容が登録済であれば、登録しない."""
+        res = make_response()
+        with mock.patch('feed.http.get', return_value=res):
+            response = utils.fetch_feed(FEED_URL)
+        Channel.objects.create(feed_url=FEED_URL,
+                               feed_body_hash=response.digest)
+
+        with mock.patch('feed.utils.save_channel') as save_channel, \
+                mock.patch('feed.utils.save_episodes') as save_episodes:
+            result = utils.store_feed(response, FEED_URL)
+
+        self.assertEqual(result, 'not_modified')
+        save_channel.assert_not_called()
+        save_episodes.assert_not_called()
+
+    def test_failed_ingest(self):
+        """エピソードの登録に失敗した場合は ETag / Last-Modified を保存しない."""
+        res = make_response(headers={
+            'etag': '"v1"',
+            'last-modified': 'Mon, 01 Oct 2018 01:00:00 GMT',
+        })
+        with mock.patch('feed.http.get', return_value=res), \
+                mock.patch('feed.utils.save_image', return_value=''), \
+                mock.patch('feed.models.Episode.objects.bulk_create',
+                           side_effect=ValueError('boom')):
+            with self.assertRaises(ValueError):
+                utils.get_feed(FEED_URL)
+
+        channel = Channel.objects.get(feed_url=FEED_URL)
+        self.assertIsNone(channel.etag)
+        self.assertIsNone(channel.last_modified)
+        self.assertIsNone(channel.feed_body_hash)
+
+    def test_same_body(self):
+        """ETag がなくても、本文が前回と同じ場合はパース・登録しない."""
+        with mock.patch('feed.http.get', return_value=make_response()), \
+                mock.patch('feed.utils.save_image', return_value=''):
+            utils.get_feed(FEED_URL)
+        channel = Channel.objects.get(feed_url=FEED_URL)
+        self.assertIsNotNone(channel.feed_body_hash)
+
+        with mock.patch('feed.http.get', return_value=make_response()), \
+                mock.patch('feed.rss.parse') as parse:
+            response = utils.fetch_feed(
+                FEED_URL, digest=channel.feed_body_hash)
+        parse.assert_not_called()
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.not_modified)
+
+        with mock.patch('feed.utils.save_channel') as save_channel, \
+                mock.patch('feed.utils.save_episodes') as save_episodes:
+            result = utils.store_feed(response, FEED_URL)
+        self.assertEqual(result, 'not_modified')
+        save_channel.assert_not_called()
+        save_episodes.assert_not_called()
+        log = PollLog.objects.latest('created')
+        self.assertEqual(log.status, PollLog.NOT_MODIFIED)
+        self.assertEqual(log.http_status, 200)
+
+
+class RedirectTest(TestCase):
+    """恒久的なリダイレクト"""
+    def make_redirect(self, status_code, location):
+        """リダイレクト後のレスポンスを作る."""
+        hop = mock.MagicMock(status_code=status_code, url=FEED_URL)
+        res = make_response()
+        res.url = location
+        res.history = [hop]
+        return res
+
+    def test_moved_permanently(self):
+        """恒久的に転送された場合、転送先を Feed URL として保存する."""
+        location = 'https://new.example.com/test.rss'
+        Channel.objects.create(feed_url=FEED_URL)
+        with mock.patch('feed.http.get',
+                        return_value=self.make_redirect(301, location)):
+            response = utils.fetch_feed(FEED_URL)
+
+        self.assertEqual(response.location, location)
+        self.assertEqual(utils.save_redirect(FEED_URL, response), location)
+        self.assertTrue(Channel.objects.filter(feed_url=location).exists())
+        self.assertFalse(Channel.objects.filter(feed_url=FEED_URL).exists())
+
+    def test_moved_temporarily(self):
+        """一時的な転送の場合は Feed URL を変更しない."""
+        with mock.patch('feed.http.get', return_value=self.make_redirect(
+                302, 'https://new.example.com/test.rss')):
+            response = utils.fetch_feed(FEED_URL)
+        self.assertIsNone(response.location)
+
+    def test_too_long(self):
+        """転送先が Feed URL に保存できない長さの場合は変更しない."""
+        location = 'https://new.example.com/%s.rss' % ('a' * 200)
+        Channel.objects.create(feed_url=FEED_URL)
+        response = utils.FeedResponse(200, None, None, None, location=location)
+
+        self.assertEqual(utils.save_redirect(FEED_URL, response), FEED_URL)
+        self.assertTrue(Channel.objects.filter(feed_url=FEED_URL).exists())
+
+    def test_stored_variant(self):
+        """正規化前の URL や http/https の違いで登録済のチャンネルを使う."""
+        legacy = 'HTTP://Example.com/test.rss?utm_source=x'
+        Channel.objects.create(feed_url=legacy)
+        Channel.objects.create(feed_url='http://example.com/other.rss')
+
+        self.assertEqual(utils.find_feed_url(
+            'http://example.com/test.rss', legacy), legacy)
+        self.assertEqual(utils.find_feed_url(
+            'https://example.com/other.rss'), 'http://example.com/other.rss')
+        self.assertEqual(utils.find_feed_url(FEED_URL), FEED_URL)
+
+        with mock.patch('feed.http.get', return_value=make_response()), \
+                mock.patch('feed.utils.save_image', return_value=''):
+            self.assertEqual(utils.get_feed(legacy), 'success')
+        self.assertEqual(Channel.objects.count(), 2)
+        self.assertEqual(Channel.objects.get(feed_url=legacy).title,
+                         'examplefm')
+
+    def test_already_registered(self):
+        """転送先が登録済の場合は Feed URL を変更しない."""
+        location = 'https://new.example.com/test.rss'
+        Channel.objects.create(feed_url=FEED_URL)
+        Channel.objects.create(feed_url=location)
+        response = utils.FeedResponse(200, None, None, None, location=location)
+
+        self.assertEqual(utils.save_redirect(FEED_URL, response), FEED_URL)
+        self.assertTrue(Channel.objects.filter(feed_url=FEED_URL).exists())
+
+
+class PollLogTest(TestCase):
+    """フィード取得結果の記録"""
+    def setUp(self):
+        self.channel = Channel.objects.create(feed_url=FEED_URL)
+
+    def test_success(self):
+        """取得成功時はバイト数と新規エピソード数を記録する."""
+        with mock.patch('feed.http.get', return_value=make_response()), \
+                mock.patch('feed.utils.save_image', return_value=''):
+            utils.get_feed(FEED_URL)
+
+        log = PollLog.objects.get(channel=self.channel)
+        self.assertEqual(log.status, PollLog.SUCCESS)
+        self.assertEqual(log.http_status, 200)
+        self.assertEqual(log.bytes, len(SAMPLE_RSS))
+        self.assertEqual(log.new_episodes, 2)
+        self.assertIsNotNone(log.duration)
+
+    def test_http_error(self):
+        """HTTP エラー時はステータスコードとエラーを記録する."""
+        with mock.patch('feed.http.get', return_value=make_response(500)):
+            response = utils.fetch_feed(FEED_URL)
+        self.assertEqual(response.status, 500)
+        self.assertIsNone(response.parsed)
+
+        self.assertEqual(utils.store_feed(response, FEED_URL), '')
+        log = PollLog.objects.get(channel=self.channel)
+        self.assertEqual(log.status, PollLog.ERROR)
+        self.assertEqual(log.http_status, 500)
+        self.assertEqual(log.error, 'HTTP 500')
+
+    def test_invalid_feed(self):
+        """フィードとして不正な場合はエラー内容を記録する."""
+        res = make_response(content=b'<rss version="2.0"><channel>'
+                                    b'<title>t</title></channel></rss>')
+        with mock.patch('feed.http.get', return_value=res):
+            self.assertEqual(utils.get_feed(FEED_URL), '')
+
+        log = PollLog.objects.get(channel=self.channel)
+        self.assertEqual(log.status, PollLog.INVALID)
+        self.assertIn('has no entries', log.error)
+
+    def test_prune(self):
+        """保存期間を過ぎた記録を削除する."""
+        PollLog.objects.create(channel=self.channel, status=PollLog.SUCCESS)
+        later = timezone.now() + utils.POLL_LOG_RETENTION * 2
+        self.assertEqual(utils.prune_poll_logs(now=later), 1)
+
+
+class SaveChannelTest(TestCase):
+    """チャンネルの更新"""
+    def setUp(self):
+        self.parsed = feedparser.parse(SAMPLE_RSS)
+        channel = Channel.objects.create(feed_url=FEED_URL)
+        utils.save_channel(self.parsed, channel, with_image=False)
+        self.channel = Channel.objects.get(feed_url=FEED_URL)
+
+    def test_unchanged(self):
+        """変更がなければ UPDATE しない."""
+        with self.assertNumQueries(0):
+            fields = utils.save_channel(
+                self.parsed, self.channel, with_image=False)
+        self.assertEqual(fields, [])
+
+    def test_changed_fields(self):
+        """変更のあった項目のみ保存する."""
+        parsed = feedparser.parse(
+            SAMPLE_RSS.replace(b'examplefm', b'renamed'))
+        with CaptureQueriesContext(connection) as queries:
+            fields = utils.save_channel(parsed, self.channel, with_image=False)
+
+        self.assertEqual(fields, ['title'])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"title"', queries[0]['sql'])
+        self.assertNotIn('"description"', queries[0]['sql'])
+        self.assertEqual(Channel.objects.get(pk=self.channel.pk).title,
+                         'renamed')
+
+    def test_save(self):
+        """保存時に既存チャンネルを検索しない."""
+        self.channel.title = 'renamed'
+        with self.assertNumQueries(1):
+            self.channel.save()
+        self.assertEqual(self.channel.get_changed_fields(), [])
+
+
+class SaveEpisodesTest(TestCase):
+    """エピソード一括登録"""
+    def setUp(self):
+        self.channel = Channel.objects.create(feed_url=FEED_URL)
+        self.parsed = feedparser.parse(SAMPLE_RSS)
+
+    def test_bulk_insert(self):
+        """未登録のエピソードをまとめて登録する."""
+        Episode.objects.create(
+            channel=self.channel, audio_url='https://files.example.com/ep1.mp3')
+
+        count = utils.save_episodes(self.parsed, self.channel)
+
+        self.assertEqual(count, 1)
+        ep = Episode.objects.get(audio_url='https://files.example.com/ep2.mp3')
+        self.assertEqual(ep.title, 'ep2')
+        self.assertEqual(ep.duration, '35:12')
+        self.assertEqual(ep.description_html, '<p>second</p>')
+        self.assertEqual(Episode.objects.filter(channel=self.channel).count(), 2)
+
+    def test_too_long_values(self):
+        """長すぎる値は項目の長さに収め、他のエピソードと共に登録する."""
+        content = SAMPLE_RSS.replace(
+            b'<itunes:duration>35:12</itunes:duration>',
+            b'<itunes:duration>35 minutes 12 seconds</itunes:duration>'
+        ).replace(b'<title>ep2</title>', b'<title>%s</title>' % (b'a' * 300))
+        content = content.replace(
+            b'https://files.example.com/ep1.mp3',
+            b'https://files.example.com/%s.mp3' % (b'b' * 2000))
+
+        count = utils.save_episodes(feedparser.parse(content), self.channel)
+
+        self.assertEqual(count, 1)
+        ep = Episode.objects.get(audio_url='https://files.example.com/ep2.mp3')
+        self.assertEqual(ep.title, 'a' * 200)
+        self.assertEqual(ep.duration, '35 minutes')
+
+    def test_unchanged_feed(self):
+        """登録済のエピソードのみの場合は 1 クエリで終わる."""
+        utils.save_episodes(self.parsed, self.channel)
+
+        with self.assertNumQueries(1):
+            count = utils.save_episodes(self.parsed, self.channel)
+        self.assertEqual(count, 0)
+
+    def make_feed(self, count, edited=None):
+        """新しい順に count 件のエピソードを持つフィードをパースする."""
+        items = []
+        for i in reversed(range(count)):
+            items.append(
+                '<item><title>%s</title><description>d%d</description>'
+                '<enclosure url="https://files.example.com/%d.mp3" '
+                'type="audio/mpeg" length="1"/></item>'
+                % (edited if edited and i == 0 else 'ep%d' % i, i, i))
+        return feedparser.parse(
+            '<rss version="2.0"><channel><title>examplefm</title>%s'
+            '</channel></rss>' % ''.join(items))
+
+    def test_stop_at_known_entries(self):
+        """登録済のエピソードが続いたら、以降のエントリは確認しない."""
+        utils.save_episodes(self.make_feed(100), self.channel)
+        parsed = self.make_feed(103)
+
+        with mock.patch('feed.utils.get_audio_url',
+                        wraps=utils.get_audio_url) as get_audio_url, \
+                self.assertNumQueries(4):
+            count = utils.save_episodes(parsed, self.channel)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(get_audio_url.call_count, utils.INCREMENTAL_CHUNK_SIZE)
+        self.assertEqual(Episode.objects.filter(channel=self.channel).count(), 103)
+
+    def test_full_sync(self):
+        """定期的に全エントリを確認し、取りこぼしと編集を反映する."""
+        utils.save_episodes(self.make_feed(100), self.channel)
+        Episode.objects.filter(
+            audio_url='https://files.example.com/50.mp3').delete()
+        parsed = self.make_feed(100, edited='renamed')
+
+        self.assertEqual(utils.save_episodes(parsed, self.channel), 0)
+
+        Channel.objects.filter(pk=self.channel.pk).update(
+            last_full_sync=timezone.now() - utils.FULL_SYNC_INTERVAL)
+        self.channel.refresh_from_db()
+        self.assertEqual(utils.save_episodes(parsed, self.channel), 1)
+        ep = Episode.objects.get(audio_url='https://files.example.com/0.mp3')
+        self.assertEqual(ep.title, 'renamed')
+        self.assertIsNone(ep.description_html)
+        self.channel.refresh_from_db()
+        self.assertGreater(self.channel.last_full_sync,
+                           timezone.now() - utils.FULL_SYNC_INTERVAL)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class SaveImageTest(TestCase):
+    """チャンネル画像の保存"""
+    image_url = 'https://example.com/cover.png'
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings = override_settings(MEDIA_ROOT=media_root)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.content = make_png()
+        self.channel = Channel.objects.create(feed_url=FEED_URL)
+
+    def save_image(self, channel, res):
+        with mock.patch('feed.http.get', return_value=res) as get:
+            channel.cover_image = utils.save_image(self.image_url, channel)
+            # save_channel と同様に画像サイズを設定する
+            channel.width_field = channel.height_field = 400
+            channel.save()
+        return get
+
+    def test_content_addressed(self):
+        """画像のハッシュ値をファイル名にして保存する."""
+        res = make_response(content=self.content, headers={'etag': '"img"'})
+        self.save_image(self.channel, res)
+
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(self.channel.cover_image.name, 'images/%s.png' % digest)
+        self.assertEqual(self.channel.cover_image_hash, digest)
+        self.assertEqual(self.channel.cover_image_etag, '"img"')
+        self.assertTrue(default_storage.exists(self.channel.cover_image.name))
+
+    def test_not_modified(self):
+        """同じ画像URLは条件付き GET を行い、304 なら保存しない."""
+        self.save_image(self.channel, make_response(
+            content=self.content, headers={'etag': '"img"'}))
+        name = self.channel.cover_image.name
+
+        with mock.patch('feed.utils.default_storage') as storage:
+            get = self.save_image(self.channel, make_response(304))
+        self.assertEqual(get.call_args[1]['headers']['If-None-Match'], '"img"')
+        storage.save.assert_not_called()
+        self.assertEqual(self.channel.cover_image.name, name)
+
+    def test_same_content(self):
+        """内容が同じ画像は書き込まない."""
+        self.save_image(self.channel, make_response(content=self.content))
+        name = self.channel.cover_image.name
+
+        with mock.patch('feed.utils.default_storage') as storage:
+            self.save_image(self.channel, make_response(content=self.content))
+        storage.save.assert_not_called()
+        self.assertEqual(self.channel.cover_image.name, name)
+
+    def test_shared_image(self):
+        """同じ画像は 1 ファイルを共有し、使われなくなるまで削除しない."""
+        other = Channel.objects.create(feed_url='https://example.com/other.rss')
+        self.save_image(self.channel, make_response(content=self.content))
+        self.save_image(other, make_response(content=self.content))
+        name = self.channel.cover_image.name
+        self.assertEqual(other.cover_image.name, name)
+
+        blue = make_png(color=(0, 0, 255))
+        self.save_image(other, make_response(content=blue))
+        self.assertNotEqual(other.cover_image.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+        self.save_image(self.channel, make_response(content=blue))
+        self.assertFalse(default_storage.exists(name))
+
+    def test_fetch_error(self):
+        """取得に失敗した場合は現在の画像を維持する."""
+        self.save_image(self.channel, make_response(content=self.content))
+        name = self.channel.cover_image.name
+
+        self.save_image(self.channel, make_response(500))
+        self.assertEqual(self.channel.cover_image.name, name)
+
+    def test_stream(self):
+        """タイムアウトを指定してチャンク単位でダウンロードする."""
+        get = self.save_image(self.channel, make_response(content=self.content))
+
+        self.assertTrue(get.call_args[1]['stream'])
+        self.assertEqual(get.call_args[1]['timeout'], utils.IMAGE_TIMEOUT)
+        self.assertTrue(default_storage.exists(self.channel.cover_image.name))
+
+    def test_too_large(self):
+        """上限サイズを超える画像は保存しない."""
+        with mock.patch('feed.utils.IMAGE_MAX_BYTES', 100), \
+                mock.patch('feed.utils.IMAGE_CHUNK_SIZE', 10):
+            self.save_image(self.channel, make_response(content=self.content))
+        self.assertFalse(self.channel.cover_image)
+
+        res = make_response(content=self.content,
+                            headers={'content-length': '999999999'})
+        self.save_image(self.channel, res)
+        self.assertFalse(self.channel.cover_image)
+        res.iter_content.assert_not_called()
+
+    def test_not_image(self):
+        """画像以外の Content-Type は保存しない."""
+        res = make_response(content=self.content,
+                            headers={'content-type': 'text/html; charset=utf-8'})
+        self.save_image(self.channel, res)
+        self.assertFalse(self.channel.cover_image)
@@ -1,9 +1,14 @@
+from io import StringIO
 from unittest import mock
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import F
 from django.urls import reverse
 from django.test import TestCase
+from django.utils import timezone
 
-from feed.models import Channel
+from feed.models import Channel, Episode, Job, Like
 from accounts.models import LogueUser
 
 
@@ -87,6 +92,20 @@ class FeedViewTest(TestCase):
         # 取得したIDが同じであることを確認
         self.assertEqual(actual, get_ch[0].id)
 
+    def test_url_variant(self):
+        """表記の異なる Feed URL は登録済のチャンネルとみなす."""
+        user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        self.client.force_login(user)
+
+        response = self.client.post(reverse('feed:entry'), {
+            'require_url': 'HTTP://Example.com/test.rss?utm_source=x'})
+
+        self.assertEqual(Channel.objects.count(), 1)
+        self.assertRedirects(
+            response, reverse('feed:ch_detail', args=[self.exist_ch.pk]),
+            fetch_redirect_response=False)
+
     def test_did_not_exist_feed_url(self):
         """リクエスト Feed URL が存在しない場合に登録されない."""
         feed_url = 'http://存在しない/testfm'
@@ -127,4 +146,128 @@ class FeedViewTest(TestCase):
         )
         actual = Channel.objects.filter(feed_url=feed_url)
         # 登録件数が0件であることを確認
-        self.assertEqual(actual.count(), 0)
\ No newline at end of file
+        self.assertEqual(actual.count(), 0)
+
+    def test_register_in_background(self):
+        """新規の Feed URL はフィードを取得せずに登録し、ジョブに登録する."""
+        user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        self.client.force_login(user)
+        feed_url = 'https://example.com/new.rss'
+        with mock.patch('feed.utils.fetch_feed') as fetch_feed:
+            response = self.client.post(
+                reverse('feed:entry'), {'require_url': feed_url})
+
+        fetch_feed.assert_not_called()
+        channel = Channel.objects.get(feed_url=feed_url)
+        self.assertRedirects(
+            response, reverse('feed:ch_detail', kwargs={'pk': channel.id}))
+        job = Job.objects.get(channel=channel)
+        self.assertEqual(job.kind, Job.REGISTER_CHANNEL)
+        self.assertEqual(job.status, Job.PENDING)
+
+        response = self.client.get(response.url)
+        self.assertContains(response, 'エピソードを取得しています')
+
+    def test_reactivate(self):
+        """取得を停止したチャンネルは、再度登録すると取得を再開する."""
+        user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        self.client.force_login(user)
+        Channel.objects.filter(pk=self.exist_ch.pk).update(
+            is_active=False, poll_error_count=12)
+
+        self.client.post(
+            reverse('feed:entry'), {'require_url': self.exist_ch.feed_url})
+
+        self.exist_ch.refresh_from_db()
+        self.assertTrue(self.exist_ch.is_active)
+        self.assertEqual(self.exist_ch.poll_error_count, 0)
+        # 登録ジョブの完了前に定期取得しない
+        self.assertGreater(self.exist_ch.next_poll_at, timezone.now())
+        self.assertTrue(Job.objects.filter(
+            channel=self.exist_ch, kind=Job.REGISTER_CHANNEL).exists())
+
+
+class ChangeLikeTest(TestCase):
+    """Like 登録・解除に関するテスト."""
+    def setUp(self):
+        self.user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        ch = Channel.objects.create(feed_url='https://example.com/test.rss')
+        self.episode = Episode.objects.create(
+            channel=ch, audio_url='http://files.example.fm/ep1.mp3')
+        self.client.force_login(self.user)
+
+    def test_like_count(self):
+        """Like 登録・解除に応じて Like 数が増減する."""
+        url = reverse('feed:change_like')
+        response = self.client.get(url, {'ep_id': self.episode.id})
+        self.assertEqual(response.json(), {'liked': True})
+        self.episode.refresh_from_db()
+        self.assertEqual(self.episode.like_count, 1)
+
+        response = self.client.get(url, {'ep_id': self.episode.id})
+        self.assertEqual(response.json(), {'liked': False})
+        self.episode.refresh_from_db()
+        self.assertEqual(self.episode.like_count, 0)
+
+    def test_unlike_concurrently(self):
+        """同時に解除された Like は、Like 数を二重に減らさない."""
+        Like.objects.create(episode=self.episode, user=self.user)
+        Episode.objects.filter(id=self.episode.id).update(like_count=1)
+        get_or_create = Like.objects.get_or_create
+
+        def unlike_by_another_request(**kwargs):
+            result = get_or_create(**kwargs)
+            Like.objects.filter(pk=result[0].pk).delete()
+            Episode.objects.filter(id=self.episode.id).update(
+                like_count=F('like_count') - 1)
+            return result
+
+        with mock.patch.object(Like.objects, 'get_or_create',
+                               side_effect=unlike_by_another_request), \
+                mock.patch('feed.models.TrendingEpisode.objects.remove_like') \
+                as remove_like:
+            response = self.client.get(
+                reverse('feed:change_like'), {'ep_id': self.episode.id})
+
+        self.assertEqual(response.json(), {'liked': False})
+        self.episode.refresh_from_db()
+        self.assertEqual(self.episode.like_count, 0)
+        # トレンドスコアは他のリクエストによる削除の 1 回のみ反映する
+        self.assertEqual(remove_like.call_count, 1)
+
+    def test_reconcile_like_counts(self):
+        """Like 数のずれを補正する."""
+        Like.objects.create(episode=self.episode, user=self.user)
+        Episode.objects.filter(id=self.episode.id).update(like_count=5)
+
+        call_command('reconcile_like_counts', stdout=StringIO())
+
+        self.episode.refresh_from_db()
+        self.assertEqual(self.episode.like_count, 1)
+
+
+class SidebarTest(TestCase):
+    """サイドバーのコレクション一覧に関するテスト."""
+    def setUp(self):
+        cache.clear()
+        self.user = LogueUser.objects.create_user(
+            email='test@example.com', password='testtesttest')
+        ch = Channel.objects.create(feed_url='https://example.com/test.rss')
+        self.episode = Episode.objects.create(
+            channel=ch, audio_url='http://files.example.fm/ep1.mp3')
+        self.client.force_login(self.user)
+
+    def test_invalidate_on_add_collection(self):
+        """コレクションを追加するとサイドバーに反映される."""
+        response = self.client.get(reverse('feed:terms'))
+        self.assertEqual(list(response.context['mst_collection']), [])
+
+        self.client.get(reverse('feed:add_collection'), {
+            'ep_id': self.episode.id, 'new_title': 'new collection'})
+
+        response = self.client.get(reverse('feed:terms'))
+        titles = [mst.title for mst in response.context['mst_collection']]
+        self.assertEqual(titles, ['new collection'])
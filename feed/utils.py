@@ -1,23 +1,92 @@
 import os
+import hashlib
+import tempfile
+import time
+from contextlib import closing
 from io import BytesIO
-import uuid
 import logging
+from collections import namedtuple
+from itertools import islice
 from time import mktime
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
-import feedparser
 import pytz
 import boto3
+from django.core.files import File
 from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.utils import html
 from PIL import Image
 from logue import settings
-from . import models
+from . import http, images, locks, models, rss
+from .normalize import feed_url_variants, normalize_feed_url
+from .rendering import render_markdown
 
 
 logger = logging.getLogger(__name__)
 
+# フィード取得時の (接続, 読み込み) タイムアウト秒数
+FEED_TIMEOUT = (5, 30)
+
+# エピソード一括登録時の 1 クエリあたりの件数
+EPISODE_BATCH_SIZE = 200
+
+# 登録済のエピソードがこの件数続いたら、以降のエントリは確認しない
+KNOWN_RUN_LIMIT = 10
+# 登録済か確認する際の 1 クエリあたりのエントリ数
+INCREMENTAL_CHUNK_SIZE = 20
+# 全エントリを確認する間隔
+FULL_SYNC_INTERVAL = timedelta(days=7)
+# 全エントリ確認時に、フィードの編集を反映する項目
+EDITABLE_FIELDS = ('title', 'link', 'description', 'duration')
+
+# フィード取得結果(PollLog)の保存期間
+POLL_LOG_RETENTION = timedelta(days=30)
+
+# 画像取得時の (接続, 読み込み) タイムアウト秒数と、ダウンロード全体の上限秒数
+IMAGE_TIMEOUT = (5, 15)
+IMAGE_MAX_SECONDS = 60
+
+# 画像の最大バイト数と、読み込み単位
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# このバイト数を超える画像は一時ファイルに書き出す
+IMAGE_SPOOL_SIZE = 1024 * 1024
+
+# 画像取得結果. file はダウンロードした画像の一時ファイル
+ImageResponse = namedtuple(
+    'ImageResponse', ['status', 'file', 'digest', 'etag', 'modified'])
+
+
+class FeedResponse(namedtuple('FeedResponse', [
+        'status', 'parsed', 'etag', 'modified', 'bytes', 'elapsed', 'error',
+        'digest', 'location'])):
+    """フィード取得結果.
+
+    Note:
+        変更がない場合(304 または本文が前回と同じ)、取得に失敗した場合は
+        parsed が None となる. 取得に失敗した場合は error にエラー内容が入る.
+        digest は本文の SHA-256.
+        location は恒久的なリダイレクト(301, 308)の転送先の正規化した URL.
+        bytes はレスポンスボディのバイト数、elapsed は取得・パースにかかった秒数.
+        RSS 2.0 のエントリは参照時にパースするため、elapsed に含まない.
+    """
+    __slots__ = ()
+
+    @property
+    def not_modified(self):
+        """変更がない場合 True."""
+        return self.error is None and self.parsed is None
+
+
+# bytes, elapsed, error, digest, location は省略可能
+FeedResponse.__new__.__defaults__ = (None, None, None, None, None)
+
+# 転送先を Feed URL として保存するリダイレクトのステータスコード
+PERMANENT_REDIRECTS = (301, 308)
+
 
 def delete_previous_file(function):
     """
@@ -53,6 +122,11 @@ def delete_previous_file(function):
 def save_image(image_url, db_channel):
     """画像を保存する.
 
+    Note:
+        前回と同じ画像URLの場合は条件付き GET を行い、変更がなければ保存しない.
+        画像はハッシュ値をファイル名にして保存し、同じ画像は複数チャンネルで共有する.
+        取得に失敗した場合は現在の画像を維持する.
+
     Arguments:
         image_url -- 画像取得URL
         db_channel -- チャンネル
@@ -60,83 +134,423 @@ def save_image(image_url, db_channel):
     Returns:
         rel_path -- DB登録用パス
     """
-    res = requests.get(image_url)
-    if res.status_code != 200:
-        return ''
+    current = db_channel.cover_image.name if db_channel.cover_image else ''
+
+    headers = {}
+    if current and db_channel.cover_image_url == image_url:
+        if db_channel.cover_image_etag:
+            headers['If-None-Match'] = db_channel.cover_image_etag
+        if db_channel.cover_image_last_modified:
+            headers['If-Modified-Since'] = db_channel.cover_image_last_modified
+
+    response = download_image(image_url, headers)
+    if response is None or response.status == 304:
+        return current
+    with response.file:
+        return store_image(image_url, db_channel, response, current)
+
 
-    # 保存する画像名を取得
+def store_image(image_url, db_channel, response, current):
+    """ダウンロードした画像を保存し、チャンネルの画像情報を更新する.
+
+    Arguments:
+        image_url(str) -- 画像取得URL
+        db_channel(Channel) -- チャンネル
+        response(ImageResponse) -- 画像取得結果
+        current(str) -- 現在の画像の保存パス
+    Return:
+        rel_path(str) -- DB登録用パス
+    """
+    db_channel.cover_image_url = image_url
+    db_channel.cover_image_etag = response.etag
+    db_channel.cover_image_last_modified = response.modified
+
+    # 内容が変わっていなければ書き込まない
+    digest = response.digest
+    if current and db_channel.cover_image_hash == digest:
+        return current
+    db_channel.cover_image_hash = digest
+
+    # DB登録用パス. 同じ画像は同じパスになる
     filename = image_url.split('/')[-1]
-    unique_name = get_image_name(filename)
+    rel_path = 'images/' + get_image_name(filename, digest)
 
-    # 画像ファイル書き込み用パス
-    if settings.DEBUG:
-        prefix = settings.MEDIA_ROOT + '/images/'
+    if default_storage.exists(rel_path):
+        # 他のチャンネルが保存済の画像を共有する
+        db_channel.has_renditions = default_storage.exists(
+            images.rendition_name(rel_path, images.RENDITION_SIZES[-1]))
     else:
-        prefix = settings.MEDIA_URL + 'images/'
-    path = prefix + unique_name
+        response.file.seek(0)
+        rel_path = default_storage.save(rel_path, File(response.file))
+        # 表示サイズごとのサムネイルを保存する
+        db_channel.has_renditions = images.save_renditions(
+            rel_path, response.file)
 
-    # DB登録用パス
-    rel_path = 'images/' + unique_name
+    # 以前の画像を、他のチャンネルが使っていなければ削除する
+    if current and current != rel_path:
+        release_image(current, db_channel)
 
-    # 以前の画像を削除する
-    if db_channel.cover_image:
-        if settings.DEBUG:
-            old_path = settings.MEDIA_ROOT + '/' + db_channel.cover_image.name
-        else:
-            old_path = settings.MEDIA_URL + db_channel.cover_image.name
-        if os.path.exists(old_path):
-            os.remove(old_path)
+    return rel_path
 
-    with default_storage.open(rel_path, 'wb') as file:
-        file.write(res.content)
 
-    return rel_path
+def download_image(image_url, headers=None, timeout=None):
+    """画像をチャンク単位で一時ファイルにダウンロードする.
+
+    Note:
+        IMAGE_SPOOL_SIZE を超える画像はディスクに書き出すため、
+        メモリ使用量は画像サイズによらず一定となる.
+        画像以外の Content-Type、IMAGE_MAX_BYTES を超えるサイズ、
+        IMAGE_MAX_SECONDS を超えるダウンロードは中断する.
+
+    Arguments:
+        image_url(str) -- 画像取得URL
+        headers(dict) -- リクエストヘッダ
+        timeout(tuple) -- (接続, 読み込み) タイムアウト秒数
+    Return:
+        response(ImageResponse) -- 取得結果. 取得失敗の場合は None
+    """
+    if timeout is None:
+        timeout = IMAGE_TIMEOUT
+    try:
+        res = http.get(image_url, headers=headers or {},
+                       timeout=timeout, stream=True)
+    except requests.RequestException as e:
+        logger.warning('logue save_image could not fetch "%s": %s', image_url, e)
+        return None
+
+    with closing(res):
+        if res.status_code == 304:
+            return ImageResponse(304, None, None, None, None)
+        if res.status_code != 200:
+            logger.warning('logue save_image got HTTP %d from "%s"',
+                           res.status_code, image_url)
+            return None
+
+        content_type = res.headers.get('content-type', '').split(';')[0]
+        if content_type and not content_type.startswith('image/') \
+                and content_type != 'application/octet-stream':
+            logger.warning('logue save_image got "%s" from "%s"',
+                           content_type, image_url)
+            return None
+        length = res.headers.get('content-length', '')
+        if length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+            logger.warning('logue save_image "%s" is too large (%s bytes)',
+                           image_url, length)
+            return None
+
+        file = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+        sha256 = hashlib.sha256()
+        size = 0
+        deadline = time.monotonic() + IMAGE_MAX_SECONDS
+        try:
+            for chunk in res.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES or time.monotonic() > deadline:
+                    logger.warning('logue save_image gave up "%s" (%d bytes)',
+                                   image_url, size)
+                    file.close()
+                    return None
+                sha256.update(chunk)
+                file.write(chunk)
+        except requests.RequestException as e:
+            logger.warning('logue save_image could not fetch "%s": %s',
+                           image_url, e)
+            file.close()
+            return None
+
+    return ImageResponse(
+        200, file, sha256.hexdigest(),
+        res.headers.get('etag'), res.headers.get('last-modified'))
+
+
+def release_image(name, db_channel=None):
+    """どのチャンネルからも使われなくなった画像を削除する.
+
+    Arguments:
+        name(str) -- 画像の保存パス
+        db_channel(Channel) -- 画像を使わなくなるチャンネル
+    """
+    users = models.Channel.objects.filter(cover_image=name)
+    if db_channel is not None and db_channel.pk:
+        users = users.exclude(pk=db_channel.pk)
+    if not users.exists():
+        images.delete_image(name)
 
 
-def get_image_name(filename):
+def get_image_name(filename, digest):
     """
-    カスタマイズした画像パスを取得する.
+    画像のハッシュ値から保存する画像名を取得する.
 
     :param filename: 元ファイル名
-    :return: カスタマイズしたファイル名を含む画像パス
+    :param digest: 画像データのハッシュ値
+    :return: ハッシュ値と拡張子からなる画像名
     """
-    # UUIDで一意な名前にする
-    name = str(uuid.uuid4()).replace('-', '')
     # 拡張子
     extension = os.path.splitext(filename)[-1]
     # 末尾にパラメータを含む場合、除外する
     if '?' in extension:
         splited = extension.split('?')
         extension = splited[0]
-    return name + extension
+    return digest + extension
+
+
+def fetch_feed(feed_url, timeout=None, etag=None, modified=None,
+               digest=None):
+    """フィードをダウンロードしてパースする.
+
+    Note:
+        DB にはアクセスしないため、複数スレッドから並行に呼び出せる.
+        etag, modified を渡すと条件付き GET となり、
+        変更がなければパースせずに 304 を返す.
+        ETag 等に対応しないホストのため、本文が digest と同じ場合もパースしない.
+
+    Arguments:
+        feed_url(str) -- リクエストFeed URL
+        timeout(tuple) -- (接続, 読み込み) タイムアウト秒数
+        etag(str) -- 前回取得時の ETag
+        modified(str) -- 前回取得時の Last-Modified
+        digest(str) -- 前回取得時の本文の SHA-256
+    Return:
+        response(FeedResponse) -- 取得結果. 取得失敗の場合は error を含む
+    """
+    if timeout is None:
+        timeout = FEED_TIMEOUT
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    start = time.monotonic()
+    try:
+        res = http.get(feed_url, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        logger.warning('logue get_feeds could not fetch "%s": %s', feed_url, e)
+        return FeedResponse(None, None, etag, modified,
+                            elapsed=time.monotonic() - start, error=str(e))
+
+    size = len(res.content)
+    location = get_permanent_location(res, feed_url)
+    if res.status_code == 304:
+        return FeedResponse(304, None, etag, modified, size,
+                            time.monotonic() - start, location=location)
+
+    if res.status_code != 200:
+        logger.warning('logue get_feeds got HTTP %d from "%s"',
+                       res.status_code, feed_url)
+        return FeedResponse(res.status_code, None, etag, modified, size,
+                            time.monotonic() - start,
+                            'HTTP %d' % res.status_code)
+
+    body_hash = hashlib.sha256(res.content).hexdigest()
+    if body_hash == digest:
+        return FeedResponse(res.status_code, None, etag, modified, size,
+                            time.monotonic() - start, digest=body_hash,
+                            location=location)
+
+    # 展開済のボディを渡すため、Content-Encoding は渡さない
+    parsed = rss.parse(res.content, response_headers={
+        'content-type': res.headers.get('content-type', ''),
+        'content-location': res.url,
+    })
+    return FeedResponse(
+        res.status_code, parsed,
+        res.headers.get('etag'), res.headers.get('last-modified'),
+        size, time.monotonic() - start, digest=body_hash, location=location)
+
+
+def get_permanent_location(res, feed_url):
+    """恒久的なリダイレクトの転送先を返す.
+
+    Note:
+        一時的なリダイレクトがあれば、その手前までの転送先を返す.
+
+    Arguments:
+        res(requests.Response) -- レスポンス
+        feed_url(str) -- リクエストFeed URL
+    Return:
+        location(str) -- 正規化した転送先URL. 転送されていない場合は None
+    """
+    location = None
+    hops = list(res.history) + [res]
+    for hop, target in zip(hops, hops[1:]):
+        if hop.status_code not in PERMANENT_REDIRECTS:
+            break
+        location = normalize_feed_url(target.url)
+    if location == feed_url:
+        return None
+    return location
+
+
+def save_redirect(feed_url, response):
+    """恒久的なリダイレクトの転送先を Feed URL として保存する.
+
+    Note:
+        次回以降は転送先を直接取得する.
+        転送先が他のチャンネルとして登録済の場合は変更しない.
+
+    Arguments:
+        feed_url(str) -- リクエストFeed URL
+        response(FeedResponse) -- フィード取得結果
+    Return:
+        feed_url(str) -- 保存後の Feed URL
+    """
+    location = response.location
+    if not location or location == feed_url:
+        return feed_url
+    if len(location) > models.Channel._meta.get_field('feed_url').max_length:
+        logger.warning('logue get_feeds found "%s" moved to "%s", '
+                       'which is too long to store', feed_url, location)
+        return feed_url
+    try:
+        with transaction.atomic():
+            updated = models.Channel.objects.filter(feed_url=feed_url).update(
+                feed_url=location)
+    except IntegrityError:
+        logger.warning('logue get_feeds found "%s" moved to "%s", '
+                       'which is already registered', feed_url, location)
+        return feed_url
+    if not updated:
+        return feed_url
+    logger.info('logue get_feeds moved "%s" to "%s"', feed_url, location)
+    return location
+
+
+def store_feed(response, feed_url, with_image=True):
+    """取得したフィードをチェックし、チャンネルとエピソードを登録する.
+
+    Note:
+        取得結果は PollLog に記録する.
+        同じフィードの登録はプロセス・ノードをまたいで 1 つずつ行い、
+        待っている間に他の処理が同じ内容を登録した場合は変更なしとする.
+
+    Arguments:
+        response(FeedResponse) -- フィード取得結果
+        feed_url(str) -- リクエストFeed URL
+        with_image(bool) -- False の場合、画像は保存しない
+    Return:
+        result(str) -- 処理成功の場合 'success',
+                       変更がない場合 'not_modified' を返す.
+                       取得失敗・フィード不正の場合は ''
+    """
+    # 取得失敗
+    if response.error:
+        record_poll(feed_url, response, models.PollLog.ERROR,
+                    error=response.error)
+        return ''
+
+    # 変更がなければ記録のみ行う. 最終取得日は scheduler.schedule_next_poll が更新する
+    if response.not_modified:
+        record_poll(feed_url, response, models.PollLog.NOT_MODIFIED)
+        return 'not_modified'
+
+    parsed = response.parsed
+    # 取得フィードステータス確認
+    error = check_feed_status(parsed, feed_url)
+    # ステータス異常があれば、処理終了
+    if error:
+        record_poll(feed_url, response, models.PollLog.INVALID, error=error)
+        return ''
+
+    with locks.advisory_lock('feed.store_feed:%s' % feed_url):
+        # チャンネルデータを先に登録する。既に登録があれば既存データを取得する
+        stored_channel, created = models.Channel.objects.get_or_create(
+            feed_url=feed_url)
+
+        # 他の処理が同じ内容を登録済であれば、その結果を使う
+        if not created and response.digest and \
+                stored_channel.feed_body_hash == response.digest:
+            record_poll(feed_url, response, models.PollLog.NOT_MODIFIED,
+                        channel=stored_channel)
+            return 'not_modified'
+
+        # チャンネルデータ更新
+        save_channel(parsed, stored_channel, with_image)
+        # エピソード登録
+        new_episodes = save_episodes(parsed, stored_channel)
+
+        # 次回の条件付き GET 用に保持する.
+        # エピソードの登録に失敗した場合に次回の取得が 304 や本文一致で
+        # 読み飛ばされないよう、最後に保存する
+        stored_channel.etag = response.etag
+        stored_channel.last_modified = response.modified
+        stored_channel.feed_body_hash = response.digest
+        stored_channel.save_changed_fields()
+
+    record_poll(feed_url, response, models.PollLog.SUCCESS,
+                new_episodes=new_episodes, channel=stored_channel)
+    return 'success'
+
+
+def record_poll(feed_url, response, status, new_episodes=0, error=None,
+                channel=None):
+    """フィード取得結果を記録する.
+
+    Arguments:
+        feed_url(str) -- リクエストFeed URL
+        response(FeedResponse) -- フィード取得結果
+        status(str) -- PollLog のステータス
+        new_episodes(int) -- 新規登録したエピソード数
+        error(str) -- エラー内容
+        channel(Channel) -- チャンネル. 省略時は Feed URL から取得する
+    """
+    if channel is None:
+        channel = models.Channel.objects.filter(feed_url=feed_url).only(
+            'pk').first()
+        if channel is None:
+            return
+    models.PollLog.objects.create(
+        channel=channel, status=status, http_status=response.status,
+        bytes=response.bytes, duration=response.elapsed,
+        new_episodes=new_episodes, error=error)
+
+
+def prune_poll_logs(now=None):
+    """保存期間を過ぎたフィード取得結果を削除する.
+
+    Return:
+        count(int) -- 削除した件数
+    """
+    now = now or timezone.now()
+    count, _ = models.PollLog.objects.filter(
+        created__lt=now - POLL_LOG_RETENTION).delete()
+    return count
 
 
 def get_feed(feed_url):
     """新規にフィードを取得し、登録する.
 
+    Note:
+        Feed URL は正規化し、恒久的に転送されている場合は転送先で登録する.
+
     Arguments:
-        db_channel -- Channelモデルインスタンス
+        feed_url(str) -- リクエストFeed URL
     Return:
         result(str) -- 処理成功の場合 'success' を返す
     """
+    # 正規化前の URL や http/https の違いで登録済の場合は、登録済の Feed URL で取得する
+    feed_url = find_feed_url(normalize_feed_url(feed_url), feed_url)
     # リクエストURLをもとにパース処理
-    parsed = feedparser.parse(feed_url)
-    # 取得フィードステータス確認
-    is_valid_feed = check_feed_status(parsed, feed_url)
-    # ステータス異常があれば、処理終了
-    if not is_valid_feed:
-        return ''
+    response = fetch_feed(feed_url)
+    result = store_feed(response, feed_url)
+    if result:
+        save_redirect(feed_url, response)
+    return result
 
-    # チャンネルデータを先に登録する。既に登録があれば既存データを取得する
-    stored_channel, created = models.Channel.objects.get_or_create(
-        feed_url=feed_url)
 
-    # チャンネルデータ更新
-    save_channel(parsed, stored_channel)
-    # エピソード登録
-    save_episodes(parsed, stored_channel)
+def find_feed_url(feed_url, original=None):
+    """同じフィードとして登録済のチャンネルの Feed URL を返す.
+
+    Arguments:
+        feed_url(str) -- 正規化した Feed URL
+        original(str) -- 正規化前の Feed URL
+    Return:
+        feed_url(str) -- 登録済の Feed URL. 登録がなければ feed_url
+    """
+    variants = feed_url_variants(feed_url, original)
+    stored = set(models.Channel.objects.filter(
+        feed_url__in=variants).values_list('feed_url', flat=True))
+    return next((url for url in variants if url in stored), feed_url)
 
-    return 'success'
 
 def check_feed_status(parsed, feed_url):
     """取得フィードの状態をチェックする.
@@ -145,14 +559,14 @@ def check_feed_status(parsed, feed_url):
         parsed(json) -- パース済 Json データ
         feed_url(str) -- リクエストFeed URL
     Return:
-        result(boolean) -- ステータス異常なし: True
+        error(str) -- ステータス異常の内容. 異常なしの場合は None
     """
     # パース成否確認
     if hasattr(parsed.feed, 'bozo_exception'):
         msg = 'logue get_feeds found Malformed feed, "%s": %s'\
             % (feed_url, parsed.feed.bozo_exception)
         logger.warning(msg)
-        return False
+        return msg
 
     # タイトル、リンクの属性存在確認
     for attr in ['title', 'title_detail']:
@@ -160,10 +574,14 @@ def check_feed_status(parsed, feed_url):
         if not hasattr(parsed.feed, attr):
             msg = 'Channel "%s" has no %s' % (feed_url, attr)
             logger.error(msg)
-            return False
+            return msg
 
     # 音声ファイルURL有無チェック
-    entry = parsed.entries[0]
+    entry = next(iter(parsed.entries), None)
+    if entry is None:
+        msg = 'Channel "%s" has no entries' % (feed_url)
+        logger.error(msg)
+        return msg
     is_audiofeed = False
     if hasattr(entry, 'links'):
         for link in entry.links:
@@ -173,18 +591,24 @@ def check_feed_status(parsed, feed_url):
     if not is_audiofeed:
         msg = 'Channel "%s" has no audio link' % (feed_url)
         logger.error(msg)
-        return False
+        return msg
 
-    return True
+    return None
 
 
-def save_channel(parsed, stored_channel):
+def save_channel(parsed, stored_channel, with_image=True):
     """チャンネルデータを登録・更新する.
 
+    Note:
+        変更のあった項目のみ保存し、変更がなければ UPDATE を発行しない.
+        最終取得日は scheduler.schedule_next_poll が更新する.
+
     Arguments:
         parsed(json) -- パース済 Json データ
         stored_channel(quryset) -- Channelモデルインスタンス
+        with_image(bool) -- False の場合、画像は保存しない
     Return:
+        fields(list) -- 保存した項目名
     """
     # タイトル取得
     if parsed.feed.title_detail.type == 'text/plain':
@@ -213,118 +637,308 @@ def save_channel(parsed, stored_channel):
     else:
         stored_channel.description = ''
 
-    # 最終取得日
-    stored_channel.last_polled_time = timezone.now()
-
     # 画像
+    image_url = get_image_url(parsed)
+    if with_image and image_url:
+        set_cover_image(stored_channel, image_url)
+
+    # データ更新
+    return stored_channel.save_changed_fields()
+
+
+def get_image_url(parsed):
+    """フィードのチャンネル画像URLを返す.
+
+    Arguments:
+        parsed(json) -- パース済 Json データ
+    Return:
+        image_url(str) -- 画像URL. ない場合は None
+    """
     if hasattr(parsed.feed, 'image'):
-        # ストレージにイメージ画像を保存
-        image_url = parsed.feed.image.href
-        path = save_image(image_url, stored_channel)
-        stored_channel.cover_image = path
+        return parsed.feed.image.get('href')
+    return None
 
-        stored_channel.width_field = '400'
-        stored_channel.height_field = '400'
 
-        # img = Image.open(settings.MEDIA_URL + '/' + path)
-        # img.thumbnail((400, 400), Image.ANTIALIAS)
-        # img.save(settings.MEDIA_URL + '/' + path)
+def set_cover_image(stored_channel, image_url):
+    """ストレージに画像を保存し、チャンネルの画像を設定する.
+
+    Note:
+        チャンネルは保存しない.
+    Arguments:
+        stored_channel(Channel) -- チャンネル
+        image_url(str) -- 画像取得URL
+    """
+    path = save_image(image_url, stored_channel)
+    # ImageField への代入は画像サイズ取得のためストレージを読むため、
+    # 変更がない場合は代入しない
+    if (stored_channel.cover_image.name or '') != (path or ''):
+        stored_channel.cover_image = path
+        stored_channel.width_field = 400
+        stored_channel.height_field = 400
 
-    # データ更新
-    stored_channel.save()
 
-def save_episodes(parsed, stored_channel):
+def save_episodes(parsed, stored_channel, full=None):
     """エピソードを登録する.
 
+    Note:
+        フィードは新しい順に並んでいるため、通常は先頭から順に確認し、
+        登録済のエピソードが KNOWN_RUN_LIMIT 件続いたところで打ち切る.
+        FULL_SYNC_INTERVAL ごとに全エントリを確認し、取りこぼしと
+        登録済エピソードの編集を反映する.
+
     Arguments:
         parsed(json) -- パース済 Json データ
         stored_channel(quryset) -- Channelモデルインスタンス
+        full(bool) -- 全エントリを確認する場合 True. 省略時は前回の全件確認日時から判断する
     Return:
+        count(int) -- 新規登録したエピソード数
     """
-    # エピソード登録処理
-    for i, entry in enumerate(parsed.entries):
-        # 属性存在判定フラグ
-        missing_attr = False
-        for attr in ['title', 'title_detail', 'description']:
-            if not hasattr(entry, attr):
-                msg = 'logue get_feeds. Episode has no %s' % (attr)
-                logger.error(msg)
-                missing_attr = True
-
-        if missing_attr:
-            continue
+    now = timezone.now()
+    if full is None:
+        full = stored_channel.last_full_sync is None or \
+            stored_channel.last_full_sync < now - FULL_SYNC_INTERVAL
 
-        # タイトル
-        if entry.title == '':
-            msg = 'logue get_feeds. Entry "%s" has a blank title'\
-                % (entry.title)
-            logger.warning(msg)
-            continue
+    if full:
+        new_episodes = sync_all_episodes(parsed, stored_channel)
+    else:
+        new_episodes = find_new_episodes(parsed, stored_channel)
+
+    # エピソード保存
+    if new_episodes:
+        with transaction.atomic():
+            models.Episode.objects.bulk_create(
+                new_episodes, batch_size=EPISODE_BATCH_SIZE)
+
+    if full:
+        # 登録に失敗した場合は次回も全エントリを確認するよう、登録後に保存する
+        stored_channel.last_full_sync = now
+        stored_channel.save(update_fields=['last_full_sync'])
 
-        # 音声ファイルURL
-        audio_url = None
-        if hasattr(entry, 'links'):
-            for link in entry.links:
-                if hasattr(link, 'type') and link.type == 'audio/mpeg':
-                    audio_url = link.href
+    return len(new_episodes)
 
+
+def find_new_episodes(parsed, stored_channel):
+    """フィードの先頭から未登録のエピソードを探す.
+
+    Note:
+        INCREMENTAL_CHUNK_SIZE 件ずつ登録済か確認し、
+        登録済のエピソードが KNOWN_RUN_LIMIT 件続いたら打ち切る.
+
+    Arguments:
+        parsed(json) -- パース済 Json データ
+        stored_channel(quryset) -- Channelモデルインスタンス
+    Return:
+        new_episodes(list) -- 未保存の Episode モデルインスタンス
+    """
+    new_episodes = []
+    seen_urls = set()
+    known_run = 0
+    entries = iter(parsed.entries)
+    while True:
+        chunk = list(islice(entries, INCREMENTAL_CHUNK_SIZE))
+        if not chunk:
+            break
+        candidates = []
+        for entry in chunk:
+            audio_url = get_audio_url(entry, stored_channel)
+            if audio_url:
+                candidates.append((entry, audio_url))
+        known_urls = set(models.Episode.objects.filter(
+            channel=stored_channel,
+            audio_url__in=[audio_url for _, audio_url in candidates],
+        ).values_list('audio_url', flat=True))
+
+        for entry, audio_url in candidates:
+            # 登録済、またはフィード内で重複するエピソードは登録しない
+            if audio_url in known_urls or audio_url in seen_urls:
+                known_run += 1
+                if known_run >= KNOWN_RUN_LIMIT:
+                    return new_episodes
+                continue
+            known_run = 0
+            seen_urls.add(audio_url)
+            new_episodes.append(
+                build_episode(entry, stored_channel, audio_url))
+    return new_episodes
+
+
+def sync_all_episodes(parsed, stored_channel):
+    """フィードの全エントリを確認し、未登録のエピソードを探す.
+
+    Note:
+        登録済のエピソードでタイトル・説明などが編集されている場合は更新する.
+
+    Arguments:
+        parsed(json) -- パース済 Json データ
+        stored_channel(quryset) -- Channelモデルインスタンス
+    Return:
+        new_episodes(list) -- 未保存の Episode モデルインスタンス
+    """
+    # 登録済のエピソード
+    known = {
+        row['audio_url']: row for row in models.Episode.objects.filter(
+            channel=stored_channel).values('pk', 'audio_url', *EDITABLE_FIELDS)
+    }
+
+    new_episodes = []
+    for entry in parsed.entries:
+        audio_url = get_audio_url(entry, stored_channel)
         if not audio_url:
-            msg = 'logue get_feeds. Episode %s in %s has a no audio URL'\
-                % (entry.title, stored_channel.title)
-            logger.warning(msg)
             continue
 
-        db_entry, created = models.Episode.objects.get_or_create(
-            channel=stored_channel, audio_url=audio_url)
-
-        # エピソードが初回登録の場合、発行日時、タイトル、説明を追加する
-        if created:
-            # 発行日時
-            published_time = ''
-            # 日付データに変換する
-            if hasattr(entry, 'published_parsed'):
-                if entry.published_parsed is None:
-                    published_time = timezone.now()
-                else:
-                    published_time = datetime.fromtimestamp(
-                        mktime(entry.published_parsed))
-                    try:
-                        published_time = pytz.timezone(
-                            settings.TIME_ZONE).localize(published_time, is_dst=None)
-                    except pytz.exceptions.AmbiguousTimeError:
-                        pytz_timezone = pytz.timezone(settings.TIME_ZONE)
-                        published_time = pytz_timezone.localize(
-                            published_time, is_dst=False)
-                    now = timezone.now()
-                    if published_time > now:
-                        published_time = now
-            # 発行日時
-            db_entry.published_time = published_time
-
-            # タイトル: 'text/plain'の場合、htmlエスケープする
-            if entry.title_detail.type == 'text/plain':
-                db_entry.title = html.escape(entry.title)
-            else:
-                db_entry.title = entry.title
-
-            # リンク
-            if hasattr(entry, 'link'):
-                db_entry.link = entry.link
-            else:
-                db_entry.link = ''
-
-            # 収録時間
-            if hasattr(entry, 'itunes_duration'):
-                db_entry.duration = entry.itunes_duration
-            else:
-                db_entry.duration = ''
-
-            # エピソード説明: 'text/plain'の場合、htmlエスケープする
-            if hasattr(entry, 'description_detail')\
-                    and entry.description_detail.type != 'text/plain':
-                db_entry.description = entry.description
-            else:
-                db_entry.description = html.escape(entry.description)
-
-            # エピソード保存
-            db_entry.save()
+        if audio_url not in known:
+            episode = build_episode(entry, stored_channel, audio_url)
+            new_episodes.append(episode)
+            # フィード内で重複するエピソードは登録しない
+            known[audio_url] = None
+            continue
+
+        stored = known[audio_url]
+        if stored is None:
+            continue
+        episode = build_episode(
+            entry, stored_channel, audio_url, render=False)
+        changes = {
+            field: getattr(episode, field) for field in EDITABLE_FIELDS
+            if getattr(episode, field) != stored[field]
+        }
+        if changes:
+            # ShowNote の HTML は表示時に変換し直す
+            changes['description_html'] = None
+            models.Episode.objects.filter(pk=stored['pk']).update(**changes)
+    return new_episodes
+
+
+def get_audio_url(entry, stored_channel):
+    """エントリの音声ファイルURLを取得する.
+
+    Note:
+        必要な属性がないエントリは登録しないため None を返す.
+
+    Arguments:
+        entry(json) -- パース済エントリ
+        stored_channel(quryset) -- Channelモデルインスタンス
+    Return:
+        audio_url(str) -- 音声ファイルURL. 登録しないエントリの場合は None
+    """
+    # 属性存在判定フラグ
+    missing_attr = False
+    # 説明の有無は、参照時に無害化する description ではなく description_detail で判定する
+    for attr in ['title', 'title_detail', 'description_detail']:
+        if not hasattr(entry, attr):
+            msg = 'logue get_feeds. Episode has no %s' % (attr)
+            logger.error(msg)
+            missing_attr = True
+
+    if missing_attr:
+        return None
+
+    # タイトル
+    if entry.title == '':
+        msg = 'logue get_feeds. Entry "%s" has a blank title'\
+            % (entry.title)
+        logger.warning(msg)
+        return None
+
+    # 音声ファイルURL
+    audio_url = None
+    if hasattr(entry, 'links'):
+        for link in entry.links:
+            if hasattr(link, 'type') and link.type == 'audio/mpeg':
+                audio_url = link.href
+
+    if not audio_url:
+        msg = 'logue get_feeds. Episode %s in %s has a no audio URL'\
+            % (entry.title, stored_channel.title)
+        logger.warning(msg)
+        return None
+
+    # URL は切り詰めると使えないため、保存できない長さのエントリは登録しない
+    if len(audio_url) > get_max_length(models.Episode, 'audio_url'):
+        msg = 'logue get_feeds. Episode %s in %s has a too long audio URL'\
+            % (entry.title, stored_channel.title)
+        logger.warning(msg)
+        return None
+
+    return audio_url
+
+
+def get_max_length(model, field_name):
+    """モデルの項目の最大文字数を返す."""
+    return model._meta.get_field(field_name).max_length
+
+
+def build_episode(entry, stored_channel, audio_url, render=True):
+    """フィードのエントリから未保存のエピソードを作る.
+
+    Arguments:
+        entry(json) -- パース済エントリ
+        stored_channel(quryset) -- Channelモデルインスタンス
+        audio_url(str) -- 音声ファイルURL
+        render(bool) -- False の場合、ShowNote を HTML に変換しない
+    Return:
+        episode(Episode) -- 未保存の Episode モデルインスタンス
+    """
+    db_entry = models.Episode(channel=stored_channel, audio_url=audio_url)
+
+    # 発行日時: 取得できない場合は登録日時とする
+    published_time = timezone.now()
+    # 日付データに変換する
+    if getattr(entry, 'published_parsed', None) is not None:
+        published_time = datetime.fromtimestamp(
+            mktime(entry.published_parsed))
+        try:
+            published_time = pytz.timezone(
+                settings.TIME_ZONE).localize(published_time, is_dst=None)
+        except pytz.exceptions.AmbiguousTimeError:
+            pytz_timezone = pytz.timezone(settings.TIME_ZONE)
+            published_time = pytz_timezone.localize(
+                published_time, is_dst=False)
+        now = timezone.now()
+        if published_time > now:
+            published_time = now
+    # 発行日時
+    db_entry.published_time = published_time
+
+    # タイトル: 'text/plain'の場合、htmlエスケープする
+    if entry.title_detail.type == 'text/plain':
+        db_entry.title = html.escape(entry.title)
+    else:
+        db_entry.title = entry.title
+
+    # リンク
+    if hasattr(entry, 'link'):
+        db_entry.link = entry.link
+    else:
+        db_entry.link = ''
+
+    # 収録時間
+    if hasattr(entry, 'itunes_duration'):
+        db_entry.duration = entry.itunes_duration
+    else:
+        db_entry.duration = ''
+
+    # エピソード説明: 'text/plain'の場合、htmlエスケープする
+    if hasattr(entry, 'description_detail')\
+            and entry.description_detail.type != 'text/plain':
+        db_entry.description = entry.description
+    else:
+        db_entry.description = html.escape(entry.description)
+    # 1 件の長すぎる値で一括登録全体が失敗しないよう、項目の長さに収める
+    for field in ('title', 'duration'):
+        value = getattr(db_entry, field)
+        max_length = get_max_length(models.Episode, field)
+        if len(value) > max_length:
+            logger.warning('logue get_feeds truncated %s of episode "%s"',
+                           field, audio_url)
+            setattr(db_entry, field, value[:max_length])
+    # リンクは切り詰めると使えないため、長すぎる場合は空にする
+    if len(db_entry.link) > get_max_length(models.Episode, 'link'):
+        logger.warning('logue get_feeds dropped too long link of episode "%s"',
+                       audio_url)
+        db_entry.link = ''
+
+    if render:
+        db_entry.description_html = render_markdown(db_entry.description)
+
+    return db_entry
@@ -1,50 +1,64 @@
 import logging
 
-import markdown
-from django.db.models import Count
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
 from django.http import JsonResponse
-from django.shortcuts import redirect, render
+from django.shortcuts import get_object_or_404, redirect, render
 from django.views import generic
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 
-from . import utils
+from . import jobs, locks
 from .forms import AddCollectionForm, ContactForm, SubscriptionForm
-from .models import (Channel, Collection, Episode, Like, MstCollection,
-                     Subscription)
+from .pagination import KeysetPaginationMixin
+from .normalize import feed_url_variants
+from .models import (Channel, Collection, Episode, Job, Like, MstCollection,
+                     Subscription, TrendingEpisode)
+from .scheduler import DEFAULT_INTERVAL
 
 logger = logging.getLogger(__name__)
 
 
-class IndexView(generic.ListView):
+def episode_item(episode):
+    """Ajax レスポンス用にエピソードの表示内容を返す."""
+    channel = episode.channel
+    return {
+        'id': str(episode.id),
+        'title': episode.title,
+        'published_time': episode.published_time,
+        'channel_id': str(channel.id),
+        'channel_title': channel.title,
+        'cover_image': (default_storage.url(channel.cover_image_60)
+                        if channel.cover_image else ''),
+    }
+
+
+class IndexView(KeysetPaginationMixin, generic.ListView):
     """トップページを表示する際のロジックを処理する."""
     model = Episode
     template_name = 'feed/index.html'
     context_object_name = 'episodes'
     paginate_by = 12
+    keyset_ordering = ('-published_time', '-id')
 
     def get_queryset(self):
-        return Episode.recently.recently_published()
+        return Episode.recently.recently_published().select_related('channel')
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        # 登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        # ログイン後であればコレクションタイトル取得
-        user = self.request.user
-        if hasattr(user, 'email'):
-            context['mst_collection'] = MstCollection.objects.filter(user=user)
-        # Like数の多いエピソードを取得
-        id_list = Like.objects.values('episode').annotate(
-            Count('episode')).order_by('-episode__count')[:10]
-        con_list = []
-        for item in id_list:
-            con_list.append(Episode.objects.get(id=item['episode']))
-        context['like_epsodes'] = con_list
+        # トレンドスコアの高いエピソードを取得
+        trending = TrendingEpisode.objects.select_related(
+            'episode__channel').order_by('-score')[:10]
+        context['like_epsodes'] = [item.episode for item in trending]
 
         return context
 
+    def get_ajax_item(self, obj):
+        return episode_item(obj)
+
 
 @require_POST
 class ChannelList(generic.DetailView):
@@ -91,18 +105,35 @@ def entry(request):
             logger.info('Required Feed URL does not match.')
             return render(request, 'feed/index.html')
 
-        try:
-            # すでに登録がある場合は既存データを表示する
-            channel = Channel.objects.get(feed_url=feed_url)
-            return redirect('feed:ch_detail', pk=channel.id)
-        except Channel.DoesNotExist:
-            logger.info('Save channel by required Feed URL %s.', feed_url)
-            # Feed URL をもとに新規登録
-            result = utils.get_feed(feed_url)
-            # 登録成功の場合, チャンネル詳細ページへリダイレクトする
-            if result == 'success':
-                channel = Channel.objects.get(feed_url=feed_url)
-                return redirect('feed:ch_detail', pk=channel.id)
+        # http/https、末尾のスラッシュ違い、正規化前の URL で登録済の場合も
+        # 既存データを表示する
+        variants = feed_url_variants(
+            feed_url, request.POST.get('require_url'))
+        with transaction.atomic():
+            # 同じ Feed URL の同時登録は 1 件ずつ処理し、後続は先行の登録結果を使う
+            locks.advisory_xact_lock(
+                'feed.entry:%s' % min(feed_url_variants(feed_url)))
+            channel = Channel.objects.filter(feed_url__in=variants).first()
+            created = False
+            if channel is None:
+                channel, created = Channel.objects.get_or_create(
+                    feed_url=feed_url,
+                    # 登録ジョブが完了するまで定期取得の対象にしない
+                    defaults={
+                        'next_poll_at': timezone.now() + DEFAULT_INTERVAL})
+            if not created and not channel.is_active:
+                # 取得を停止したチャンネルは、改めて登録を試みる.
+                # 登録ジョブと定期取得が同時に取得しないよう、次回取得日時を延ばす
+                logger.info('Reactivate channel %s.', feed_url)
+                Channel.objects.filter(pk=channel.pk).update(
+                    is_active=True, poll_error_count=0,
+                    next_poll_at=timezone.now() + DEFAULT_INTERVAL)
+            if created or not channel.is_active:
+                logger.info('Save channel by required Feed URL %s.', feed_url)
+                # フィードの取得・エピソード登録はバックグラウンドで行う
+                jobs.enqueue(Job.REGISTER_CHANNEL, channel,
+                             key='%s:%s' % (Job.REGISTER_CHANNEL, channel.pk))
+        return redirect('feed:ch_detail', pk=channel.id)
 
     # バリデートエラーの場合、トップページに戻る
     logger.warning('WARNING: Invalid feed URL.')
@@ -156,16 +187,12 @@ class ChannelDetailView(generic.DetailView):
         context = super().get_context_data(*args, **kwargs)
         user = self.request.user
 
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
         # エピソードリスト
         context['episodes'] = Episode.objects.filter(
             channel=context['channel']).order_by('-published_time')[:8]
 
         # ログイン済の場合、登録状況に応じたデータを返す
         if hasattr(user, 'email'):
-            # コレクション情報
-            context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
             # 講読情報
             context['subscription'] = Subscription.objects.filter(
                 channel=context['channel'], user=user)
@@ -185,21 +212,17 @@ class EpisodeDetailView(generic.DetailView):
     """
     model = Episode
     template_name = 'feed/ep_detail.html'
+    queryset = Episode.objects.select_related('channel')
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         user = self.request.user
 
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
         # ShowNote の内容を Markdown 形式で渡す
-        des = context['episode'].description
-        context['parsed_description'] = markdown.markdown(des)
+        context['parsed_description'] = context['episode'].get_description_html()
 
         # ログイン済の場合、登録状況に応じたデータを返す
         if hasattr(user, 'email'):
-            # コレクション情報
-            context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
             # コレクション追加フォーム
             col_form = AddCollectionForm()
             col_form.fields['add_collection'].queryset = MstCollection.objects.filter(user=user)
@@ -213,7 +236,7 @@ class EpisodeDetailView(generic.DetailView):
         return context
 
 
-class ChannelAllView(generic.ListView):
+class ChannelAllView(KeysetPaginationMixin, generic.ListView):
     """チャンネル一覧を表示する.
 
     Arguments:
@@ -226,25 +249,27 @@ class ChannelAllView(generic.ListView):
     model = Subscription
     template_name = 'feed/ch_all.html'
     context_object_name = 'subs'
-    ordering = '-modified'
+    paginate_by = 48
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
         return super(ChannelAllView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user)
+        return Subscription.objects.filter(
+            user=self.request.user).select_related('channel')
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        # コレクション情報
-        context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
-        return context
+    def get_ajax_item(self, obj):
+        channel = obj.channel
+        return {
+            'id': str(channel.id),
+            'title': channel.title,
+            'cover_image': (default_storage.url(channel.cover_image_145)
+                            if channel.cover_image else ''),
+        }
 
 
-class CollectionListView(generic.ListView):
+class CollectionListView(KeysetPaginationMixin, generic.ListView):
     """コレクション一覧を表示する.
 
     Arguments:
@@ -266,14 +291,11 @@ class CollectionListView(generic.ListView):
         qs = super().get_queryset()
         return qs.filter(user=self.request.user)
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        # 登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        return context
+    def get_ajax_item(self, obj):
+        return {'id': str(obj.id), 'title': obj.title}
 
 
-class CollectionDetailView(generic.ListView):
+class CollectionDetailView(KeysetPaginationMixin, generic.ListView):
     """コレクション詳細を表示する.
 
     Arguments:
@@ -292,21 +314,25 @@ class CollectionDetailView(generic.ListView):
         return super(CollectionDetailView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
+        # ログインユーザーのコレクションのみ表示する
+        self.mst = get_object_or_404(
+            MstCollection, id=self.kwargs['mst_coll_id'],
+            user=self.request.user)
         qs = super().get_queryset()
-        return qs.filter(mst_collection_id=self.kwargs['mst_coll_id'])
+        return qs.filter(mst_collection=self.mst).select_related(
+            'episode__channel', 'mst_collection')
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        # コレクション情報
-        context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
         # コレクションタイトル
-        context['title'] = context['collection'][0].mst_collection.title
+        context['title'] = self.mst.title
         return context
 
+    def get_ajax_item(self, obj):
+        return episode_item(obj.episode)
 
-class LikeListView(generic.ListView):
+
+class LikeListView(KeysetPaginationMixin, generic.ListView):
     """Likeされた全エピソードリストを表示する.
 
     Arguments:
@@ -325,15 +351,11 @@ class LikeListView(generic.ListView):
         return super(LikeListView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        return Like.objects.filter(user=self.request.user)
+        return Like.objects.filter(
+            user=self.request.user).select_related('episode__channel')
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        # コレクション情報
-        context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        return context
+    def get_ajax_item(self, obj):
+        return episode_item(obj.episode)
 
 
 class SettingsView(generic.TemplateView):
@@ -344,14 +366,6 @@ class SettingsView(generic.TemplateView):
     """
     template_name = 'feed/settings.html'
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        # コレクションタイトル
-        context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
-        # 登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        return context
-
 
 class TermsView(generic.TemplateView):
     """利用規約を表示する.
@@ -361,19 +375,6 @@ class TermsView(generic.TemplateView):
     """
     template_name = 'feed/terms.html'
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        user = self.request.user
-
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-
-        # ログイン後であればコレクションタイトル取得
-        if hasattr(user, 'email'):
-            context['mst_collection'] = MstCollection.objects.filter(user=user)
-
-        return context
-
 
 class PrivacyView(generic.TemplateView):
     """プラバシーポリシーを表示する.
@@ -383,19 +384,6 @@ class PrivacyView(generic.TemplateView):
     """
     template_name = 'feed/privacy.html'
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        user = self.request.user
-
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-
-        # ログイン後であればコレクションタイトル取得
-        if hasattr(user, 'email'):
-            context['mst_collection'] = MstCollection.objects.filter(user=user)
-
-        return context
-
 
 @require_GET
 @login_required
@@ -414,16 +402,25 @@ def change_like(request):
     # ユーザー情報、エピソード情報を取得
     episode = Episode.objects.get(id=query)
     user = request.user
-    # 登録 Like データ取得
-    like = Like.objects.filter(episode=episode, user=user)
-
-    # 登録の有無により、登録／解除を切り替える
-    if not like:
-        Like.objects.create(episode=episode, user=user)
-        response = {'liked': True}
-    else:
-        Like.objects.filter(episode=episode, user=user).delete()
-        response = {'liked': False}
+    with transaction.atomic():
+        # 登録の有無により、登録／解除を切り替える
+        like, created = Like.objects.get_or_create(episode=episode, user=user)
+        if created:
+            delta = 1
+            response = {'liked': True}
+        else:
+            # 同時に解除された場合に二重に減らさないよう、行をロックして削除し、
+            # 削除できた場合のみ Like 数を減らす
+            deleted = 0
+            if Like.objects.select_for_update().filter(pk=like.pk).exists():
+                deleted, _ = Like.objects.filter(pk=like.pk).delete()
+            delta = -1 if deleted else 0
+            response = {'liked': False}
+
+        # Like 数を更新する
+        if delta:
+            Episode.objects.filter(id=episode.id).update(
+                like_count=F('like_count') + delta)
 
     return JsonResponse(response)
 
@@ -508,13 +505,3 @@ class ContactView(generic.FormView):
     def form_valid(self, form):
         form.send_email()
         return super(ContactView, self).form_valid(form)
-
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        user = self.request.user
-        # ヘッダ部登録用フォーム
-        context['subscription_form'] = SubscriptionForm
-        # ログイン後であればコレクションタイトル取得
-        if hasattr(user, 'email'):
-            context['mst_collection'] = MstCollection.objects.filter(user=self.request.user)
-        return context